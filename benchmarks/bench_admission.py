@@ -0,0 +1,108 @@
+"""
+Всплеск трафика: burst пользователей одновременно пишут боту, сервер
+генерации обрабатывает не больше llm-slots запросов разом. Без контроля
+допуска все сообщения ждут общей очереди; с ним не больше max-concurrent
+прогонов RAG, очередь ограничена, лишние сразу получают ответ о перегрузке.
+Модели, Chroma, Telegram и LLM — заглушки.
+
+    python -m benchmarks.bench_admission --burst 200 --max-concurrent 8 --max-queue 32
+"""
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+import bot.handlers as handlers
+from services import rag_service
+from services.admission import AdmissionController, UserRateLimiter
+from benchmarks.bench_handler_pipeline import Fakes
+from benchmarks.common import save_results, summarize
+
+
+class Spike(Fakes):
+    def __init__(self, args):
+        super().__init__(args)
+        self.slots = asyncio.Semaphore(args.llm_slots)
+        self.replies = {}  # пользователь -> (задержка, текст) первого сообщения
+        self.answers = {}  # пользователь -> задержка ответа по существу
+
+    async def agenerate(self, payload, affinity=None, timeout=None):
+        # Сервер генерации с ограниченным числом слотов: лишние ждут на его стороне
+        async with self.slots:
+            await asyncio.sleep(self.args.llm_ms / 1000)
+        return "Ответ"
+
+
+def make_update(fakes, user_id, started):
+    async def reply_text(text, reply_markup=None):
+        # Первая реакция — любое сообщение пользователю (позиция в очереди тоже)
+        latency = time.perf_counter() - started
+        fakes.replies.setdefault(user_id, (latency, text))
+        if text.startswith("Ответ"):
+            fakes.answers[user_id] = latency
+
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, first_name="Тест", last_name=None, username=None),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(text=f"Вопрос номер {user_id} про паркинг", reply_text=reply_text),
+    )
+
+
+async def spike(args, enabled):
+    fakes = Spike(args)
+    handlers.ADMISSION_ENABLED = enabled
+    handlers.admission = AdmissionController(args.max_concurrent, args.max_queue)
+    handlers.rate_limiter = UserRateLimiter()
+    rag_service.generation_client = SimpleNamespace(agenerate=fakes.agenerate)
+    context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=fakes.send_chat_action))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        handlers.handle_message(make_update(fakes, user_id, started), context, fakes, fakes)
+        for user_id in range(args.burst)
+    ))
+    elapsed = time.perf_counter() - started
+
+    answered = list(fakes.answers.values())
+    first_reply = [latency for latency, _ in fakes.replies.values()]
+    stats = handlers.admission.stats()
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "answered": len(answered),
+        "answer_latency": summarize(answered),
+        "first_reply_latency": summarize(first_reply),
+        "shed": stats["shed"] if enabled else {},
+        "wait": stats["wait"] if enabled else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=200)
+    parser.add_argument("--max-concurrent", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--llm-slots", type=int, default=8)
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--chatwoot-ms", type=float, default=0)
+    parser.add_argument("--telegram-ms", type=float, default=60)
+    parser.add_argument("--retrieval-ms", type=float, default=80)
+    parser.add_argument("--pair-ms", type=float, default=0.2, help="стоимость одной пары cross-encoder")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    handlers.CHATWOOT_ENABLED = False
+    rag_service.faq.faq_index = None
+
+    results = {}
+    for name, enabled in (("unbounded", False), ("admission", True)):
+        row = asyncio.run(spike(args, enabled))
+        results[name] = row
+        print(f"{name:<10} отвечено {row['answered']:>4} из {args.burst}, ответ p50 {row['answer_latency'].get('p50_ms')} мс, "
+              f"p95 {row['answer_latency'].get('p95_ms')} мс; первая реакция p95 {row['first_reply_latency'].get('p95_ms')} мс; "
+              f"сброшено {row['shed']}")
+    save_results(args.output, "admission", results)
+
+
+if __name__ == "__main__":
+    main()
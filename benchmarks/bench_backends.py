@@ -0,0 +1,100 @@
+"""
+Задержка, пропускная способность и RSS эмбеддера и cross-encoder'а для
+каждого бэкенда инференса (torch, onnx, onnx-int8). Каждый бэкенд
+запускается в отдельном процессе, чтобы RSS не смешивался.
+
+    python -m benchmarks.bench_backends --backends torch,onnx,onnx-int8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+from config import EMBED_MODEL_PATH, RERANKER_PATH, ONNX_DIR_NAME, ONNX_NUM_THREADS
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize, timed
+
+
+def rss_mb():
+    """Текущий RSS процесса в МБ (Linux), иначе пиковый"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, repeat, pairs_per_query):
+    from services.inference_backends import load_embeddings, load_cross_encoder
+
+    kwargs = {} if backend == "torch" else {"onnx_dir": ONNX_DIR_NAME, "num_threads": ONNX_NUM_THREADS}
+    baseline_rss = rss_mb()
+    started = time.perf_counter()
+    embeddings = load_embeddings(backend, EMBED_MODEL_PATH, **kwargs)
+    reranker = load_cross_encoder(backend, RERANKER_PATH, **kwargs)
+    load_time = time.perf_counter() - started
+    loaded_rss = rss_mb()
+
+    passages = [" ".join(SAMPLE_QUESTIONS) * 3] * pairs_per_query
+    embeddings.embed_query(SAMPLE_QUESTIONS[0])
+    reranker.predict([(SAMPLE_QUESTIONS[0], passages[0])])
+
+    embed_latencies = []
+    rerank_latencies = []
+    for i in range(repeat):
+        question = SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]
+        _, latency = timed(embeddings.embed_query, question)
+        embed_latencies.extend(latency)
+        _, latency = timed(reranker.predict, [(question, passage) for passage in passages])
+        rerank_latencies.extend(latency)
+
+    return {
+        "backend": backend,
+        "load_s": round(load_time, 2),
+        "rss_models_mb": round(loaded_rss - baseline_rss, 1),
+        "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "embed_query": summarize(embed_latencies),
+        "embed_qps": round(len(embed_latencies) / sum(embed_latencies), 1),
+        "rerank": summarize(rerank_latencies),
+        "rerank_pairs_per_s": round(len(rerank_latencies) * pairs_per_query / sum(rerank_latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--pairs", type=int, default=50, help="пар на один вызов реранкера")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.repeat, args.pairs)))
+        return
+
+    results = []
+    for backend in args.backends.split(","):
+        command = [sys.executable, "-m", "benchmarks.bench_backends", "--worker", backend,
+                   "--repeat", str(args.repeat), "--pairs", str(args.pairs)]
+        completed = subprocess.run(command, capture_output=True, text=True, env=os.environ.copy())
+        if completed.returncode != 0:
+            print(f"{backend}: ошибка\n{completed.stderr[-2000:]}")
+            continue
+        row = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(row)
+        print(
+            f"{backend:>10}: загрузка {row['load_s']} с, RSS моделей {row['rss_models_mb']} МБ, "
+            f"embed p50 {row['embed_query']['p50_ms']} мс ({row['embed_qps']} q/s), "
+            f"rerank x{args.pairs} p50 {row['rerank']['p50_ms']} мс ({row['rerank_pairs_per_s']} пар/с)"
+        )
+    save_results(args.output, "inference_backends", results)
+
+
+if __name__ == "__main__":
+    main()
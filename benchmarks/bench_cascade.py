@@ -0,0 +1,93 @@
+"""
+Каскадный реранкинг против полного: среднее число оценённых пар на запрос,
+задержка реранкинга и совпадение top-3 с полным реранкингом k=50.
+
+    python -m benchmarks.bench_cascade --questions questions.txt
+"""
+import time
+import argparse
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import CrossEncoder
+
+from config import (
+    CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, EMBED_MODEL_PATH, RERANKER_PATH,
+    RERANK_CASCADE_FIRST_SLICE, RERANK_CASCADE_STEP, RERANK_CASCADE_MAX_DEPTH,
+    RERANK_CASCADE_CONFIDENT_SCORE, RERANK_CASCADE_MARGIN
+)
+from services.cascade_reranker import CascadeReranker
+from services.rag_service import rerank_documents
+from services.utils import clean_text
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="файл с вопросами, по одному на строку")
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--first-slice", type=int, default=RERANK_CASCADE_FIRST_SLICE)
+    parser.add_argument("--step", type=int, default=RERANK_CASCADE_STEP)
+    parser.add_argument("--max-depth", type=int, default=RERANK_CASCADE_MAX_DEPTH)
+    parser.add_argument("--confident-score", type=float, default=RERANK_CASCADE_CONFIDENT_SCORE)
+    parser.add_argument("--margin", type=float, default=RERANK_CASCADE_MARGIN)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    questions = SAMPLE_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL_PATH, model_kwargs={"device": "cpu"})
+    vectorstore = Chroma(client=client, collection_name=COLLECTION_NAME, embedding_function=embeddings)
+    retriever = vectorstore.as_retriever(search_kwargs={"k": args.k})
+    cross_encoder = CrossEncoder(RERANKER_PATH)
+    cascade = CascadeReranker(
+        cross_encoder,
+        first_slice=args.first_slice,
+        step=args.step,
+        max_depth=args.max_depth,
+        confident_score=args.confident_score,
+        margin=args.margin
+    )
+
+    full_latencies, cascade_latencies = [], []
+    full_pairs = 0
+    top3_agreement = 0
+    for raw_question in questions:
+        question = clean_text(raw_question)
+        docs = retriever.get_relevant_documents(question)
+
+        started = time.perf_counter()
+        full = rerank_documents(question, docs, cross_encoder)
+        full_latencies.append(time.perf_counter() - started)
+        full_pairs += len(docs)
+
+        started = time.perf_counter()
+        fast = rerank_documents(question, docs, cascade)
+        cascade_latencies.append(time.perf_counter() - started)
+
+        full_top = {doc.page_content for doc, _ in full[:3]}
+        fast_top = {doc.page_content for doc, _ in fast[:3]}
+        top3_agreement += len(full_top & fast_top) / max(1, len(full_top))
+
+    results = {
+        "full": {"avg_pairs": full_pairs / len(questions), "latency": summarize(full_latencies)},
+        "cascade": {"avg_pairs": cascade.average_pairs, "latency": summarize(cascade_latencies)},
+        "top3_agreement": round(top3_agreement / len(questions), 3),
+    }
+    for name in ("full", "cascade"):
+        row = results[name]
+        print(
+            f"{name:>8}: пар на запрос {row['avg_pairs']:.1f}, "
+            f"p50 {row['latency']['p50_ms']} мс, p95 {row['latency']['p95_ms']} мс"
+        )
+    print(f"Совпадение top-3 с полным реранкингом: {results['top3_agreement']:.3f}")
+    save_results(args.output, "cascade_rerank", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Микробенчмарк очистки текста на типичных русских чанках: прежняя
+реализация clean_text (две регулярки, NFKC, encode/decode), новая
+(translate + быстрый путь) и кэш очищенных документов по 50 чанкам.
+
+    python -m benchmarks.bench_clean_text
+"""
+import re
+import time
+import argparse
+import unicodedata
+
+from langchain_core.documents import Document
+
+from services.utils import clean_text, clean_document
+from benchmarks.common import save_results, summarize
+
+PARAGRAPH = (
+    "ЖК «Южане» — квартал комфорт-класса в 15 минутах от центра. Квартира № 105, 2 комнаты, "
+    "площадь 58,4 м², 7 этаж, стоимость 6 450 000 ₽. Отделка «white box», высота потолков 2,8 м. "
+    "Офис продаж: ул. Ленина, 1, ежедневно с 9:00 до 20:00, тел. +7 (800) 555-35-35. "
+    "Информация не является публичной офертой."
+)
+
+
+def legacy_clean_text(text):
+    cleaned = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', ' ', text)
+    cleaned = re.sub(r'[\ud800-\udfff]', '', cleaned)
+    cleaned = unicodedata.normalize('NFKC', cleaned)
+    return cleaned.encode('utf-8', 'ignore').decode('utf-8')
+
+
+def make_chunks(count):
+    chunks = []
+    for i in range(count):
+        text = f"{PARAGRAPH} Корпус {i % 5 + 1}. " * 4
+        if i % 3 == 0:
+            text = text.replace(" ", " ", 3)  # неразрывные пробелы из PDF
+        if i % 7 == 0:
+            text += "\x0c\x07"  # управляющие символы после парсинга
+        chunks.append(text)
+    return chunks
+
+
+def bench(fn, chunks, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for chunk in chunks:
+            fn(chunk)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    assert all(legacy_clean_text(chunk) == clean_text(chunk) for chunk in chunks)
+    clean_chunks = [clean_text(chunk) for chunk in chunks]
+    documents = [Document(page_content=chunk) for chunk in chunks]
+
+    results = {
+        "legacy": bench(legacy_clean_text, chunks, args.repeat),
+        "new_raw": bench(clean_text, chunks, args.repeat),
+        "new_already_clean": bench(clean_text, clean_chunks, args.repeat),
+        "clean_document_cached": bench(clean_document, documents, args.repeat),
+    }
+    for name, row in results.items():
+        print(f"{name:>22}: {args.chunks} чанков p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс")
+    save_results(args.output, "clean_text", results)
+
+
+if __name__ == "__main__":
+    main()
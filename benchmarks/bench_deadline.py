@@ -0,0 +1,105 @@
+"""
+RAG-пайплайн с дедлайном ответа против пайплайна без него при медленном
+поиске и перегруженном реранкере. Модели, Chroma и LLM заменены заглушками:
+в доле запросов поиск (slow-retrieval-rate) или оценка пар (slow-rerank-rate)
+замедляются в slow-factor раз. Сравниваются хвост задержки ответа и набор
+применённых деградаций.
+
+    python -m benchmarks.bench_deadline --requests 100 --slow-rerank-rate 0.2 --deadline 4
+"""
+import time
+import random
+import asyncio
+import logging
+import argparse
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from services import rag_service
+from services.deadline import degradation_stats
+from services.utils import user_question_history
+from benchmarks.common import save_results, summarize
+
+
+class SlowFakes:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.docs = [Document(page_content=f"Чанк {i} о жилом комплексе", id=str(i)) for i in range(args.k)]
+        self.slow_retrieval = self.slow_rerank = False
+
+    def predict(self, pairs):
+        factor = self.args.slow_factor if self.slow_rerank else 1.0
+        time.sleep(self.args.pair_ms * len(pairs) * factor / 1000)
+        return [random.random() for _ in pairs]
+
+    async def aget_relevant_documents(self, query, k=None):
+        factor = self.args.slow_factor if self.slow_retrieval else 1.0
+        await asyncio.sleep(self.args.retrieval_ms * factor / 1000)
+        return self.docs[:k or self.args.k]
+
+    async def agenerate(self, payload, affinity=None, timeout=None):
+        # Префилл пропорционален длине контекста
+        seconds = self.args.llm_ms / 1000 * (0.5 + 0.5 * len(payload["prompt"]) / self.full_prompt)
+        if timeout is not None and seconds > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError("LLM не уложилась в бюджет")
+        await asyncio.sleep(seconds)
+        return "Ответ"
+
+
+async def run(fakes, args, enabled):
+    rag_service.DEADLINE_ENABLED = enabled
+    rag_service.rerank_cost.per_pair = None
+    degradation_stats.__init__()
+    latencies = []
+    for i in range(args.requests):
+        fakes.slow_retrieval = fakes.random.random() < args.slow_retrieval_rate
+        fakes.slow_rerank = fakes.random.random() < args.slow_rerank_rate
+        user_question_history.pop(i, None)
+        started = time.perf_counter()
+        await rag_service.process_question(i, "Сколько стоит двухкомнатная квартира?", fakes, fakes)
+        latencies.append(time.perf_counter() - started)
+    return {**summarize(latencies), **degradation_stats.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--retrieval-ms", type=float, default=80)
+    parser.add_argument("--pair-ms", type=float, default=4, help="стоимость одной пары cross-encoder")
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--slow-retrieval-rate", type=float, default=0.05, help="доля запросов с медленным поиском")
+    parser.add_argument("--slow-rerank-rate", type=float, default=0.2, help="доля запросов с перегруженным реранкером")
+    parser.add_argument("--slow-factor", type=float, default=20)
+    parser.add_argument("--deadline", type=float, default=4, help="ANSWER_DEADLINE, секунды")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)  # деградации логируются на каждый запрос
+
+    fakes = SlowFakes(args)
+    fakes.full_prompt = len(rag_service.build_prompt(0, fakes.docs, "вопрос", layout="default"))
+    rag_service.generation_client = SimpleNamespace(agenerate=fakes.agenerate)
+    rag_service.faq.faq_index = None
+    rag_service.ANSWER_DEADLINE = args.deadline
+    # Бюджеты этапов в той же пропорции, что и по умолчанию для дедлайна 30 с
+    rag_service.DEADLINE_FOLLOWUP_BUDGET = args.deadline / 30
+    rag_service.DEADLINE_RETRIEVAL_BUDGET = args.deadline / 10
+    rag_service.DEADLINE_RERANK_BUDGET = args.deadline * 2 / 15
+    rag_service.DEADLINE_LLM_MIN = args.deadline / 3
+
+    results = {}
+    for name, enabled in (("without_deadline", False), ("with_deadline", True)):
+        fakes.random.seed(args.seed)
+        row = asyncio.run(run(fakes, args, enabled))
+        results[name] = row
+        print(f"{name:<17} p50 {row['p50_ms']:>8} мс, p95 {row['p95_ms']:>8} мс, p99 {row['p99_ms']:>8} мс, "
+              f"с деградациями {row['degraded_rate']:.0%} {row['degradations']}")
+    save_results(args.output, "deadline", results)
+
+
+if __name__ == "__main__":
+    main()
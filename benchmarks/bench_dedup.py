@@ -0,0 +1,71 @@
+"""
+Схлопывание почти одинаковых чанков: сколько кандидатов отбрасывается,
+сколько стоит проверка и сколько времени реранкинга она экономит.
+
+    python -m benchmarks.bench_dedup --max-distance 3
+"""
+import time
+import argparse
+
+import chromadb
+from langchain_chroma import Chroma
+
+from config import (
+    CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, EMBED_MODEL_PATH, RERANKER_PATH,
+    INFERENCE_BACKEND, ONNX_DIR_NAME
+)
+from services.dedup import NearDuplicateFilter
+from services.inference_backends import load_models
+from services.rag_service import rerank_documents
+from services.utils import clean_text
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--max-distance", type=int, default=3)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    embeddings, reranker = load_models(INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, **kwargs)
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+    vectorstore = Chroma(client=client, collection_name=COLLECTION_NAME, embedding_function=embeddings)
+    retriever = vectorstore.as_retriever(search_kwargs={"k": args.k})
+    dedup = NearDuplicateFilter(max_distance=args.max_distance)
+
+    check_cold, check_warm, full_rerank, dedup_rerank = [], [], [], []
+    for raw_question in SAMPLE_QUESTIONS:
+        question = clean_text(raw_question)
+        docs = retriever.get_relevant_documents(question)
+
+        started = time.perf_counter()
+        dedup.collapse(docs)
+        check_cold.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        kept, _ = dedup.collapse(docs)
+        check_warm.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        rerank_documents(question, docs, reranker)
+        full_rerank.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        rerank_documents(question, kept, reranker)
+        dedup_rerank.append(time.perf_counter() - started)
+
+    results = {
+        "avg_dropped": round(dedup.dropped / dedup.queries, 2),
+        "check_cold": summarize(check_cold),
+        "check_warm": summarize(check_warm),
+        "rerank_full": summarize(full_rerank),
+        "rerank_dedup": summarize(dedup_rerank),
+    }
+    print(f"Отброшено дублей в среднем: {results['avg_dropped']} из {args.k}")
+    print(f"Проверка: холодный кэш p50 {results['check_cold']['p50_ms']} мс, тёплый p50 {results['check_warm']['p50_ms']} мс")
+    print(f"Реранкинг: без дедупликации p50 {results['rerank_full']['p50_ms']} мс, с ней p50 {results['rerank_dedup']['p50_ms']} мс")
+    save_results(args.output, "dedup", results)
+
+
+if __name__ == "__main__":
+    main()
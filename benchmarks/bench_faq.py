@@ -0,0 +1,72 @@
+"""
+Задержка поиска по FAQ в зависимости от числа формулировок (одно умножение
+матрицы на вектор) и проверка горячей перезагрузки файла. Эмбеддер по
+умолчанию — HashEmbeddings, чтобы замерять сам поиск; --real берёт модель
+из EMBED_MODEL_PATH.
+
+    python -m benchmarks.bench_faq --sizes 10 100 1000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+
+from services.faq import FaqIndex
+from benchmarks.common import HashEmbeddings, SAMPLE_QUESTIONS, save_results, summarize, timed
+
+
+def write_faq(path, size):
+    entries = [
+        {"questions": [f"{question} вариант {i}" for question in SAMPLE_QUESTIONS[:3]], "answer": f"Ответ {i}"}
+        for i in range(max(1, size // 3))
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--real", action="store_true", help="настоящий эмбеддер вместо HashEmbeddings")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    if args.real:
+        from config import INFERENCE_BACKEND, EMBED_MODEL_PATH
+        from services.inference_backends import load_embeddings
+        embeddings = load_embeddings(INFERENCE_BACKEND, EMBED_MODEL_PATH)
+    else:
+        embeddings = HashEmbeddings()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "faq.json")
+        for size in args.sizes:
+            write_faq(path, size)
+            index = FaqIndex(path, embeddings, threshold=0.9, reload_interval=3600)
+            questions = [f"{SAMPLE_QUESTIONS[0]} вариант {size // 6}", "Совсем другой вопрос про ипотеку"]
+            _, latencies = timed(lambda: [index.match(q) for q in questions], repeat=args.repeat)
+            row = {"formulations": len(index.entry_of), "hit_rate": round(index.hit_rate, 3), **summarize([l / 2 for l in latencies])}
+            results.append(row)
+            print(f"формулировок {row['formulations']:>5}: p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс на вопрос")
+
+        # Горячая перезагрузка: новая запись находится после изменения файла
+        index = FaqIndex(path, embeddings, threshold=0.9, reload_interval=0)
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        entries.append({"questions": ["парковка для гостей"], "answer": "Гостевая парковка у главного входа."})
+        time.sleep(0.01)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.utime(path, None)
+        answer, score = index.match("парковка для гостей")
+        print(f"после правки файла: {'найден новый ответ' if answer else 'ответ не найден'} (сходство {score:.3f})")
+        results.append({"hot_reload": bool(answer)})
+
+    save_results(args.output, "faq", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Сквозная задержка обработчика сообщения: последовательные этапы (как было)
+против графа асинхронных этапов (поиск параллельно с проверкой уточняющего
+вопроса, Chatwoot и "печатает..." параллельно с RAG). Внешние сервисы и
+модели заменены заглушками с задаваемыми задержками, поэтому замеряется
+именно оркестрация.
+
+    python -m benchmarks.bench_handler_pipeline --llm-ms 1500 --chatwoot-ms 120
+"""
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+from collections import deque
+
+from langchain_core.documents import Document
+
+import bot.handlers as handlers
+from services import rag_service
+from services.utils import user_states, user_question_history
+from benchmarks.common import save_results, summarize
+
+USER_ID = 1
+
+
+class Fakes:
+    def __init__(self, args):
+        self.args = args
+        self.docs = [Document(page_content=f"Чанк {i} о жилом комплексе", id=str(i)) for i in range(args.k)]
+
+    # Chatwoot (синхронные HTTP-вызовы)
+    def send_message_to_chatwoot(self, *args, **kwargs):
+        time.sleep(self.args.chatwoot_ms / 1000)
+        return True
+
+    # Telegram
+    async def send_chat_action(self, **kwargs):
+        await asyncio.sleep(self.args.telegram_ms / 1000)
+
+    async def reply_text(self, text):
+        await asyncio.sleep(self.args.telegram_ms / 1000)
+
+    # Модели и поиск
+    def predict(self, pairs):
+        time.sleep(self.args.pair_ms * len(pairs) / 1000)
+        return [0.1] * len(pairs)
+
+    async def aget_relevant_documents(self, query, k=None):
+        await asyncio.sleep(self.args.retrieval_ms / 1000)
+        return self.docs[:k or self.args.k]
+
+    async def agenerate(self, payload, affinity=None, timeout=None):
+        await asyncio.sleep(self.args.llm_ms / 1000)
+        return "Ответ"
+
+
+def reset_user():
+    user_states[USER_ID] = {"with_agent": False, "conversation_id": 1, "contact_id": 1, "history_sent": True}
+    # Четыре прошлых вопроса: проверка уточнения делает четыре вызова cross-encoder
+    user_question_history[USER_ID] = deque([f"Прошлый вопрос {i}" for i in range(4)], maxlen=4)
+
+
+async def sequential(fakes, question):
+    """Порядок этапов до изменения: всё по очереди"""
+    fakes.send_message_to_chatwoot()
+    await fakes.send_chat_action()
+    for prev in list(user_question_history[USER_ID]):
+        fakes.predict([(question, prev)])
+    docs = await fakes.aget_relevant_documents(question)
+    fakes.predict([(question, doc.page_content) for doc in docs])
+    await fakes.agenerate({})
+    await fakes.reply_text("")
+    fakes.send_message_to_chatwoot()
+
+
+async def pipelined(fakes, question, update, context):
+    await handlers.handle_message(update, context, fakes, fakes)
+
+
+async def measure(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        reset_user()
+        started = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--chatwoot-ms", type=float, default=120)
+    parser.add_argument("--telegram-ms", type=float, default=60)
+    parser.add_argument("--retrieval-ms", type=float, default=80)
+    parser.add_argument("--pair-ms", type=float, default=4, help="стоимость одной пары cross-encoder")
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    fakes = Fakes(args)
+    handlers.CHATWOOT_ENABLED = True
+    handlers.send_message_to_chatwoot = fakes.send_message_to_chatwoot
+    rag_service.generation_client = SimpleNamespace(agenerate=fakes.agenerate)
+    rag_service.faq.faq_index = None
+
+    question = "Сколько стоит двухкомнатная квартира?"
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=USER_ID, first_name="Тест", last_name=None, username=None),
+        effective_chat=SimpleNamespace(id=USER_ID),
+        message=SimpleNamespace(text=question, reply_text=fakes.reply_text),
+    )
+    context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=fakes.send_chat_action))
+
+    async def run():
+        return {
+            "sequential": await measure(lambda: sequential(fakes, question), args.repeat),
+            "pipelined": await measure(lambda: pipelined(fakes, question, update, context), args.repeat),
+        }
+
+    results = asyncio.run(run())
+    before, after = results["sequential"]["p50_ms"], results["pipelined"]["p50_ms"]
+    results["reduction_pct"] = round((1 - after / before) * 100, 1)
+    print(f"последовательно: p50 {before} мс")
+    print(f"граф этапов    : p50 {after} мс (−{results['reduction_pct']}%)")
+    save_results(args.output, "handler_pipeline", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Сравнение реранкинга: плотный поиск k=50 против гибридного BM25 + RRF с
+меньшим числом кандидатов. Замеряет задержку cross-encoder и hit rate.
+
+Файл оценки — JSONL, по строке на вопрос:
+    {"question": "Сколько стоит квартира 105?", "expected": "105"}
+Вопрос считается отвеченным, если expected (без учёта регистра) встречается
+в одном из первых --hit-at документов после реранкинга.
+
+    python -m benchmarks.bench_hybrid --eval eval.jsonl --top-n 10,20,30
+"""
+import json
+import time
+import argparse
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import CrossEncoder
+
+from config import CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, EMBED_MODEL_PATH, RERANKER_PATH
+from services.hybrid_search import BM25Index, HybridRetriever
+from services.rag_service import rerank_documents
+from services.utils import clean_text
+from benchmarks.common import save_results, summarize
+
+
+def load_eval(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(name, retriever, reranker, questions, hit_at):
+    rerank_latencies = []
+    candidates = 0
+    hits = 0
+    for item in questions:
+        question = clean_text(item["question"])
+        docs = retriever.get_relevant_documents(question)
+        candidates += len(docs)
+        started = time.perf_counter()
+        ranked = rerank_documents(question, docs, reranker)
+        rerank_latencies.append(time.perf_counter() - started)
+        expected = item["expected"].lower()
+        if any(expected in doc.page_content.lower() for doc, _ in ranked[:hit_at]):
+            hits += 1
+    row = {
+        "setup": name,
+        "avg_candidates": round(candidates / len(questions), 1),
+        "hit_rate": round(hits / len(questions), 3),
+        "rerank": summarize(rerank_latencies),
+    }
+    print(
+        f"{name:>16}: кандидатов {row['avg_candidates']:>5}, hit@{hit_at} {row['hit_rate']:.3f}, "
+        f"реранкинг p50 {row['rerank']['p50_ms']} мс, p95 {row['rerank']['p95_ms']} мс"
+    )
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval", required=True, help="JSONL с вопросами и ожидаемыми фрагментами")
+    parser.add_argument("--dense-k", type=int, default=50)
+    parser.add_argument("--lexical-k", type=int, default=50)
+    parser.add_argument("--top-n", default="10,20,30", help="варианты числа кандидатов после RRF")
+    parser.add_argument("--hit-at", type=int, default=5)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    questions = load_eval(args.eval)
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL_PATH, model_kwargs={"device": "cpu"})
+    vectorstore = Chroma(client=client, collection_name=COLLECTION_NAME, embedding_function=embeddings)
+    reranker = CrossEncoder(RERANKER_PATH)
+    dense = vectorstore.as_retriever(search_kwargs={"k": args.dense_k})
+    bm25_index = BM25Index.from_collection(client.get_collection(COLLECTION_NAME))
+
+    results = [evaluate(f"dense k={args.dense_k}", dense, reranker, questions, args.hit_at)]
+    for top_n in [int(n) for n in args.top_n.split(",")]:
+        hybrid = HybridRetriever(dense, bm25_index, lexical_k=args.lexical_k, top_n=top_n)
+        results.append(evaluate(f"hybrid top={top_n}", hybrid, reranker, questions, args.hit_at))
+    save_results(args.output, "hybrid_rerank", results)
+
+
+if __name__ == "__main__":
+    main()
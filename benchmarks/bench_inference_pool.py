@@ -0,0 +1,74 @@
+"""
+Масштабирование пропускной способности реранкинга при росте числа
+процессов пула инференса от 1 до N. Для сравнения замеряется и режим без
+пула (модели в текущем процессе).
+
+    python -m benchmarks.bench_inference_pool --max-workers 8
+"""
+import time
+import argparse
+import threading
+from functools import partial
+
+from config import INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, ONNX_DIR_NAME
+from services.inference_backends import load_models
+from services.inference_pool import InferencePool, PooledCrossEncoder
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize
+
+
+def drive(reranker, clients, requests_per_client, pairs):
+    latencies = []
+    lock = threading.Lock()
+    passage = " ".join(SAMPLE_QUESTIONS) * 3
+
+    def client(seed):
+        local = []
+        for i in range(requests_per_client):
+            question = SAMPLE_QUESTIONS[(seed + i) % len(SAMPLE_QUESTIONS)]
+            started = time.perf_counter()
+            reranker.predict([(question, passage)] * pairs)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {"qps": round(len(latencies) / elapsed, 2), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=10, help="запросов на клиента")
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    loader = partial(load_models, INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, **kwargs)
+    preload = INFERENCE_BACKEND == "torch"
+    results = []
+
+    levels = sorted({1, 2, 4, 8, 16, args.max_workers} & set(range(1, args.max_workers + 1)))
+    for workers in levels:
+        pool = InferencePool(loader, workers=workers, preload=preload)
+        row = {"workers": workers, **drive(PooledCrossEncoder(pool), workers * 2, args.requests, args.pairs)}
+        pool.close()
+        results.append(row)
+        print(f"воркеров {workers:>3}: {row['qps']:>7} запросов/с, p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс")
+
+    # Без пула: один процесс, общий GIL и пул потоков PyTorch
+    _, reranker = loader()
+    row = {"workers": 0, **drive(reranker, 2, args.requests, args.pairs)}
+    results.append(row)
+    print(f"без пула    : {row['qps']:>7} запросов/с, p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс")
+    save_results(args.output, "inference_pool", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Балансировка клиента генерации по нескольким локальным фейковым репликам:
+равномерность распределения, веса для разного железа и переключение при
+отказе реплики с возвратом в ротацию после проверки здоровья.
+
+    python -m benchmarks.bench_llm_balancing --replicas 3 --requests 300
+"""
+import time
+import argparse
+
+from services.llm_client import GenerationClient
+from benchmarks.common import FakeEndpoint, save_results
+from benchmarks.bench_llm_client import drive
+
+PAYLOAD = {"prompt": "Сколько квартир в доме?", "max_new_tokens": 32}
+
+
+def shares(client, before=None):
+    """Доля запросов каждой реплики (с момента снимка before)"""
+    counts = [endpoint.requests - (before[i] if before else 0) for i, endpoint in enumerate(client.endpoints)]
+    total = sum(counts) or 1
+    return [round(count / total * 100, 1) for count in counts]
+
+
+def snapshot(client):
+    return [endpoint.requests for endpoint in client.endpoints]
+
+
+def make_client(servers, weights, **kwargs):
+    spec = ", ".join(f"{server.url} {weight}" for server, weight in zip(servers, weights))
+    return GenerationClient(spec, read_timeout=5, total_timeout=10, pool_size=64, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--base-delay", type=float, default=0.05)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    results = {}
+
+    # Одинаковые реплики: доли должны быть близки к 1 / replicas
+    servers = [FakeEndpoint(args.base_delay, tail_rate=0.0, seed=i) for i in range(args.replicas)]
+    client = make_client(servers, [1] * args.replicas)
+    row = drive(lambda: client.generate(PAYLOAD), args.requests, args.concurrency)
+    row["shares_pct"] = shares(client)
+    results["equal"] = row
+    print(f"одинаковые реплики: доли {row['shares_pct']}%, p50 {row['p50_ms']} мс, ошибок {row['errors']}")
+    client.close()
+
+    # Разное железо: первая реплика вдвое быстрее и имеет вес 2
+    servers[0].base_delay = args.base_delay / 2
+    client = make_client(servers, [2] + [1] * (args.replicas - 1))
+    row = drive(lambda: client.generate(PAYLOAD), args.requests, args.concurrency)
+    row["shares_pct"] = shares(client)
+    results["weighted"] = row
+    print(f"веса 2:1:..: доли {row['shares_pct']}%, p50 {row['p50_ms']} мс, ошибок {row['errors']}")
+    client.close()
+    servers[0].base_delay = args.base_delay
+
+    # Отказ: реплика 0 падает посреди нагрузки, затем поднимается и возвращается в ротацию
+    client = make_client(servers, [1] * args.replicas, breaker_failures=3, breaker_reset=1.0, health_interval=0.3)
+    phases = {}
+    for phase, mode in (("before", "ok"), ("down", "down"), ("restored", "ok")):
+        servers[0].mode = mode
+        if phase == "restored":
+            time.sleep(1.5)  # проверка здоровья и полуоткрытый автомат возвращают реплику
+        before = snapshot(client)
+        row = drive(lambda: client.generate(PAYLOAD), args.requests, args.concurrency)
+        row["shares_pct"] = shares(client, before)
+        row["replica0_healthy"] = client.endpoints[0].healthy
+        phases[phase] = row
+        print(f"отказ, фаза {phase:<9}: доли {row['shares_pct']}%, p95 {row['p95_ms']} мс, ошибок {row['errors']}")
+    stats = client.stats()
+    phases["retries"] = stats["retries"]
+    results["failover"] = phases
+    print(f"повторов на другие реплики: {stats['retries']}")
+    client.close()
+
+    for server in servers:
+        server.server.shutdown()
+    save_results(args.output, "llm_balancing", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Клиент генерации против локального фейкового эндпоинта с внедрённой
+медлительностью: голый requests.post против пула соединений и
+хеджирования, а также поведение при зависании и отказе эндпоинта.
+
+    python -m benchmarks.bench_llm_client --requests 200 --tail-rate 0.03 --tail-delay 3
+"""
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from services.llm_client import GenerationClient, GenerationError
+from benchmarks.common import FakeEndpoint, save_results, summarize
+
+
+def drive(call, total, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            with lock:
+                errors += 1
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+    return {"errors": errors, "qps": round(total / elapsed, 2), **summarize(latencies)}
+
+
+def report(name, row):
+    print(f"{name:<28} p50 {row['p50_ms']:>8} мс, p95 {row['p95_ms']:>8} мс, p99 {row['p99_ms']:>8} мс, ошибок {row['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-delay", type=float, default=0.05)
+    parser.add_argument("--tail-rate", type=float, default=0.03, help="доля медленных ответов (хеджирование срабатывает на p95)")
+    parser.add_argument("--tail-delay", type=float, default=3.0)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    endpoint = FakeEndpoint(args.base_delay, args.tail_rate, args.tail_delay)
+    payload = {"prompt": "Сколько квартир в доме?", "max_new_tokens": 32}
+    results = {}
+
+    # Как было: новое соединение на каждый запрос, без таймаутов
+    row = drive(lambda: requests.post(endpoint.url, json=payload), args.requests, args.concurrency)
+    results["bare_requests"] = row
+    report("requests.post", row)
+
+    client = GenerationClient(endpoint.url, read_timeout=10, total_timeout=15, pool_size=args.concurrency)
+    row = drive(lambda: client.generate(payload), args.requests, args.concurrency)
+    results["pooled"] = row
+    report("пул соединений", row)
+
+    hedged = GenerationClient(
+        endpoint.url, read_timeout=10, total_timeout=15, pool_size=args.concurrency * 2,
+        hedge_enabled=True, hedge_min_delay=args.base_delay * 2
+    )
+    # Прогрев окна задержек, чтобы хеджирование знало p95
+    drive(lambda: hedged.generate(payload), 40, args.concurrency)
+    hits_before = endpoint.hits
+    row = drive(lambda: hedged.generate(payload), args.requests, args.concurrency)
+    stats = hedged.stats()
+    row.update({
+        "hedge_delay_s": stats["hedge_delay_s"],
+        "hedges": stats["hedges"],
+        "hedge_wins": stats["hedge_wins"],
+        "extra_load_pct": round((endpoint.hits - hits_before - args.requests) / args.requests * 100, 1),
+    })
+    results["hedged"] = row
+    report("пул + хеджирование", row)
+    print(f"  задержка дубля {row['hedge_delay_s']:.3f} с, дублей {row['hedges']}, выиграли {row['hedge_wins']}, "
+          f"доп. нагрузка {row['extra_load_pct']}%")
+
+    # Зависший эндпоинт: вызов ограничен бюджетом, а не висит вечно
+    endpoint.mode = "hang"
+    hanging = GenerationClient(endpoint.url, read_timeout=1.0, total_timeout=2.5, max_retries=1, retry_backoff=0.1)
+    row = drive(lambda: hanging.generate(payload), 4, 4)
+    results["hang"] = row
+    report("зависание (таймауты)", row)
+
+    # Отказ эндпоинта: после порога ошибок автомат отвечает мгновенно
+    endpoint.mode = "error"
+    failing = GenerationClient(endpoint.url, max_retries=0, breaker_failures=5, breaker_reset=60)
+    latencies = []
+    for _ in range(50):
+        started = time.perf_counter()
+        try:
+            failing.generate(payload)
+        except GenerationError:
+            pass
+        latencies.append(time.perf_counter() - started)
+    stats = failing.stats()
+    results["outage"] = {
+        "first_errors": summarize(latencies[:5]),
+        "short_circuited": {**summarize(latencies[5:]), "count": stats["short_circuited"]},
+        "breaker": stats["endpoints"][0]["breaker"],
+    }
+    print(f"отказ эндпоинта: первые 5 ошибок p50 {results['outage']['first_errors']['p50_ms']} мс, "
+          f"затем {stats['short_circuited']} отказов автомата, p50 {results['outage']['short_circuited']['p50_ms']} мс")
+
+    endpoint.server.shutdown()
+    save_results(args.output, "llm_client", results)
+
+
+if __name__ == "__main__":
+    main()
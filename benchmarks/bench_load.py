@@ -0,0 +1,377 @@
+"""
+Нагрузочный тест: N виртуальных жителей пишут боту через фейковый Telegram
+(getUpdates отдаёт их сообщения, ответ — первый sendMessage в их чат), думают
+между вопросами (экспоненциальное время, среднее --think-s) и с вероятностью
+--followup-rate задают уточняющий вопрос. Одновременно «операторы» шлют
+события Chatwoot на /webhook с частотой --webhook-rate в секунду.
+
+Telegram, Chatwoot и генерация — локальные заглушки с задаваемой задержкой
+(у генерации — ещё и число параллельных слотов). Число пользователей растёт
+ступенями (--users); для каждой ступени — пропускная способность и p50/p95/p99
+по путям: новый вопрос, уточняющий вопрос, вебхук. Точка насыщения — последняя
+ступень, после которой пропускная способность растёт меньше чем на --min-gain
+или p95 ответа выходит за --slo-p95.
+
+По умолчанию бот поднимается в этом же процессе: обработчики и вебхук — как в
+main.py, поиск — по MemoryVectorStore, модели — локальные или заглушки (как в
+bench_stages). Генератор нагрузки делит с ботом GIL, поэтому для оценки
+ёмкости настоящего экземпляра есть --external: заглушки слушают порты от
+--port-base, а бот запускается отдельно с выведенными переменными окружения.
+
+    python -m benchmarks.bench_load --users 5,10,20,40 --step-seconds 30 --output results/load.json
+    python -m benchmarks.bench_load --external --webhook-url http://127.0.0.1:5000/webhook
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.common import (
+    FakeEndpoint,
+    FakeChatwoot,
+    FakeTelegram,
+    MemoryVectorStore,
+    SAMPLE_QUESTIONS,
+    synthetic_chunks,
+    save_results,
+    summarize
+)
+
+FOLLOWUPS = [
+    "А сколько это стоит?",
+    "А на каком этаже?",
+    "А в каком доме?",
+    "Когда можно посмотреть?",
+    "А есть варианты с отделкой?",
+]
+
+# Ответ бота на вопрос всегда заканчивается подсказкой про оператора; без неё — сброс под нагрузкой
+ANSWER_MARK = "Если вам нужна помощь оператора"
+# Промежуточные сообщения, которые не считаются ответом на вопрос
+QUEUE_NOTICE = "Ваш вопрос в очереди"
+OPERATOR_PREFIX = "Оператор:"
+
+
+def bot_environment(args):
+    """Переменные окружения, направляющие бота на заглушки"""
+    base = "http://127.0.0.1"
+    llm_url = f"{base}:{args.port_base + 2}/generate"
+    return {
+        "TELEGRAM_BOT_TOKEN": "123456:loadtest",
+        "TELEGRAM_API_URL": f"{base}:{args.port_base}",
+        "CHATWOOT_BASE_URL": f"{base}:{args.port_base + 1}",
+        "CHATWOOT_API_KEY": "loadtest",
+        "CHATWOOT_ACCOUNT_ID": "1",
+        "CHATWOOT_INBOX_ID": "1",
+        "HF_ENDPOINT_URL": llm_url,
+        "HF_ENDPOINT_URLS": llm_url,
+        "HF_API_KEY": "loadtest",
+        "WEBHOOK_PORT": str(args.port_base + 3),
+    }
+
+
+# === Бот в этом процессе ===
+class InProcessBot:
+    """Приложение PTB и сервер вебхука в фоновых потоках; импорт модулей бота — после настройки окружения"""
+
+    def __init__(self, args):
+        import main as bot_main
+        from services.tenants import load_tenants, tenants as registry
+        from services.inference_backends import TimedEmbeddings
+        from benchmarks.bench_stages import load_local_models, build_retriever, wrap_reranker
+        from webhook.app import app
+        from werkzeug.serving import make_server
+
+        tenants = load_tenants(None)
+        registry.extend(tenants)
+        embeddings, reranker, self.models = load_local_models(args)
+        store = MemoryVectorStore(TimedEmbeddings(embeddings), synthetic_chunks(args.docs))
+        tenants[0].retriever, _ = build_retriever(store)
+        self.application = bot_main.build_application(tenants[0], wrap_reranker(reranker))
+
+        self.server = make_server("127.0.0.1", args.port_base + 3, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name="load-webhook", daemon=True).start()
+
+        self._loop = None
+        self._stop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),), name="load-bot", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(60):
+            raise RuntimeError("Бот не запустился за 60 секунд")
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        await self.application.initialize()
+        await self.application.start()
+        await self.application.updater.start_polling(poll_interval=0.0, timeout=10)
+        self._ready.set()
+        await self._stop.wait()
+        await self.application.updater.stop()
+        await self.application.stop()
+        await self.application.shutdown()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(timeout=30)
+        self.server.shutdown()
+
+
+# === Генератор нагрузки ===
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+class LoadGenerator:
+    def __init__(self, args, telegram, webhook_url):
+        self.args = args
+        self.telegram = telegram
+        self.webhook_url = webhook_url
+        self.waiting = {}  # chat_id -> future ответа на текущий вопрос
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="load-webhook-client")
+        self.sessions = threading.local()
+        telegram.on_send = self.on_send
+
+    def on_send(self, chat_id, text, sent_at):
+        # Вызывается из потока сервера заглушки Telegram
+        if not text or text.startswith(OPERATOR_PREFIX) or QUEUE_NOTICE in text:
+            return
+        future = self.waiting.pop(chat_id, None)
+        if future is not None:
+            self.loop.call_soon_threadsafe(_resolve, future, (text, sent_at))
+
+    async def ask(self, user_id, text):
+        """Задержка до ответа и его текст; (None, None), если ответа нет за --reply-timeout"""
+        future = self.loop.create_future()
+        self.waiting[user_id] = future
+        sent_at = time.time()
+        self.telegram.push_message(user_id, text)
+        try:
+            reply, replied_at = await asyncio.wait_for(future, self.args.reply_timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop(user_id, None)
+            return None, None
+        return replied_at - sent_at, reply
+
+    async def resident(self, user_id, stop_at, step):
+        rng = random.Random(user_id * 7919 + step["users"])
+        await asyncio.sleep(rng.uniform(0, self.args.think_s))
+        asked = False
+        while time.monotonic() < stop_at:
+            followup = asked and rng.random() < self.args.followup_rate
+            path = "telegram_followup" if followup else "telegram_question"
+            latency, reply = await self.ask(user_id, rng.choice(FOLLOWUPS if followup else SAMPLE_QUESTIONS))
+            if latency is None:
+                # Житель не дождался ответа и ушёл: поздний ответ не должен засчитаться следующему вопросу
+                step["timeouts"][path] += 1
+                return
+            step["latencies"][path].append(latency)
+            if ANSWER_MARK not in reply:
+                step["not_answered"][path] += 1
+            asked = True
+            await asyncio.sleep(rng.expovariate(1.0 / self.args.think_s) if self.args.think_s > 0 else 0)
+
+    def post_webhook(self, user_id, step):
+        session = getattr(self.sessions, "session", None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        event = {
+            "event": "message_created",
+            "message_type": "outgoing",
+            "private": False,
+            "content": "Добрый день! Уточню и вернусь с ответом.",
+            "sender": {"type": "user"},
+            "inbox": {"id": 1},
+            "conversation": {"id": user_id, "inbox_id": 1, "meta": {"sender": {"identifier": f"telegram:{user_id}"}}},
+        }
+        started = time.perf_counter()
+        try:
+            status = session.post(self.webhook_url, json=event, timeout=self.args.reply_timeout).json().get("status")
+        except Exception:
+            status = "error"
+        step["latencies"]["chatwoot_webhook"].append(time.perf_counter() - started)
+        if status != "sent_to_telegram":
+            step["not_answered"]["chatwoot_webhook"] += 1
+
+    async def operators(self, users, stop_at, step):
+        """События Chatwoot — пуассоновский поток с частотой --webhook-rate, не ждущий ответов"""
+        rng = random.Random(users)
+        pending = []
+        while self.args.webhook_rate > 0:
+            await asyncio.sleep(rng.expovariate(self.args.webhook_rate))
+            if time.monotonic() >= stop_at:
+                break
+            pending.append(self.loop.run_in_executor(self.executor, self.post_webhook, rng.randint(1, users), step))
+        await asyncio.gather(*pending)
+
+    async def run_step(self, users):
+        step = {"users": users, "latencies": defaultdict(list), "timeouts": defaultdict(int), "not_answered": defaultdict(int)}
+        started = time.monotonic()
+        stop_at = started + self.args.step_seconds
+        await asyncio.gather(
+            self.operators(users, stop_at, step),
+            *(self.resident(user_id, stop_at, step) for user_id in range(1, users + 1))
+        )
+        return report_step(step, time.monotonic() - started)
+
+    async def run(self, levels):
+        self.loop = asyncio.get_running_loop()
+        steps = []
+        for users in levels:
+            step = await self.run_step(users)
+            steps.append(step)
+            print_step(step)
+            await asyncio.sleep(self.args.cooldown)
+        return steps
+
+
+# === Отчёт ===
+def report_step(step, elapsed):
+    paths = {}
+    for path in ("telegram_question", "telegram_followup", "chatwoot_webhook"):
+        latencies = step["latencies"][path]
+        paths[path] = {
+            **summarize(latencies),
+            "throughput_per_s": round(len(latencies) / elapsed, 2),
+            "timeouts": step["timeouts"][path],
+            "not_answered": step["not_answered"][path],
+        }
+    answers = paths["telegram_question"]["count"] + paths["telegram_followup"]["count"]
+    all_latencies = step["latencies"]["telegram_question"] + step["latencies"]["telegram_followup"]
+    return {
+        "users": step["users"],
+        "seconds": round(elapsed, 1),
+        "telegram_throughput_per_s": round(answers / elapsed, 2),
+        "telegram": summarize(all_latencies),
+        "paths": paths,
+    }
+
+
+def print_step(step):
+    telegram = step["telegram"]
+    webhook = step["paths"]["chatwoot_webhook"]
+    timeouts = sum(path["timeouts"] for path in step["paths"].values())
+    print(
+        f"пользователей {step['users']:>4}: {step['telegram_throughput_per_s']:>6.2f} ответов/с, "
+        f"p50 {telegram.get('p50_ms', 0):>7.0f} мс, p95 {telegram.get('p95_ms', 0):>7.0f} мс, "
+        f"p99 {telegram.get('p99_ms', 0):>7.0f} мс, без ответа {timeouts}; "
+        f"вебхук {webhook['throughput_per_s']:.2f}/с, p95 {webhook.get('p95_ms', 0):.0f} мс"
+    )
+
+
+def find_saturation(steps, slo_p95, min_gain):
+    """
+    Последняя ступень до насыщения: следующая за ней не прибавила min_gain в пропускной
+    способности или вышла за SLO по p95. None — насыщение не достигнуто.
+    """
+    for index, step in enumerate(steps):
+        p95 = step["telegram"].get("p95_ms", 0) / 1000
+        timeouts = sum(path["timeouts"] for path in step["paths"].values())
+        previous = steps[index - 1] if index else None
+        reason = None
+        if p95 > slo_p95 or timeouts:
+            reason = f"p95 {p95:.1f} с (SLO {slo_p95} с), без ответа {timeouts}"
+        elif previous and step["telegram_throughput_per_s"] < previous["telegram_throughput_per_s"] * (1 + min_gain):
+            reason = (
+                f"пропускная способность {previous['telegram_throughput_per_s']} → "
+                f"{step['telegram_throughput_per_s']} ответов/с при росте числа пользователей"
+            )
+        if reason:
+            return {
+                "users": previous["users"] if previous else None,
+                "throughput_per_s": previous["telegram_throughput_per_s"] if previous else None,
+                "saturated_at_users": step["users"],
+                "reason": reason,
+            }
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="5,10,20,40,80", help="ступени числа пользователей через запятую")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--cooldown", type=float, default=2, help="пауза между ступенями, секунд")
+    parser.add_argument("--think-s", type=float, default=5, help="среднее время между ответом и следующим вопросом")
+    parser.add_argument("--followup-rate", type=float, default=0.4, help="доля уточняющих вопросов")
+    parser.add_argument("--webhook-rate", type=float, default=2, help="событий Chatwoot в секунду")
+    parser.add_argument("--reply-timeout", type=float, default=60)
+    parser.add_argument("--llm-ms", type=float, default=1500, help="задержка генерации")
+    parser.add_argument("--llm-tail-rate", type=float, default=0.02, help="доля медленных генераций")
+    parser.add_argument("--llm-slots", type=int, default=4, help="параллельных генераций на сервере (0 — без ограничения)")
+    parser.add_argument("--chatwoot-ms", type=float, default=80)
+    parser.add_argument("--telegram-ms", type=float, default=40)
+    parser.add_argument("--slo-p95", type=float, default=10, help="p95 ответа, выше которого экземпляр перегружен, секунд")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="минимальный прирост пропускной способности между ступенями")
+    parser.add_argument("--port-base", type=int, default=18700, help="Telegram, Chatwoot, генерация и вебхук — порты подряд")
+    parser.add_argument("--external", action="store_true", help="бот запущен отдельно на заглушках")
+    parser.add_argument("--webhook-url", help="вебхук внешнего бота (по умолчанию вебхук бота в этом процессе)")
+    parser.add_argument("--connect-timeout", type=float, default=300, help="сколько ждать подключения внешнего бота")
+    parser.add_argument("--docs", type=int, default=3000, help="чанков в индексе бота в этом процессе")
+    parser.add_argument("--pair-ms", type=float, default=0.5, help="стоимость пары у заглушки cross-encoder")
+    parser.add_argument("--fallback-models", action="store_true", help="не загружать локальные модели")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    levels = [int(value) for value in args.users.split(",")]
+
+    telegram = FakeTelegram(delay=args.telegram_ms / 1000, port=args.port_base)
+    FakeChatwoot(delay=args.chatwoot_ms / 1000, port=args.port_base + 1)
+    FakeEndpoint(base_delay=args.llm_ms / 1000, tail_rate=args.llm_tail_rate, tail_delay=args.llm_ms * 4 / 1000,
+                 concurrency=args.llm_slots or None, port=args.port_base + 2)
+    environment = bot_environment(args)
+
+    bot = None
+    if args.external:
+        webhook_url = args.webhook_url or f"http://127.0.0.1:{environment['WEBHOOK_PORT']}/webhook"
+        print("Заглушки запущены. Переменные окружения для бота:")
+        for name, value in environment.items():
+            print(f"  {name}={value}")
+        print(f"Ожидание подключения бота (getUpdates) и вебхука {webhook_url}...")
+        deadline = time.monotonic() + args.connect_timeout
+        while not telegram.calls["getUpdates"]:
+            if time.monotonic() > deadline:
+                raise SystemExit("Бот не подключился к заглушке Telegram")
+            time.sleep(0.5)
+        models = "external"
+    else:
+        os.environ.update(environment)
+        bot = InProcessBot(args)
+        webhook_url = f"http://127.0.0.1:{environment['WEBHOOK_PORT']}/webhook"
+        models = bot.models
+    logging.getLogger().setLevel(args.log_level)
+
+    generator = LoadGenerator(args, telegram, webhook_url)
+    try:
+        steps = asyncio.run(generator.run(levels))
+    finally:
+        if bot:
+            bot.close()
+
+    saturation = find_saturation(steps, args.slo_p95, args.min_gain)
+    if saturation is None:
+        print(f"Насыщение не достигнуто до {levels[-1]} пользователей")
+    elif saturation["users"] is None:
+        print(f"Перегрузка уже на {saturation['saturated_at_users']} пользователях: {saturation['reason']}")
+    else:
+        print(
+            f"Насыщение: {saturation['users']} пользователей, {saturation['throughput_per_s']} ответов/с "
+            f"(на {saturation['saturated_at_users']}: {saturation['reason']})"
+        )
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output",)}
+    config["models"] = models
+    save_results(args.output, "load", {"config": config, "steps": steps, "saturation": saturation})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Переиспользование префикса промпта на локальном стенде llama.cpp server:
+сколько токенов промпта сервер посчитал заново и сколько взял из KV-кэша,
+и сколько времени префилла это сэкономило. Сравниваются: обычная сборка
+промпта без подсказок, cache_prompt + id_slot, и то же с раскладкой cache
+(чанки прошлого промпта пользователя идут первыми в прежнем порядке).
+
+    python -m benchmarks.bench_prompt_cache --users 6 --turns 4 --slots 8
+"""
+import random
+import argparse
+
+from langchain_core.documents import Document
+
+from services.llm_client import GenerationClient
+from services.rag_service import build_prompt, generation_hints
+from services.utils import user_context_order
+from benchmarks.common import FakeEndpoint, SAMPLE_QUESTIONS, save_results
+
+
+def make_corpus(size, words, rng):
+    vocabulary = " ".join(SAMPLE_QUESTIONS).lower().replace("?", "").split()
+    return [
+        Document(page_content=f"Раздел {i}. " + " ".join(rng.choice(vocabulary) for _ in range(words)))
+        for i in range(size)
+    ]
+
+
+def make_sessions(corpus, users, turns, per_prompt, overlap, rng):
+    """У каждого пользователя цепочка уточняющих вопросов: часть чанков переходит в следующий ход"""
+    sessions = []
+    for user in range(users):
+        docs = rng.sample(corpus, per_prompt)
+        session = []
+        for turn in range(turns):
+            session.append((f"{SAMPLE_QUESTIONS[(user + turn) % len(SAMPLE_QUESTIONS)]} (уточнение {turn})", list(docs)))
+            kept = rng.sample(docs, overlap)
+            fresh = rng.sample([doc for doc in corpus if doc not in docs], per_prompt - overlap)
+            docs = kept + fresh
+            rng.shuffle(docs)  # реранкинг меняет порядок от хода к ходу
+        sessions.append(session)
+    return sessions
+
+
+def run(endpoint, sessions, layout, cache_prompt, slot_count, affinity):
+    client = GenerationClient(endpoint.url, read_timeout=30, total_timeout=60)
+    endpoint.slots = [[] for _ in endpoint.slots]
+    user_context_order.clear()
+    # Пользователи задают вопросы вперемешку, как в живом чате
+    for turn in range(len(sessions[0])):
+        for user, session in enumerate(sessions):
+            question, docs = session[turn]
+            payload = {
+                "prompt": build_prompt(user, docs, question, layout=layout),
+                "max_new_tokens": 32,
+                **generation_hints(user, cache_prompt=cache_prompt, slot_count=slot_count),
+            }
+            client.generate(payload, affinity=user if affinity else None)
+    stats = client.stats()
+    client.close()
+    return {
+        "prompt_tokens": stats["prompt_tokens"],
+        "prompt_tokens_cached": stats["prompt_tokens_cached"],
+        "hit_rate": stats["prompt_cache_hit_rate"],
+        "prefill_ms": stats["prefill_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=8, help="параллельных слотов на сервере")
+    parser.add_argument("--per-prompt", type=int, default=5, help="чанков в промпте")
+    parser.add_argument("--overlap", type=int, default=3, help="чанков, переходящих в следующий ход")
+    parser.add_argument("--chunk-words", type=int, default=120)
+    parser.add_argument("--ms-per-token", type=float, default=0.05)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus = make_corpus(200, args.chunk_words, rng)
+    sessions = make_sessions(corpus, args.users, args.turns, args.per_prompt, args.overlap, rng)
+    endpoint = FakeEndpoint(base_delay=0.0, tail_rate=0.0, prefill_ms_per_token=args.ms_per_token, slots=args.slots)
+
+    modes = [
+        ("без подсказок", dict(layout="default", cache_prompt=False, slot_count=0, affinity=False)),
+        ("cache_prompt", dict(layout="default", cache_prompt=True, slot_count=0, affinity=False)),
+        ("cache_prompt + id_slot", dict(layout="default", cache_prompt=True, slot_count=args.slots, affinity=True)),
+        ("+ раскладка cache", dict(layout="cache", cache_prompt=True, slot_count=args.slots, affinity=True)),
+    ]
+    results = {}
+    baseline = None
+    for name, options in modes:
+        row = run(endpoint, sessions, **options)
+        baseline = baseline or row["prefill_ms"]
+        row["prefill_saved_pct"] = round((1 - row["prefill_ms"] / baseline) * 100, 1) if baseline else 0.0
+        results[name] = {**options, **row}
+        print(
+            f"{name:<24} токенов промпта {row['prompt_tokens']:>7}, из кэша {row['prompt_tokens_cached']:>7} "
+            f"({(row['hit_rate'] or 0) * 100:5.1f}%), префилл {row['prefill_ms']:>8.1f} мс (−{row['prefill_saved_pct']}%)"
+        )
+
+    endpoint.server.shutdown()
+    save_results(args.output, "prompt_cache", results)
+
+
+if __name__ == "__main__":
+    main()
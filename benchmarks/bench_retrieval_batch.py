@@ -0,0 +1,99 @@
+"""
+Бенчмарк пакетирования запросов к Chroma: запросов в секунду при 1–64
+одновременных пользователях, напрямую и через RetrievalBatcher.
+
+    python -m benchmarks.bench_retrieval_batch                 # in-process Chroma
+    python -m benchmarks.bench_retrieval_batch --host localhost --port 8000
+"""
+import time
+import random
+import argparse
+import threading
+
+import chromadb
+from langchain_chroma import Chroma
+
+from services.retrieval_batcher import RetrievalBatcher
+from benchmarks.common import HashEmbeddings, SAMPLE_QUESTIONS, save_results, summarize
+
+COLLECTION = "bench_retrieval_batch"
+
+
+def build_vectorstore(args):
+    if args.host:
+        client = chromadb.HttpClient(host=args.host, port=args.port, ssl=False)
+    else:
+        client = chromadb.EphemeralClient()
+    try:
+        client.delete_collection(COLLECTION)
+    except Exception:
+        pass
+    vectorstore = Chroma(client=client, collection_name=COLLECTION, embedding_function=HashEmbeddings())
+
+    rng = random.Random(42)
+    words = " ".join(SAMPLE_QUESTIONS).lower().split() + ["квартира", "этаж", "подъезд", "парковка", "цена"]
+    texts = [" ".join(rng.choice(words) for _ in range(60)) for _ in range(args.docs)]
+    for start in range(0, len(texts), 500):
+        vectorstore.add_texts(texts[start:start + 500])
+    return vectorstore, client.get_collection(COLLECTION)
+
+
+def run_level(search, users, requests_per_user):
+    latencies = []
+    lock = threading.Lock()
+
+    def user_loop(seed):
+        rng = random.Random(seed)
+        local = []
+        for _ in range(requests_per_user):
+            question = rng.choice(SAMPLE_QUESTIONS)
+            started = time.perf_counter()
+            search(question)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=user_loop, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {"users": users, "rps": round(len(latencies) / elapsed, 1), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", help="хост Chroma (по умолчанию in-process EphemeralClient)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="запросов на пользователя")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    vectorstore, collection = build_vectorstore(args)
+    batcher = RetrievalBatcher(collection, vectorstore.embeddings, k=args.k, max_batch_size=args.batch_size, window_ms=args.window_ms)
+    modes = {
+        "direct": lambda q: vectorstore.similarity_search_with_score(q, k=args.k),
+        "batched": batcher.search_with_scores,
+    }
+
+    results = {}
+    print(f"{'users':>6} {'mode':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for users in [int(level) for level in args.levels.split(",")]:
+        for mode, search in modes.items():
+            row = run_level(search, users, args.requests)
+            results.setdefault(mode, []).append(row)
+            print(f"{users:>6} {mode:>8} {row['rps']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9}")
+    results["batched_avg_batch_size"] = round(batcher.average_batch_size, 2)
+    print(f"Средний размер пакета: {batcher.average_batch_size:.2f}")
+    save_results(args.output, "retrieval_batch", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Несколько воркеров на одной машине с общим хранилищем SQLite. Telegram
+заменён таблицей синтетических апдейтов (getUpdates читает её по смещению),
+обработка апдейта — пауза work-ms. Проверяется, что каждый апдейт обработан,
+пользователь всегда попадает в один шард, а его сообщения — в порядке
+отправки. С --kill-leader в середине прогона лидер опроса убивается (SIGKILL)
+и перезапускается под новым id: замеряется пауза, пока аренду не подхватит
+другой воркер. Пропускная способность сравнивается для разного числа воркеров.
+
+    python -m benchmarks.bench_scale_out --workers 1,2,4 --updates 2000 --kill-leader
+"""
+import os
+import time
+import random
+import signal
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from types import SimpleNamespace
+
+from services.state_store import SQLiteStateStore
+from services.scale_out import UpdatePoller, ShardConsumer, shard_of
+from benchmarks.common import save_results, summarize
+
+TENANT = "bench"
+
+
+# === Заглушка Telegram ===
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+
+class FakeBot:
+    """getUpdates по таблице updates: апдейты со смещения offset, long polling — ожидание новых"""
+
+    def __init__(self, path):
+        self.connection = connect(path)
+
+    async def get_updates(self, offset=None, timeout=0):
+        deadline = time.monotonic() + timeout
+        while True:
+            rows = self.connection.execute(
+                "SELECT id, user_id, seq FROM updates WHERE id >= ? ORDER BY id LIMIT 100", (offset or 0,)
+            ).fetchall()
+            if rows or time.monotonic() >= deadline:
+                return [fake_update(*row) for row in rows]
+            await asyncio.sleep(0.02)
+
+
+def fake_update(update_id, user_id, seq):
+    return SimpleNamespace(
+        update_id=update_id,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=None,
+        to_dict=lambda: {"update_id": update_id, "user_id": user_id, "seq": seq},
+    )
+
+
+# === Воркер ===
+def run_worker(index, worker_id, args, store_path, bot_path):
+    async def work():
+        store = SQLiteStateStore(store_path)
+        results = connect(bot_path)
+
+        async def handle(kind, payload):
+            await asyncio.sleep(args.work_ms / 1000)
+            update = payload["update"]
+            results.execute(
+                "INSERT INTO processed (update_id, user_id, seq, worker, processed_at) VALUES (?, ?, ?, ?, ?)",
+                (update["update_id"], update["user_id"], update["seq"], index, time.time())
+            )
+
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        poller = UpdatePoller(store, TENANT, FakeBot(bot_path), worker_id=worker_id, ttl=args.ttl, shards=args.n)
+        consumer = ShardConsumer(store, handle, shard=index, interval=0.02)
+        await asyncio.gather(poller.run(stop), consumer.run(stop))
+
+    asyncio.run(work())
+
+
+def start_worker(index, worker_id, args, store_path, bot_path):
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_worker, args=(index, worker_id, args, store_path, bot_path), daemon=True
+    )
+    process.start()
+    return process
+
+
+# === Прогон ===
+def run(args, workers):
+    args.n = workers
+    directory = tempfile.mkdtemp(prefix="bench_scale_out_")
+    store_path, bot_path = os.path.join(directory, "state.db"), os.path.join(directory, "telegram.db")
+    store = SQLiteStateStore(store_path)
+    bot_db = connect(bot_path)
+    bot_db.executescript("""
+        CREATE TABLE updates (id INTEGER PRIMARY KEY, user_id INTEGER, seq INTEGER, sent_at REAL);
+        CREATE TABLE processed (update_id INTEGER, user_id INTEGER, seq INTEGER, worker INTEGER, processed_at REAL);
+    """)
+
+    processes = {index: start_worker(index, f"worker-{index}", args, store_path, bot_path) for index in range(workers)}
+    time.sleep(2.0)  # запуск интерпретаторов
+
+    rng = random.Random(args.seed)
+    sequence = {}
+    kill = {}
+    started = time.time()
+    interval = 1.0 / args.rate
+    for update_id in range(1, args.updates + 1):
+        user_id = rng.randrange(1, args.users + 1)
+        sequence[user_id] = sequence.get(user_id, 0) + 1
+        bot_db.execute("INSERT INTO updates VALUES (?, ?, ?, ?)", (update_id, user_id, sequence[user_id], time.time()))
+        if args.kill_leader and workers > 1 and update_id == args.updates // 2:
+            leader = store.lease_owner(f"poller:{TENANT}")
+            if leader:
+                index = int(leader.rsplit("-", 1)[1])
+                processes[index].kill()
+                processes[index].join()
+                # Перезапуск под новым id, как это сделал бы супервизор: старая аренда истечёт сама
+                processes[index] = start_worker(index, f"worker-{index}-restarted", args, store_path, bot_path)
+                kill = {"killed_worker": index, "killed_at": time.time(), "after_update": update_id}
+        time.sleep(max(0.0, started + update_id * interval - time.time()))
+
+    # Ждём, пока все апдейты будут обработаны (или истечёт время)
+    wait_until = time.time() + args.ttl * 2 + 30
+    while time.time() < wait_until:
+        done = bot_db.execute("SELECT COUNT(DISTINCT update_id) FROM processed").fetchone()[0]
+        if done >= args.updates and store.queue_depth() == 0:
+            break
+        time.sleep(0.2)
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join(timeout=10)
+
+    return check(args, bot_db, workers, started, kill)
+
+
+def check(args, bot_db, workers, started, kill):
+    rows = bot_db.execute(
+        "SELECT p.update_id, p.user_id, p.seq, p.worker, p.processed_at, u.sent_at "
+        "FROM processed p JOIN updates u ON u.id = p.update_id ORDER BY p.processed_at"
+    ).fetchall()
+    seen, duplicates, wrong_shard, out_of_order = set(), 0, 0, 0
+    last_seq, user_workers, latencies = {}, {}, []
+    for update_id, user_id, seq, worker, processed_at, sent_at in rows:
+        if update_id in seen:
+            duplicates += 1
+            continue
+        seen.add(update_id)
+        latencies.append(processed_at - sent_at)
+        user_workers.setdefault(user_id, set()).add(worker)
+        if worker != shard_of(user_id, workers):
+            wrong_shard += 1
+        if seq < last_seq.get(user_id, 0):
+            out_of_order += 1
+        last_seq[user_id] = seq
+
+    finished = max((row[4] for row in rows), default=started)
+    result = {
+        "workers": workers,
+        "updates": args.updates,
+        "processed": len(seen),
+        "lost": args.updates - len(seen),
+        "duplicates": duplicates,
+        "wrong_shard": wrong_shard,
+        "users_on_several_workers": sum(1 for owners in user_workers.values() if len(owners) > 1),
+        "out_of_order": out_of_order,
+        "throughput_per_s": round(len(seen) / max(1e-9, finished - started), 1),
+        "latency": summarize(latencies),
+    }
+    if kill:
+        # Пауза опроса: самый поздний из апдейтов, отправленных сразу после убийства лидера
+        after = bot_db.execute(
+            "SELECT MIN(p.processed_at) - u.sent_at FROM processed p JOIN updates u ON u.id = p.update_id "
+            "WHERE u.id = ? GROUP BY u.id", (kill["after_update"] + 1,)
+        ).fetchone()
+        kill["failover_s"] = round(after[0], 2) if after else None
+        kill.pop("killed_at")
+        result["kill"] = kill
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="числа воркеров через запятую")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=400, help="апдейтов в секунду")
+    parser.add_argument("--work-ms", type=float, default=5, help="обработка одного апдейта")
+    parser.add_argument("--ttl", type=float, default=3, help="TTL аренды опроса, секунд")
+    parser.add_argument("--kill-leader", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    results = []
+    for workers in [int(value) for value in args.workers.split(",")]:
+        result = run(args, workers)
+        results.append(result)
+        line = (
+            f"воркеров {workers}: обработано {result['processed']}/{result['updates']}, "
+            f"повторов {result['duplicates']}, потеряно {result['lost']}, не в своём шарде {result['wrong_shard']}, "
+            f"не по порядку {result['out_of_order']}, {result['throughput_per_s']}/с, "
+            f"p95 {result['latency'].get('p95_ms', 0):.0f} мс"
+        )
+        if "kill" in result:
+            line += f", лидер убит — опрос восстановлен через {result['kill']['failover_s']} с"
+        print(line)
+    save_results(args.output, "scale_out", {"runs": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Уточняющие вопросы с кэшем кандидатов сессии против полного поиска k=50 и
+реранкинга: задержка получения кандидатов, число оценённых пар и
+совпадение top-3 с полным пересчётом.
+
+    python -m benchmarks.bench_session_cache --delta-k 10
+"""
+import time
+import asyncio
+import argparse
+
+import chromadb
+from langchain_chroma import Chroma
+
+from config import (
+    CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, EMBED_MODEL_PATH, RERANKER_PATH,
+    INFERENCE_BACKEND, ONNX_DIR_NAME, RETRIEVAL_K
+)
+from services.inference_backends import load_models
+from services import rag_service
+from services.rag_service import rank_candidates, refresh_candidates
+from services.session_cache import session_cache
+from services.utils import clean_text
+from benchmarks.common import save_results, summarize
+
+# Первый вопрос темы и уточнение к нему
+DIALOGS = [
+    ("Сколько стоит двухкомнатная квартира?", "А трёхкомнатная?"),
+    ("Есть ли подземный паркинг?", "Сколько стоит машиноместо?"),
+    ("Когда сдача первой очереди?", "А второй очереди?"),
+    ("Какие есть варианты ипотеки?", "Какая ставка по семейной ипотеке?"),
+    ("Есть ли рядом школа?", "А детский сад?"),
+    ("Какая высота потолков в квартирах?", "Какая отделка в квартирах?"),
+]
+
+
+async def run(retriever, reranker, delta_k):
+    rag_service.SESSION_DELTA_K = delta_k
+    cold, followup, full = [], [], []
+    agreement = 0.0
+    rescored_before = session_cache.rescored_pairs
+    for first, second in DIALOGS:
+        first, second = clean_text(first), clean_text(second)
+        cached = await rank_candidates(first, await retriever.aget_relevant_documents(first), reranker)
+
+        started = time.perf_counter()
+        docs = await retriever.aget_relevant_documents(second)
+        retrieval_time = time.perf_counter() - started
+        fresh = await rank_candidates(second, docs, reranker)
+        full.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        refreshed = await refresh_candidates(second, cached, docs, reranker)
+        followup.append(retrieval_time + time.perf_counter() - started)
+
+        fresh_top = {doc.page_content for doc, _ in fresh[:3]}
+        refreshed_top = {doc.page_content for doc, _ in refreshed[:3]}
+        agreement += len(fresh_top & refreshed_top) / max(1, len(fresh_top))
+        cold.append(len(fresh))
+    return {
+        "full": {"avg_pairs": sum(cold) / len(cold), "latency": summarize(full)},
+        "followup": {"avg_new_pairs": round((session_cache.rescored_pairs - rescored_before) / len(DIALOGS), 1), "latency": summarize(followup)},
+        "top3_agreement": round(agreement / len(DIALOGS), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delta-k", type=int, default=10)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    embeddings, reranker = load_models(INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, **kwargs)
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+    vectorstore = Chroma(client=client, collection_name=COLLECTION_NAME, embedding_function=embeddings)
+    retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+
+    results = asyncio.run(run(retriever, reranker, args.delta_k))
+    print(f"полный пересчёт: {results['full']['avg_pairs']:.0f} пар, p50 {results['full']['latency']['p50_ms']} мс")
+    print(
+        f"кэш сессии    : ~{results['followup']['avg_new_pairs']} новых пар, "
+        f"p50 {results['followup']['latency']['p50_ms']} мс"
+    )
+    print(f"совпадение top-3 с полным пересчётом: {results['top3_agreement']:.0%}")
+    save_results(args.output, "session_cache", results)
+
+
+if __name__ == "__main__":
+    main()
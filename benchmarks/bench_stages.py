@@ -0,0 +1,374 @@
+"""
+Поэтапный бенчмарк бота без внешних сервисов. Модели — локальные эмбеддер и
+cross-encoder (INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH), если они
+есть, иначе HashEmbeddings и OverlapCrossEncoder. Chroma заменена
+MemoryVectorStore, генерация — FakeEndpoint, Chatwoot и Telegram — FakeChatwoot
+и FakeTelegram. Поиск собирается как в main.py (пакетирование, BM25, каскад
+реранкинга — по конфигу), поэтому RETRIEVAL_K, HYBRID_*, LLM_PROMPT_LAYOUT и
+другие переменные окружения влияют на замер так же, как на бота.
+
+Замеряются:
+  micro.*            — отдельные этапы: clean_text, очистка чанков (холодный и
+                       тёплый кэш), эмбеддинг вопроса, векторный поиск, BM25,
+                       реранкинг, сборка промпта;
+  process_question.* — этапы RAG по таймлайну (retrieval, followup_check, rerank, prompt, llm);
+  handle_message.*   — обработчик сообщения Telegram (chatwoot_question, typing, rag, reply, chatwoot_answer);
+  webhook.*          — POST /webhook с ответом оператора: разбор и маршрутизация, отправка в Telegram.
+
+Результаты сохраняются в JSON; с --baseline прогон сравнивается с прошлым по
+p50 каждого этапа, при регрессии больше --tolerance код выхода 1.
+
+    python -m benchmarks.bench_stages --output results/stages.json
+    python -m benchmarks.bench_stages --baseline results/stages.json --tolerance 0.15
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from types import SimpleNamespace
+from collections import defaultdict
+
+import requests
+
+import bot.handlers as handlers
+from config import (
+    INFERENCE_BACKEND,
+    EMBED_MODEL_PATH,
+    RERANKER_PATH,
+    RETRIEVAL_K,
+    RETRIEVAL_BATCH_ENABLED,
+    RETRIEVAL_BATCH_MAX_SIZE,
+    RETRIEVAL_BATCH_WINDOW_MS,
+    HYBRID_SEARCH_ENABLED,
+    HYBRID_LEXICAL_K,
+    HYBRID_RRF_K,
+    HYBRID_TOP_N,
+    RERANK_CASCADE_ENABLED,
+    LLM_PROMPT_LAYOUT
+)
+from services import rag_service, chatwoot_service, utils
+from services.utils import clean_text, clean_document
+from services.rag_service import process_question, rerank_documents, build_prompt
+from services.timeline import Timeline, current_timeline
+from services.llm_client import GenerationClient
+from services.inference_backends import TimedEmbeddings
+from services.retrieval_batcher import RetrievalBatcher
+from services.hybrid_search import BM25Index, HybridRetriever
+from benchmarks.common import (
+    HashEmbeddings,
+    OverlapCrossEncoder,
+    MemoryVectorStore,
+    FakeEndpoint,
+    FakeChatwoot,
+    FakeTelegram,
+    SAMPLE_QUESTIONS,
+    synthetic_chunks,
+    save_results,
+    summarize
+)
+
+# Разница p50 меньше этого порога не считается регрессией (шум таймера и планировщика)
+NOISE_FLOOR_MS = 0.05
+
+
+# === Модели и поиск ===
+def load_local_models(args):
+    """Локальные модели, как их грузит main.py; без весов (или с --fallback-models) — заглушки"""
+    if not args.fallback_models and os.path.isdir(EMBED_MODEL_PATH) and os.path.isdir(RERANKER_PATH):
+        try:
+            from services.inference_backends import load_models
+            embeddings, reranker = load_models(INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH)
+            return embeddings, reranker, INFERENCE_BACKEND
+        except Exception as e:
+            logging.warning(f"Локальные модели не загружены ({e}), используются заглушки")
+    return HashEmbeddings(), OverlapCrossEncoder(pair_ms=args.pair_ms), "fallback"
+
+
+def build_retriever(store):
+    """Та же сборка, что build_retriever в main.py, поверх хранилища в памяти"""
+    if RETRIEVAL_BATCH_ENABLED:
+        retriever = RetrievalBatcher(store.collection, store.embeddings, k=RETRIEVAL_K, max_batch_size=RETRIEVAL_BATCH_MAX_SIZE, window_ms=RETRIEVAL_BATCH_WINDOW_MS)
+    else:
+        # Без пакетирования бот ходит в Chroma по запросу на вопрос: пакет из одного запроса, без окна
+        retriever = RetrievalBatcher(store.collection, store.embeddings, k=RETRIEVAL_K, max_batch_size=1, window_ms=0)
+    bm25_index = None
+    if HYBRID_SEARCH_ENABLED:
+        bm25_index = BM25Index.from_collection(store.collection)
+        retriever = HybridRetriever(retriever, bm25_index, lexical_k=HYBRID_LEXICAL_K, rrf_k=HYBRID_RRF_K, top_n=HYBRID_TOP_N)
+    return retriever, bm25_index
+
+
+def wrap_reranker(reranker):
+    if not RERANK_CASCADE_ENABLED:
+        return reranker
+    from config import (
+        RERANK_CASCADE_FIRST_SLICE,
+        RERANK_CASCADE_STEP,
+        RERANK_CASCADE_MAX_DEPTH,
+        RERANK_CASCADE_CONFIDENT_SCORE,
+        RERANK_CASCADE_MARGIN,
+        RERANK_CASCADE_KEEP_UNSCORED
+    )
+    from services.cascade_reranker import CascadeReranker
+    return CascadeReranker(
+        reranker,
+        first_slice=RERANK_CASCADE_FIRST_SLICE,
+        step=RERANK_CASCADE_STEP,
+        max_depth=RERANK_CASCADE_MAX_DEPTH,
+        confident_score=RERANK_CASCADE_CONFIDENT_SCORE,
+        margin=RERANK_CASCADE_MARGIN,
+        keep_unscored=RERANK_CASCADE_KEEP_UNSCORED
+    )
+
+
+# === Отдельные этапы ===
+def measure(samples, name, fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples[name].append(time.perf_counter() - started)
+
+
+def micro_stages(args, samples, embeddings, store, retriever, bm25_index, reranker):
+    question = SAMPLE_QUESTIONS[0]
+    docs = retriever.get_relevant_documents(question)
+    cleaned = [clean_document(doc) for doc in docs]
+    vector = embeddings.embed_query(question)
+
+    def clean_cold():
+        utils._cleaned_documents.clear()
+        return [clean_document(doc) for doc in docs]
+
+    stages = [
+        ("clean_text", lambda: clean_text(question)),
+        ("clean_documents_cold", clean_cold),
+        ("clean_documents_warm", lambda: [clean_document(doc) for doc in docs]),
+        ("embed_query", lambda: embeddings.embed_query(question)),
+        ("vector_query", lambda: store.collection.query(query_embeddings=[vector], n_results=RETRIEVAL_K)),
+        ("rerank", lambda: rerank_documents(question, cleaned, reranker)),
+        ("build_prompt", lambda: build_prompt(0, cleaned, question, layout=LLM_PROMPT_LAYOUT)),
+    ]
+    if bm25_index is not None:
+        stages.append(("bm25_search", lambda: bm25_index.search(question, HYBRID_LEXICAL_K)))
+    for name, fn in stages:
+        measure(samples, f"micro.{name}", fn, args.repeat, args.warmup)
+
+
+# === Пайплайны ===
+def collect(samples, prefix, timeline):
+    for name, _, duration in timeline.stages:
+        samples[f"{prefix}.{name}"].append(duration)
+    samples[f"{prefix}.total"].append(timeline.elapsed)
+
+
+async def pipeline_process_question(args, samples, retriever, reranker):
+    """process_question с таймлайном; каждые четыре вопроса от одного пользователя — проверка уточнения работает"""
+    for i in range(args.warmup + args.repeat):
+        timeline = Timeline("bench")
+        token = current_timeline.set(timeline)
+        try:
+            await process_question(1000 + i // 4, SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], retriever, reranker)
+        finally:
+            current_timeline.reset(token)
+        if i >= args.warmup:
+            collect(samples, "process_question", timeline)
+
+
+class RecordingTimeline(Timeline):
+    """Таймлайн обработчика вместо записи в лог запоминается для замера"""
+
+    finished = []
+
+    def log(self):
+        RecordingTimeline.finished.append(self)
+
+
+class TelegramStub:
+    """update.message.reply_text и context.bot.send_chat_action — HTTP-вызовы FakeTelegram"""
+
+    def __init__(self, telegram, chat_id):
+        self.base_url = f"{telegram.url}/botbench"
+        self.chat_id = chat_id
+
+    async def call(self, method, **params):
+        response = await asyncio.to_thread(requests.post, f"{self.base_url}/{method}", json=params, timeout=10)
+        return response.json()["result"]
+
+    async def reply_text(self, text, reply_markup=None):
+        return await self.call("sendMessage", chat_id=self.chat_id, text=text)
+
+    async def send_chat_action(self, chat_id, action):
+        return await self.call("sendChatAction", chat_id=chat_id, action=action)
+
+
+async def pipeline_handle_message(args, samples, telegram, retriever, reranker):
+    """Обработчик сообщения целиком; пользователи по кругу, первое сообщение каждого регистрирует его в Chatwoot"""
+    handlers.Timeline = RecordingTimeline
+    for i in range(args.warmup + args.repeat):
+        user_id = 2000 + i % args.users
+        stub = TelegramStub(telegram, user_id)
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id, first_name="Тест", last_name=None, username=None),
+            effective_chat=SimpleNamespace(id=user_id),
+            message=SimpleNamespace(text=SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], reply_text=stub.reply_text),
+        )
+        context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=stub.send_chat_action))
+        RecordingTimeline.finished.clear()
+        await handlers.handle_message(update, context, retriever, reranker)
+        if i >= args.warmup and RecordingTimeline.finished:
+            collect(samples, "handle_message", RecordingTimeline.finished[-1])
+
+
+def pipeline_webhook(args, samples, telegram):
+    """POST /webhook с сообщением оператора через тестовый клиент Flask; отправка в Telegram — отдельно"""
+    import webhook.app as webhook_app
+
+    logging.getLogger().setLevel(args.log_level)  # webhook.app настраивает логирование при импорте
+    webhook_app.TELEGRAM_API_URL = telegram.url
+    send = webhook_app.send_telegram_message
+    sends = []
+
+    def timed_send(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            sends.append(time.perf_counter() - started)
+
+    webhook_app.send_telegram_message = timed_send
+    client = webhook_app.app.test_client()
+    try:
+        for i in range(args.warmup + args.repeat):
+            user_id = 2000 + i % args.users
+            event = {
+                "event": "message_created",
+                "message_type": "outgoing",
+                "private": False,
+                "content": f"Ответ оператора на вопрос {i}",
+                "sender": {"type": "user"},
+                "inbox": {"id": 1},
+                "conversation": {"id": user_id, "meta": {"sender": {"identifier": f"telegram:{user_id}"}}},
+            }
+            sends.clear()
+            started = time.perf_counter()
+            response = client.post("/webhook", json=event)
+            total = time.perf_counter() - started
+            if response.get_json().get("status") != "sent_to_telegram":
+                logging.warning(f"Вебхук не дошёл до Telegram: {response.get_json()}")
+            if i >= args.warmup:
+                samples["webhook.total"].append(total)
+                samples["webhook.telegram_send"].extend(sends)
+                samples["webhook.handling"].append(total - sum(sends))
+    finally:
+        webhook_app.send_telegram_message = send
+
+
+# === Сравнение с прошлым прогоном ===
+def compare(stages, baseline_path, tolerance):
+    """Строки сравнения p50 с базовым прогоном и список регрессий"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]["stages"]
+    rows, regressions = [], []
+    for name, summary in stages.items():
+        before = baseline.get(name, {}).get("p50_ms")
+        after = summary.get("p50_ms")
+        if before is None or after is None:
+            rows.append((name, before, after, None))
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if change > tolerance and after - before > NOISE_FLOOR_MS:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--docs", type=int, default=3000, help="чанков в индексе")
+    parser.add_argument("--users", type=int, default=8, help="пользователей для обработчика и вебхука")
+    parser.add_argument("--llm-ms", type=float, default=300, help="задержка фейковой генерации")
+    parser.add_argument("--chatwoot-ms", type=float, default=30, help="задержка фейкового Chatwoot")
+    parser.add_argument("--telegram-ms", type=float, default=30, help="задержка фейкового Telegram")
+    parser.add_argument("--pair-ms", type=float, default=0.5, help="стоимость пары у заглушки cross-encoder")
+    parser.add_argument("--fallback-models", action="store_true", help="не загружать локальные модели")
+    parser.add_argument("--skip", default="", help="не запускать части: micro,process_question,handle_message,webhook")
+    parser.add_argument("--log-level", default="WARNING", help="INFO — со стоимостью логирования, как у бота")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="допустимый рост p50 (доля)")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+    logging.getLogger().setLevel(args.log_level)
+
+    embeddings, reranker, models = load_local_models(args)
+    embeddings = TimedEmbeddings(embeddings)
+    reranker = wrap_reranker(reranker)
+    started = time.perf_counter()
+    store = MemoryVectorStore(embeddings, synthetic_chunks(args.docs))
+    print(f"индекс в памяти: {args.docs} чанков за {time.perf_counter() - started:.1f} с")
+    retriever, bm25_index = build_retriever(store)
+
+    llm = FakeEndpoint(base_delay=args.llm_ms / 1000, tail_rate=0.0)
+    chatwoot = FakeChatwoot(delay=args.chatwoot_ms / 1000)
+    telegram = FakeTelegram(delay=args.telegram_ms / 1000)
+    rag_service.generation_client = GenerationClient(llm.url, read_timeout=30, total_timeout=60)
+    rag_service.faq.faq_index = None
+    handlers.CHATWOOT_ENABLED = chatwoot_service.CHATWOOT_ENABLED = True
+    chatwoot_service.CHATWOOT_BASE_URL = chatwoot.url
+    chatwoot_service.CHATWOOT_ACCOUNT_ID = "1"
+    chatwoot_service.CHATWOOT_API_KEY = "bench"
+
+    samples = defaultdict(list)
+    if "micro" not in skip:
+        micro_stages(args, samples, embeddings, store, retriever, bm25_index, reranker)
+    if "process_question" not in skip:
+        asyncio.run(pipeline_process_question(args, samples, retriever, reranker))
+    if "handle_message" not in skip:
+        asyncio.run(pipeline_handle_message(args, samples, telegram, retriever, reranker))
+    if "webhook" not in skip:
+        pipeline_webhook(args, samples, telegram)
+
+    stages = {name: summarize(values) for name, values in sorted(samples.items())}
+    print(f"модели: {models}, чанков {args.docs}, k={RETRIEVAL_K}, повторов {args.repeat}")
+    for name, summary in stages.items():
+        print(f"{name:<36} p50 {summary['p50_ms']:>9.3f} мс   p95 {summary['p95_ms']:>9.3f} мс   n={summary['count']}")
+
+    results = {
+        "config": {
+            "models": models,
+            "docs": args.docs,
+            "retrieval_k": RETRIEVAL_K,
+            "hybrid": HYBRID_SEARCH_ENABLED,
+            "cascade": RERANK_CASCADE_ENABLED,
+            "prompt_layout": LLM_PROMPT_LAYOUT,
+            "llm_ms": args.llm_ms,
+            "chatwoot_ms": args.chatwoot_ms,
+            "telegram_ms": args.telegram_ms,
+        },
+        "stages": stages,
+    }
+    regressions = []
+    if args.baseline:
+        rows, regressions = compare(stages, args.baseline, args.tolerance)
+        print(f"\nсравнение с {args.baseline} (p50):")
+        for name, before, after, change in rows:
+            if change is None:
+                print(f"{name:<36} нет в одном из прогонов")
+                continue
+            mark = "  РЕГРЕССИЯ" if name in regressions else ""
+            print(f"{name:<36} {before:>9.3f} → {after:>9.3f} мс ({change:+.1%}){mark}")
+        results["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "regressions": regressions}
+    save_results(args.output, "stages", results)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
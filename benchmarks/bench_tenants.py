@@ -0,0 +1,84 @@
+"""
+Память нескольких жилых комплексов в одном процессе против контейнера на
+каждый комплекс. Модели загружаются один раз, затем по одному добавляются
+тенанты: ретривер над коллекцией Chroma (с BM25-индексом, если включён
+гибридный поиск), индекс FAQ и приложение PTB. Замеряется прирост RSS на
+тенанта; контейнер на тенанта оценивается как процесс с моделями и одним тенантом.
+
+    python -m benchmarks.bench_tenants --tenants 5 --collection yuzhane --faq faq-example.json
+"""
+import gc
+import argparse
+
+import chromadb
+
+from config import (
+    CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, EMBED_MODEL_PATH, RERANKER_PATH,
+    INFERENCE_BACKEND, ONNX_DIR_NAME, FAQ_THRESHOLD
+)
+from services.inference_backends import load_models
+from services.faq import FaqIndex
+from services.tenants import Tenant
+from benchmarks.bench_backends import rss_mb
+from benchmarks.common import save_results
+
+
+def add_tenant(index, args, chroma_client, embedding_function):
+    from telegram.ext import ApplicationBuilder
+    from main import build_retriever
+
+    tenant = Tenant(f"tenant-{index}", f"{100000 + index}:TEST", args.collection, faq_path=args.faq)
+    tenant.retriever = build_retriever(chroma_client, embedding_function, tenant.collection_name)
+    if args.faq:
+        tenant.faq_index = FaqIndex(args.faq, embedding_function, threshold=FAQ_THRESHOLD)
+    # Приложение PTB без сети: сеть нужна только при initialize / start_polling
+    application = ApplicationBuilder().token(tenant.bot_token).build()
+    tenant.retriever.get_relevant_documents("прогрев")
+    return tenant, application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--collection", default=COLLECTION_NAME, help="коллекция для всех тенантов (как у одинаковых по размеру комплексов)")
+    parser.add_argument("--faq", help="файл FAQ для каждого тенанта")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    baseline = rss_mb()
+    model_kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    embedding_function, reranker = load_models(INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, **model_kwargs)
+    embedding_function.embed_query("прогрев")
+    reranker.predict([("прогрев", "прогрев")])
+    models = rss_mb()
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+
+    tenants, per_tenant = [], []
+    previous = rss_mb()
+    for index in range(args.tenants):
+        tenants.append(add_tenant(index, args, chroma_client, embedding_function))
+        gc.collect()
+        current = rss_mb()
+        per_tenant.append(round(current - previous, 1))
+        previous = current
+        print(f"тенантов {index + 1}: RSS {current:.0f} МБ (+{per_tenant[-1]} МБ)")
+
+    shared_total = previous
+    # Контейнер на тенанта: интерпретатор, модели и один тенант в каждом
+    container = models + per_tenant[0]
+    results = {
+        "interpreter_mb": round(baseline, 1),
+        "models_mb": round(models - baseline, 1),
+        "per_tenant_mb": per_tenant,
+        "added_tenant_mb": round(sum(per_tenant[1:]) / max(1, len(per_tenant) - 1), 1),
+        "shared_process_mb": round(shared_total, 1),
+        "container_per_tenant_mb": round(container * args.tenants, 1),
+    }
+    print(f"модели: {results['models_mb']} МБ, каждый следующий тенант: ~{results['added_tenant_mb']} МБ")
+    print(f"{args.tenants} тенантов: один процесс {results['shared_process_mb']} МБ, "
+          f"контейнер на тенанта ~{results['container_per_tenant_mb']} МБ")
+    save_results(args.output, "tenants", results)
+
+
+if __name__ == "__main__":
+    main()
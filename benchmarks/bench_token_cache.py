@@ -0,0 +1,83 @@
+"""
+Время токенизации и задержка реранкинга 50 пар с кэшем токенов чанков и
+без него. Чанки берутся из коллекции Chroma (--from-chroma) или
+генерируются из примеров вопросов.
+
+    python -m benchmarks.bench_token_cache --from-chroma
+"""
+import time
+import argparse
+
+from config import (
+    CHROMA_HOST, CHROMA_PORT, COLLECTION_NAME, RERANKER_PATH,
+    INFERENCE_BACKEND, ONNX_DIR_NAME
+)
+from services.inference_backends import load_cross_encoder
+from services.token_cache import CachedTokenCrossEncoder
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize
+
+
+def load_chunks(from_chroma, count):
+    if from_chroma:
+        import chromadb
+        client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+        return client.get_collection(COLLECTION_NAME).get(include=["documents"], limit=count)["documents"]
+    base = " ".join(SAMPLE_QUESTIONS)
+    return [f"Фрагмент {i}. {base} Квартира {100 + i}, этаж {i % 17 + 1}." * 3 for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-chroma", action="store_true")
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    cross_encoder = load_cross_encoder(INFERENCE_BACKEND, RERANKER_PATH, **kwargs)
+    cached = CachedTokenCrossEncoder(cross_encoder)
+    chunks = load_chunks(args.from_chroma, args.pairs)
+    tokenizer = cross_encoder.tokenizer
+
+    # Чистая токенизация: все пары целиком против одного вопроса + кэш
+    plain_tokenize, cached_tokenize = [], []
+    cached.warm(chunks)
+    for i in range(args.repeat):
+        pairs = [(SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], chunk) for chunk in chunks]
+        started = time.perf_counter()
+        tokenizer([a for a, _ in pairs], [b for _, b in pairs], padding=True, truncation="longest_first",
+                  max_length=cached.max_length, return_tensors="np")
+        plain_tokenize.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        cached._encode(pairs)
+        cached_tokenize.append(time.perf_counter() - started)
+
+    plain_rerank, cached_rerank = [], []
+    for i in range(args.repeat):
+        pairs = [(SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], chunk) for chunk in chunks]
+        started = time.perf_counter()
+        reference = cross_encoder.predict(pairs)
+        plain_rerank.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        scores = cached.predict(pairs)
+        cached_rerank.append(time.perf_counter() - started)
+    max_diff = float(abs(reference - scores).max())
+
+    results = {
+        "tokenize": {"plain": summarize(plain_tokenize), "cached": summarize(cached_tokenize)},
+        "rerank": {"plain": summarize(plain_rerank), "cached": summarize(cached_rerank)},
+        "max_score_diff": max_diff,
+        "cache_hit_rate": round(cached.hit_rate, 3),
+    }
+    for stage in ("tokenize", "rerank"):
+        print(
+            f"{stage:>9}: без кэша p50 {results[stage]['plain']['p50_ms']} мс, "
+            f"с кэшем p50 {results[stage]['cached']['p50_ms']} мс"
+        )
+    print(f"Максимальное расхождение оценок: {max_diff:.2e}, доля попаданий в кэш: {cached.hit_rate:.3f}")
+    save_results(args.output, "token_cache", results)
+
+
+if __name__ == "__main__":
+    main()
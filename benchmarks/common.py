@@ -0,0 +1,486 @@
+import os
+import json
+import math
+import time
+import random
+import socket
+import hashlib
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+# === Общие утилиты бенчмарков ===
+def percentile(values, pct):
+    """Возвращает перцентиль pct (0-100) по списку значений"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """Сводка по списку задержек в секундах (значения в миллисекундах)"""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def timed(fn, *args, repeat=1, **kwargs):
+    """Выполняет fn repeat раз и возвращает (последний результат, список задержек)"""
+    latencies = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        latencies.append(time.perf_counter() - started)
+    return result, latencies
+
+
+def save_results(path, name, results):
+    """Сохраняет результаты бенчмарка в JSON, чтобы прогоны можно было сравнивать"""
+    if not path:
+        return
+    payload = {
+        "benchmark": name,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    logging.info(f"Результаты сохранены в {path}")
+
+
+class HashEmbeddings:
+    """
+    Детерминированный эмбеддер без модели: вектор строится из хэшей токенов.
+    Нужен, чтобы бенчмарки инфраструктуры не зависели от весов модели.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for token in text.lower().split():
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value & (1 << 63) else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+SAMPLE_QUESTIONS = [
+    "Где находится офис продаж?",
+    "Сколько квартир на третьем этаже?",
+    "Какие планировки есть в доме 2?",
+    "Есть ли подземный паркинг?",
+    "Когда сдача первой очереди?",
+    "Какая стоимость квадратного метра?",
+    "Есть ли рядом школа и детский сад?",
+    "Какая высота потолков в квартирах?",
+]
+
+
+class FakeEndpoint:
+    """
+    Фейковый эндпоинт генерации: HTTP-сервер в отдельном потоке с внедрённой
+    медлительностью; поведение меняется на лету через атрибуты.
+
+    При prefill_ms_per_token > 0 имитирует префилл llama.cpp server: у каждого
+    из slots слотов хранится последний промпт, при cache_prompt считаются
+    только токены после общего с ним префикса; слот берётся из id_slot или
+    случайный. Ответ содержит tokens_evaluated и timings как у llama.cpp.
+
+    concurrency ограничивает число одновременно генерирующих запросов (параллельные
+    слоты сервера): остальные ждут в очереди, как на настоящем сервере генерации.
+    """
+
+    def __init__(self, base_delay=0.05, tail_rate=0.05, tail_delay=3.0, seed=0, prefill_ms_per_token=0.0, slots=4,
+                 concurrency=None, port=0):
+        self.base_delay = base_delay
+        self.tail_rate = tail_rate
+        self.tail_delay = tail_delay
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.slots = [[] for _ in range(slots)]
+        self.mode = "ok"  # ok / hang / error / down / garbage
+        self.hits = 0
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._busy = threading.BoundedSemaphore(concurrency) if concurrency else None
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Заголовки и тело пишутся отдельно: без TCP_NODELAY keep-alive ловит задержку ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # Проверка здоровья: лежащий (mode="down") сервер обрывает соединение
+                if endpoint.mode == "down":
+                    self.close_connection = True
+                    return
+                self._reply(503 if endpoint.mode == "error" else 200, {"status": endpoint.mode})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with endpoint._lock:
+                    endpoint.hits += 1
+                    slow = endpoint.random.random() < endpoint.tail_rate
+                    slot = body.get("id_slot")
+                    if slot is None or not 0 <= slot < len(endpoint.slots):
+                        slot = endpoint.random.randrange(len(endpoint.slots))
+                if endpoint.mode == "down":
+                    self.close_connection = True
+                    return
+                if endpoint.mode == "hang":
+                    time.sleep(3600)
+                if endpoint.mode == "error":
+                    self._reply(503, {"error": "overloaded"})
+                    return
+                if endpoint.mode == "garbage":
+                    # 200 с телом не в JSON (оборванный ответ прокси и т.п.)
+                    self._reply(200, "<html>Bad Gateway</html>")
+                    return
+                if endpoint._busy:
+                    endpoint._busy.acquire()
+                try:
+                    reply = {"content": "Ответ фейковой модели"}
+                    if endpoint.prefill_ms_per_token:
+                        reply.update(endpoint.prefill(body, slot))
+                    time.sleep(endpoint.tail_delay if slow else endpoint.base_delay)
+                finally:
+                    if endpoint._busy:
+                        endpoint._busy.release()
+                self._reply(200, reply)
+
+            def _reply(self, status, body):
+                data = (body if isinstance(body, str) else json.dumps(body)).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/generate"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def prefill(self, body, slot):
+        tokens = body.get("prompt", "").split()
+        cached = 0
+        with self._lock:
+            previous = self.slots[slot]
+            if body.get("cache_prompt"):
+                limit = min(len(previous), len(tokens))
+                while cached < limit and previous[cached] == tokens[cached]:
+                    cached += 1
+            self.slots[slot] = tokens
+        processed = len(tokens) - cached
+        prompt_ms = processed * self.prefill_ms_per_token
+        time.sleep(prompt_ms / 1000)
+        return {
+            "tokens_evaluated": len(tokens),
+            "tokens_cached": cached,
+            "timings": {"prompt_n": processed, "prompt_ms": prompt_ms},
+        }
+
+
+# === Локальные заглушки моделей и Chroma ===
+class OverlapCrossEncoder:
+    """
+    Запасной cross-encoder без модели: доля общих токенов пары (0..1) плюс
+    имитация стоимости pair_ms на пару. predict совместим с CrossEncoder.
+    """
+
+    def __init__(self, pair_ms=0.0):
+        self.pair_ms = pair_ms
+
+    def predict(self, pairs, **kwargs):
+        if self.pair_ms:
+            time.sleep(self.pair_ms * len(pairs) / 1000)
+        scores = []
+        for query, text in pairs:
+            query_tokens, text_tokens = set(query.lower().split()), set(text.lower().split())
+            scores.append(len(query_tokens & text_tokens) / (len(query_tokens) or 1))
+        return scores
+
+
+class _MemoryCollection:
+    """Подмножество API коллекции Chroma (query, get, count) поверх матрицы numpy"""
+
+    def __init__(self, ids, documents, metadatas, matrix):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.matrix = matrix
+
+    def count(self):
+        return len(self.ids)
+
+    def query(self, query_embeddings, n_results=10, include=("documents", "metadatas", "distances")):
+        import numpy as np
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        distances = 1.0 - queries @ self.matrix.T  # косинусное расстояние: векторы нормированы
+        n_results = min(n_results, len(self.ids))
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row in distances:
+            best = np.argpartition(row, n_results - 1)[:n_results]
+            best = best[np.argsort(row[best])]
+            result["ids"].append([self.ids[i] for i in best])
+            result["documents"].append([self.documents[i] for i in best])
+            result["metadatas"].append([self.metadatas[i] for i in best])
+            result["distances"].append([float(row[i]) for i in best])
+        return result
+
+    def get(self, include=("documents", "metadatas"), limit=None, offset=0):
+        end = len(self.ids) if limit is None else offset + limit
+        return {"ids": self.ids[offset:end], "documents": self.documents[offset:end], "metadatas": self.metadatas[offset:end]}
+
+
+class MemoryVectorStore:
+    """
+    Замена векторного хранилища Chroma в памяти: embeddings и collection (с методами
+    query, get и count коллекции Chroma) передаются в RetrievalBatcher и BM25Index.from_collection.
+    Поиск — точный перебор (для бенчмарков на тысячах чанков этого достаточно).
+    """
+
+    def __init__(self, embeddings, texts, metadatas=None, batch_size=256):
+        import numpy as np
+
+        self.embeddings = embeddings
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+        self.collection = _MemoryCollection(
+            [str(i) for i in range(len(texts))], list(texts), list(metadatas or [{} for _ in texts]), matrix
+        )
+
+
+def synthetic_chunks(count, words=60, seed=42):
+    """Чанки из словаря вопросов и типичных слов базы знаний ЖК (с переводами строк и табуляцией, как после парсинга)"""
+    rng = random.Random(seed)
+    vocabulary = " ".join(SAMPLE_QUESTIONS).lower().replace("?", "").split() + [
+        "квартира", "этаж", "подъезд", "парковка", "цена", "планировка", "корпус", "ипотека", "отделка", "м²"
+    ]
+    chunks = []
+    for i in range(count):
+        body = " ".join(rng.choice(vocabulary) for _ in range(words))
+        chunks.append(f"Раздел {i}.\t{body}\n\nКорпус {rng.randint(1, 5)}, квартира №{rng.randint(1, 400)}")
+    return chunks
+
+
+# === Заглушки внешних API ===
+class FakeApi:
+    """
+    HTTP-заглушка внешнего API в отдельном потоке: каждый запрос ждёт delay
+    секунд и отдаётся в route(method, path, params) -> (статус, JSON-ответ).
+    Параметры — объединение query string и тела (JSON или форма, где значения
+    закодированы в JSON, как их шлёт python-telegram-bot). Счётчик вызовов — calls.
+    """
+
+    def __init__(self, delay=0.0, port=0):
+        self.delay = delay
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def _handle(self, method):
+                parts = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                params.update(api._body(self.headers, self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+                if api.delay and not parts.path.endswith("/getUpdates"):
+                    time.sleep(api.delay)
+                status, reply = api.route(method, parts.path, params)
+                data = json.dumps(reply, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def _body(headers, raw):
+        if not raw:
+            return {}
+        if "application/x-www-form-urlencoded" in headers.get("Content-Type", ""):
+            params = {}
+            for key, values in parse_qs(raw.decode("utf-8")).items():
+                try:
+                    params[key] = json.loads(values[0])
+                except ValueError:
+                    params[key] = values[0]
+            return params
+        return json.loads(raw)
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def route(self, method, path, params):
+        raise NotImplementedError
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeChatwoot(FakeApi):
+    """
+    API Chatwoot в объёме services.chatwoot_service: поиск и создание контакта,
+    поиск и создание разговора, сообщения, назначение, список инбоксов.
+    Контакты и разговоры запоминаются, поэтому повторный пользователь находится поиском.
+    """
+
+    def __init__(self, delay=0.03, port=0):
+        super().__init__(delay, port)
+        self.contacts = {}  # identifier -> контакт
+        self.conversations = {}  # contact_id -> id разговора
+        self.messages = []
+
+    def route(self, method, path, params):
+        parts = path.strip("/").split("/")  # api v1 accounts <id> <resource> ...
+        resource = parts[4:] if len(parts) > 4 else []
+        with self._lock:
+            if resource == ["contacts", "search"]:
+                self.calls["contact_search"] += 1
+                contact = self.contacts.get(params.get("q"))
+                return 200, {"payload": [contact] if contact else []}
+            if resource == ["contacts"] and method == "POST":
+                self.calls["contact_create"] += 1
+                contact = {"id": len(self.contacts) + 1, "identifier": params.get("identifier"), "name": params.get("name")}
+                self.contacts[contact["identifier"]] = contact
+                return 200, contact
+            if resource == ["conversations"] and method == "GET":
+                self.calls["conversation_search"] += 1
+                conversation_id = self.conversations.get(int(params.get("contact_id", 0)))
+                return 200, {"data": {"payload": [{"id": conversation_id}] if conversation_id else []}}
+            if resource == ["conversations"]:
+                self.calls["conversation_create"] += 1
+                conversation_id = len(self.conversations) + 1
+                self.conversations[int(params.get("contact_id", 0))] = conversation_id
+                return 200, {"id": conversation_id}
+            if resource[-1:] == ["messages"]:
+                self.calls["message_send"] += 1
+                self.messages.append((resource[1], params.get("message_type"), params.get("content")))
+                return 200, {"id": len(self.messages)}
+            if resource[-1:] == ["assignments"]:
+                self.calls["assign_agent"] += 1
+                return 200, {}
+            if resource == ["inboxes"]:
+                self.calls["inboxes"] += 1
+                return 200, {"payload": []}
+        return 404, {"error": f"нет заглушки для {method} {path}"}
+
+
+class FakeTelegram(FakeApi):
+    """
+    Bot API Telegram (/bot<токен>/<метод>): getMe, sendMessage, sendChatAction,
+    getUpdates с long polling по апдейтам из push_message; остальные методы
+    отвечают успехом. Отправленные ботом сообщения — в sent и в on_send(chat_id, текст, время).
+    """
+
+    def __init__(self, delay=0.03, port=0):
+        super().__init__(delay, port)
+        self.sent = []  # (chat_id, текст, время отправки)
+        self.on_send = None
+        self.updates = []
+        self._next_update_id = 1
+        self._updates_ready = threading.Condition(self._lock)
+
+    def push_message(self, user_id, text, first_name="Житель"):
+        """Сообщение пользователя боту: апдейт отдаётся следующим getUpdates"""
+        user = {"id": user_id, "is_bot": False, "first_name": first_name}
+        with self._updates_ready:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self.updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private", "first_name": first_name},
+                    "from": user,
+                    "text": text,
+                },
+            })
+            self._updates_ready.notify_all()
+        return update_id
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_ready:
+            # Апдейты до offset бот уже подтвердил
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self._updates_ready.wait(deadline - time.monotonic())
+            return self.updates[:int(params.get("limit") or 100)]
+
+    def route(self, method, path, params):
+        api_method = path.rsplit("/", 1)[-1]
+        self.count(api_method)
+        if api_method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+        if api_method == "sendMessage":
+            chat_id, text, sent_at = int(params.get("chat_id") or 0), params.get("text"), time.time()
+            with self._lock:
+                self.sent.append((chat_id, text, sent_at))
+                message_id = len(self.sent)
+            if self.on_send:
+                self.on_send(chat_id, text, sent_at)
+            chat = {"id": chat_id, "type": "private"}
+            return 200, {"ok": True, "result": {"message_id": message_id, "date": int(time.time()), "chat": chat, "text": params.get("text")}}
+        return 200, {"ok": True, "result": True}
@@ -2,7 +2,7 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from services.utils import user_states
+from services.utils import user_states, update_user_state
 from services.chatwoot_service import (
     create_or_get_chatwoot_contact, 
     get_or_create_chatwoot_conversation, 
@@ -48,7 +48,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         }
             else:
                 # Если уже есть - просто обновляем статус
-                user_states[user_id]["with_agent"] = True
+                update_user_state(user_id, with_agent=True)
             
             if user_id in user_states and "conversation_id" in user_states[user_id]:
                 conversation_id = user_states[user_id]["conversation_id"]
@@ -57,7 +57,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if not user_states[user_id].get("history_sent", False):
                     history_text = get_formatted_history(user_id)
                     send_conversation_history_to_chatwoot(conversation_id, history_text)
-                    user_states[user_id]["history_sent"] = True
+                    update_user_state(user_id, history_sent=True)
                 
                 # Отправляем уведомление в Chatwoot, что пользователь запросил оператора
                 send_message_to_chatwoot(
@@ -1,10 +1,12 @@
 import time
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from services.utils import (
     user_states, 
+    update_user_state,
     add_message_to_history,  
     get_formatted_history    
 )
@@ -16,7 +18,13 @@ from services.chatwoot_service import (
     send_conversation_history_to_chatwoot
 )
 from services.rag_service import process_question
-from config import CHATWOOT_ENABLED
+from services.timeline import Timeline, current_timeline, run_stage
+from services.metrics import requests_in_flight
+from services.tracing import span
+from services.admission import admission, rate_limiter, answer_cache
+from services.utils import clean_text
+from services import faq
+from config import CHATWOOT_ENABLED, ADMISSION_ENABLED, ADMISSION_QUEUE_NOTICE, DEADLINE_FAQ_THRESHOLD
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -106,71 +114,160 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, bas
         await connect_with_agent(update, context)
         return
     
-    chatwoot_conversation_id = None
-    
-    # Если Chatwoot включен, пытаемся использовать его
-    if CHATWOOT_ENABLED:
-        try:
-            # Проверяем, зарегистрирован ли пользователь
-            if user_id not in user_states:
-                # Если нет - регистрируем
-                contact = create_or_get_chatwoot_contact(
-                    user_id, 
-                    update.effective_user.first_name, 
-                    update.effective_user.last_name, 
-                    update.effective_user.username
+    # Этапы, не зависящие друг от друга, идут параллельно; длительности пишутся в таймлайн
+    timeline = Timeline(f"сообщения пользователя {user_id}")
+    timeline_token = current_timeline.set(timeline)
+    requests_in_flight.inc()
+    try:
+        # Корневой спан трассы сообщения: этапы таймлайна и вызовы Chatwoot становятся его потомками
+        with span("handle_message", user_id=user_id, question_chars=len(question)) as message_span:
+            chatwoot_task = None
+            if CHATWOOT_ENABLED:
+                # Регистрация и копия вопроса в Chatwoot — блокирующие HTTP-запросы, уводим их в поток
+                chatwoot_task = asyncio.create_task(
+                    run_stage("chatwoot_question", asyncio.to_thread(mirror_question_to_chatwoot, update.effective_user, question))
                 )
-                
-                if contact and "id" in contact:
-                    conversation_id = get_or_create_chatwoot_conversation(contact["id"])
-                    if conversation_id:
-                        user_states[user_id] = {
-                            "with_agent": False,
-                            "conversation_id": conversation_id,
-                            "contact_id": contact["id"],
-                            "history_sent": False
-                        }
-                        
-                        # Назначение на бота
-                        assign_agent_to_conversation(conversation_id)
-            
-            # Отправляем сообщение пользователя в Chatwoot
-            if user_id in user_states and "conversation_id" in user_states[user_id]:
-                chatwoot_conversation_id = user_states[user_id]["conversation_id"]
-                send_message_to_chatwoot(chatwoot_conversation_id, question, "incoming", "user")
-                
                 # Если пользователь общается с агентом, не отвечаем ботом
-                if user_states[user_id].get("with_agent", False):
+                if user_states.get(user_id, {}).get("with_agent", False):
+                    message_span.set(with_agent=True)
+                    await chatwoot_task
                     return
-        except Exception as e:
-            logging.error(f"Ошибка при взаимодействии с Chatwoot: {e}")
-    
-    # Отправка уведомления "печатает..."
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
-    
-    # Обработка запроса ботом
-    response = await process_question(user_id, question, base_retriever, reranker)
-    
-    # Сохраняем ответ бота в историю
-    add_message_to_history(user_id, "bot", response)
-    
-    # Добавляем информацию о возможности вызова оператора
-    response_with_hint = (
-        f"{response}\n\n"
-        "Если вам нужна помощь оператора, просто напишите 'оператор' или 'нужен оператор'."
-    )
-    
-    # Отправляем ответ пользователю (без кнопки)
-    await update.message.reply_text(response_with_hint)
-    
-    # Отправляем ответ бота в Chatwoot, но с меткой [BOT_MESSAGE], чтобы избежать дублирования
-    if CHATWOOT_ENABLED and user_id in user_states and "conversation_id" in user_states[user_id]:
-        send_message_to_chatwoot(
-            user_states[user_id]["conversation_id"], 
-            f"[BOT_MESSAGE]{response}", 
-            "outgoing", 
-            "bot"
+
+            # Допуск к RAG: лимит частоты вопросов пользователя, ограниченное число одновременных
+            # прогонов и очередь ограниченной длины. Лимит — только здесь: сообщения, идущие
+            # оператору, уже скопированы в Chatwoot выше и не отсекаются
+            if ADMISSION_ENABLED:
+                allowed, retry_after = rate_limiter.allow(user_id)
+                if not allowed:
+                    admission.rate_limited += 1
+                    message_span.set(rate_limited=True)
+                    stages = [run_stage("reply", update.message.reply_text(
+                        f"Вы отправляете вопросы слишком часто. Пожалуйста, повторите через {max(1, round(retry_after))} сек."
+                    ))]
+                    if chatwoot_task:
+                        stages.append(chatwoot_task)
+                    await asyncio.gather(*stages)
+                    return
+
+                with timeline.stage("admission"):
+                    admitted = await admission.acquire(on_queued=lambda position: notify_queued(update, position))
+                if not admitted:
+                    message_span.set(shed=True)
+                    response, reply_markup = await shed_response(user_id, question)
+                    stages = [run_stage("reply", update.message.reply_text(response, reply_markup=reply_markup))]
+                    if chatwoot_task:
+                        stages.append(run_stage("chatwoot_answer", mirror_answer_to_chatwoot(chatwoot_task, user_id, response)))
+                    await asyncio.gather(*stages)
+                    return
+
+            # Отправка уведомления "печатает..." параллельно с обработкой запроса
+            typing_task = asyncio.create_task(
+                run_stage("typing", context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing'))
+            )
+
+            # Обработка запроса ботом
+            try:
+                with timeline.stage("rag"):
+                    response = await process_question(user_id, question, base_retriever, reranker)
+            finally:
+                if ADMISSION_ENABLED:
+                    admission.release()
+
+            message_span.set(response_chars=len(response))
+
+            # Сохраняем ответ бота в историю
+            add_message_to_history(user_id, "bot", response)
+
+            # Добавляем информацию о возможности вызова оператора
+            response_with_hint = (
+                f"{response}\n\n"
+                "Если вам нужна помощь оператора, просто напишите 'оператор' или 'нужен оператор'."
+            )
+
+            # Ответ пользователю (без кнопки) и копия ответа в Chatwoot уходят одновременно
+            stages = [typing_task, run_stage("reply", update.message.reply_text(response_with_hint))]
+            if chatwoot_task:
+                stages.append(run_stage("chatwoot_answer", mirror_answer_to_chatwoot(chatwoot_task, user_id, response)))
+            await asyncio.gather(*stages)
+    finally:
+        requests_in_flight.dec()
+        current_timeline.reset(timeline_token)
+        timeline.log()
+
+async def notify_queued(update, position):
+    """Сообщает стоящему в очереди его номер, если очередь длинная"""
+    if not ADMISSION_QUEUE_NOTICE or position < ADMISSION_QUEUE_NOTICE:
+        return
+    try:
+        await update.message.reply_text(f"Сейчас много вопросов. Ваш вопрос в очереди, перед вами {position - 1}. Ответ придёт сюда.")
+    except Exception as e:
+        logging.error(f"Не удалось сообщить позицию в очереди: {e}")
+
+async def shed_response(user_id, question):
+    """
+    Ответ на сброшенный запрос (очередь полна): недавний ответ на тот же вопрос,
+    ответ из FAQ с пониженным порогом, предложение оператора или позиция в очереди.
+    Возвращает (текст, клавиатура или None).
+    """
+    clean_question = clean_text(question)
+    answer = answer_cache.get(clean_question)
+    if answer:
+        admission.record_shed("answer_cache")
+        return answer, None
+    faq_index = faq.current_faq_index()
+    if faq_index:
+        answer, _ = await asyncio.to_thread(faq_index.match, clean_question, DEADLINE_FAQ_THRESHOLD)
+        if answer:
+            admission.record_shed("faq")
+            return answer, None
+
+    ahead = admission.active + admission.queue_length
+    if CHATWOOT_ENABLED and user_id in user_states:
+        admission.record_shed("operator_offer")
+        keyboard = [[InlineKeyboardButton("Связаться с оператором", callback_data="connect_agent")]]
+        return (
+            f"Сейчас очень много вопросов: перед вами {ahead}. Повторите вопрос через пару минут "
+            "или свяжитесь с оператором.",
+            InlineKeyboardMarkup(keyboard)
         )
+    admission.record_shed("queue_full")
+    return f"Сейчас очень много вопросов: перед вами {ahead}. Пожалуйста, повторите вопрос через пару минут.", None
+
+def mirror_question_to_chatwoot(user, question):
+    """Регистрирует пользователя в Chatwoot (если нужно) и отправляет туда его вопрос"""
+    user_id = user.id
+    try:
+        # Проверяем, зарегистрирован ли пользователь
+        if user_id not in user_states:
+            # Если нет - регистрируем
+            contact = create_or_get_chatwoot_contact(user_id, user.first_name, user.last_name, user.username)
+
+            if contact and "id" in contact:
+                conversation_id = get_or_create_chatwoot_conversation(contact["id"])
+                if conversation_id:
+                    user_states[user_id] = {
+                        "with_agent": False,
+                        "conversation_id": conversation_id,
+                        "contact_id": contact["id"],
+                        "history_sent": False
+                    }
+
+                    # Назначение на бота
+                    assign_agent_to_conversation(conversation_id)
+
+        # Отправляем сообщение пользователя в Chatwoot
+        if user_id in user_states and "conversation_id" in user_states[user_id]:
+            send_message_to_chatwoot(user_states[user_id]["conversation_id"], question, "incoming", "user")
+    except Exception as e:
+        logging.error(f"Ошибка при взаимодействии с Chatwoot: {e}")
+
+async def mirror_answer_to_chatwoot(question_task, user_id, response):
+    """Копия ответа уходит в Chatwoot после копии вопроса, чтобы не нарушить порядок в разговоре"""
+    await question_task
+    state = user_states.get(user_id)
+    if state and "conversation_id" in state:
+        # Метка [BOT_MESSAGE] нужна, чтобы избежать дублирования
+        await asyncio.to_thread(send_message_to_chatwoot, state["conversation_id"], f"[BOT_MESSAGE]{response}", "outgoing", "bot")
 
 async def connect_with_agent(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Функция для соединения пользователя с оператором"""
@@ -221,7 +318,7 @@ async def connect_with_agent(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 logging.error("Не удалось создать/получить контакт")
         else:
             # Если уже есть - просто обновляем статус
-            user_states[user_id]["with_agent"] = True
+            update_user_state(user_id, with_agent=True)
             logging.info(f"Пользователь {user_id} уже зарегистрирован, обновлен статус with_agent=True")
         
         if user_id in user_states and "conversation_id" in user_states[user_id]:
@@ -244,7 +341,7 @@ async def connect_with_agent(update: Update, context: ContextTypes.DEFAULT_TYPE)
                         "bot",
                         True  # также делаем приватным на всякий случай
                     )
-                    user_states[user_id]["history_sent"] = True
+                    update_user_state(user_id, history_sent=True)
                 
                 # Отправляем уведомление в Chatwoot с префиксом [INTERNAL_MESSAGE]
                 logging.info(f"Отправка уведомления о запросе оператора в Chatwoot для разговора {conversation_id}")
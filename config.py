@@ -1,9 +1,15 @@
 import os
+import socket
 import logging
 
 # === Логирование ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+
+def _env_flag(name, default):
+    """Читает булев флаг из переменной окружения (1/true/yes/on)"""
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
 # === Конфигурация ===
 CHROMA_HOST = os.getenv("CHROMA_HOST", '91.228.154.144')
 CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8077"))
@@ -11,8 +17,210 @@ COLLECTION_NAME = os.getenv("COLLECTION_NAME", "yuzhane")
 EMBED_MODEL_PATH = os.getenv("EMBED_MODEL_PATH", "/app/models/sbert_cache/intfloat_multilingual-e5-base")
 HF_API_KEY = os.getenv("HF_API_KEY")
 HF_ENDPOINT_URL = os.getenv("HF_ENDPOINT_URL")
+# Несколько реплик генерации через запятую, у каждой необязательный вес: "http://a/completion 2, http://b/completion".
+# Если не задано — используется единственный HF_ENDPOINT_URL
+HF_ENDPOINT_URLS = os.getenv("HF_ENDPOINT_URLS") or HF_ENDPOINT_URL or ""
 RERANKER_PATH = os.getenv("RERANKER_PATH", "/app/models/reranker_cache/cross-encoder_ms-marco-MiniLM-L-6-v2")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Адрес Bot API (свой сервер telegram-bot-api или локальная заглушка в бенчмарках)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Несколько жилых комплексов в одном процессе: JSON-файл со списком тенантов (пример — tenants-example.json).
+# У каждого свой бот, коллекция Chroma, промпт, инбокс Chatwoot и FAQ; модели, пул инференса и
+# соединения общие. Без файла — один тенант из TELEGRAM_BOT_TOKEN, COLLECTION_NAME и RAG_PROMPT_TEMPLATE
+TENANTS_FILE = os.getenv("TENANTS_FILE")
+
+# Сколько апдейтов Telegram обрабатывать одновременно (1 — строго последовательно)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "1"))
+
+# === Запуск ===
+# Эндпоинт /ready на порту вебхука и прогрев моделей перед стартом. С READINESS_ENDPOINT_ENABLED
+# сервер вебхука поднимается и без Chatwoot — вместе с /webhook и /stats/* на 0.0.0.0
+READINESS_ENDPOINT_ENABLED = _env_flag("READINESS_ENDPOINT_ENABLED", "false")
+STARTUP_WARMUP_ENABLED = _env_flag("STARTUP_WARMUP_ENABLED", "true")
+
+# === Трассировка и диагностика ===
+# Спаны обработки сообщения и вебхуков (этапы, вызовы Chatwoot) в JSONL-файле с ротацией. Сохраняется
+# доля TRACE_SAMPLE_RATE трасс и все трассы дольше TRACE_SLOW_SECONDS (решение принимается в конце трассы)
+TRACING_ENABLED = _env_flag("TRACING_ENABLED", "false")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+# Токен административных эндпоинтов (/admin/*, заголовок X-Admin-Token); без токена они выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# /admin/memory: размеры структур состояния, память моделей и рост аллокаций (tracemalloc запускается
+# первым вызовом и замедляет аллокации, пока его не остановят ?stop=1). Выключено — эндпоинт недоступен
+MEMORY_INTROSPECTION_ENABLED = _env_flag("MEMORY_INTROSPECTION_ENABLED", "false")
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "1"))
+
+# === Горизонтальное масштабирование ===
+# Несколько воркеров (процессов или машин) с общим состоянием. Пользователи делятся на WORKER_SHARDS шардов
+# по Telegram id, воркер обрабатывает свой шард WORKER_SHARD. getUpdates опрашивает один воркер — держатель
+# аренды в хранилище (продлевается, пока он жив), и раскладывает апдейты по очередям шардов; туда же
+# перенаправляются вебхуки Chatwoot чужих пользователей. STATE_STORE_URL: sqlite:///файл (воркеры на одной
+# машине) или redis://хост:порт/база (пакет redis)
+SCALE_OUT_ENABLED = _env_flag("SCALE_OUT_ENABLED", "false")
+STATE_STORE_URL = os.getenv("STATE_STORE_URL", "sqlite:///state.db")
+WORKER_SHARDS = int(os.getenv("WORKER_SHARDS", "1"))
+WORKER_SHARD = int(os.getenv("WORKER_SHARD", "0"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+POLLER_LEASE_TTL = float(os.getenv("POLLER_LEASE_TTL", "15"))
+SHARD_QUEUE_POLL_INTERVAL = float(os.getenv("SHARD_QUEUE_POLL_INTERVAL", "0.1"))
+# Сколько последних сообщений хранить в истории пользователя. История в общем хранилище перезаписывается
+# целиком на каждое сообщение, поэтому без предела запись растёт вместе с перепиской; оператору уходят 20
+MESSAGE_HISTORY_LIMIT = int(os.getenv("MESSAGE_HISTORY_LIMIT", "50"))
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "5011"))
+
+# === Допуск запросов под нагрузкой ===
+# Лимит сообщений одного пользователя (токен-бакет: ADMISSION_USER_RATE в минуту, запас ADMISSION_USER_BURST),
+# не больше ADMISSION_MAX_CONCURRENT одновременных прогонов RAG (общие для тенантов) и очередь до
+# ADMISSION_MAX_QUEUE ожидающих у каждого тенанта; освободившиеся слоты раздаются тенантам по кругу.
+# При полной очереди запрос сбрасывается: ответ из кэша недавних ответов или FAQ, иначе предложение
+# оператора (с Chatwoot) или сообщение о позиции в очереди. Стоящим в очереди с позиции
+# ADMISSION_QUEUE_NOTICE и дальше бот сообщает их номер (0 — не сообщать)
+ADMISSION_ENABLED = _env_flag("ADMISSION_ENABLED", "false")
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "6"))
+ADMISSION_USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "3"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_NOTICE = int(os.getenv("ADMISSION_QUEUE_NOTICE", "5"))
+ADMISSION_ANSWER_CACHE_SIZE = int(os.getenv("ADMISSION_ANSWER_CACHE_SIZE", "1000"))
+
+# === Быстрые ответы (FAQ) ===
+# Курируемые ответы из JSON-файла (пример — faq-example.json) отдаются без поиска и LLM,
+# если косинус вопроса с одной из формулировок не ниже FAQ_THRESHOLD (обе стороны кодируются как запросы,
+# дословный вопрос даёт 1.0). Файл перечитывается при изменении
+FAQ_ENABLED = _env_flag("FAQ_ENABLED", "true")
+FAQ_PATH = os.getenv("FAQ_PATH", "faq.json")
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.92"))
+FAQ_RELOAD_INTERVAL = float(os.getenv("FAQ_RELOAD_INTERVAL", "5"))
+
+# === Поиск ===
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "50"))
+
+# Объединение одновременных запросов к Chroma в один вызов collection.query
+RETRIEVAL_BATCH_ENABLED = _env_flag("RETRIEVAL_BATCH_ENABLED", "true")
+RETRIEVAL_BATCH_MAX_SIZE = int(os.getenv("RETRIEVAL_BATCH_MAX_SIZE", "32"))
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "5"))
+RETRIEVAL_BATCH_WORKERS = int(os.getenv("RETRIEVAL_BATCH_WORKERS", "2"))
+
+# Кэш кандидатов сессии: для уточняющего вопроса (is_contextual_followup) ищутся только
+# SESSION_DELTA_K документов, и оцениваются лишь пары, которых нет в наборе прошлого вопроса
+SESSION_CACHE_ENABLED = _env_flag("SESSION_CACHE_ENABLED", "false")
+SESSION_DELTA_K = int(os.getenv("SESSION_DELTA_K", "10"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "600"))
+SESSION_CACHE_MAX_USERS = int(os.getenv("SESSION_CACHE_MAX_USERS", "10000"))
+
+# Гибридный поиск: плотный + BM25 с слиянием через Reciprocal Rank Fusion
+HYBRID_SEARCH_ENABLED = _env_flag("HYBRID_SEARCH_ENABLED", "false")
+HYBRID_LEXICAL_K = int(os.getenv("HYBRID_LEXICAL_K", "50"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_TOP_N = int(os.getenv("HYBRID_TOP_N", "20"))  # сколько кандидатов отдаём на реранкинг
+# Как часто сверять число документов коллекции с BM25 индексом (перестройка после ingest.py); 0 — не сверять
+HYBRID_REFRESH_INTERVAL = float(os.getenv("HYBRID_REFRESH_INTERVAL", "60"))
+
+# === Бэкенд инференса моделей ===
+# torch — PyTorch как раньше, onnx — ONNX Runtime FP32, onnx-int8 — динамически квантованная модель.
+# ONNX-файлы создаются командой python export_onnx.py в <путь модели>/<ONNX_DIR_NAME>
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_DIR_NAME = os.getenv("ONNX_DIR_NAME", "onnx")
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "0"))  # 0 — решает ONNX Runtime
+
+# Пул процессов для инференса: 0 — модели работают в процессе бота.
+# INFERENCE_POOL_PRELOAD=true — модели загружаются до fork и делятся copy-on-write (torch),
+# false — каждый воркер загружает модели сам (обязательно для onnx/onnx-int8)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "0"))  # 0 — ядра / воркеры
+INFERENCE_POOL_PRELOAD = _env_flag("INFERENCE_POOL_PRELOAD", "true")
+# Сколько раз перезапускать упавший воркер (замена загружает модели сама)
+INFERENCE_WORKER_MAX_RESTARTS = int(os.getenv("INFERENCE_WORKER_MAX_RESTARTS", "3"))
+
+# === Реранкинг ===
+# Кэш токенов чанков для cross-encoder (по хэшу текста): при запросе токенизируется только вопрос.
+# Выключен по умолчанию: обрезка длинных пар до max_length может разойтись с токенизатором на
+# один токен, и оценки немного отличаются от обычного CrossEncoder — включайте после сверки на своих данных
+RERANK_TOKEN_CACHE_ENABLED = _env_flag("RERANK_TOKEN_CACHE_ENABLED", "false")
+RERANK_TOKEN_CACHE_SIZE = int(os.getenv("RERANK_TOKEN_CACHE_SIZE", "20000"))
+
+# Схлопывание почти одинаковых чанков (SimHash) перед реранкингом и сборкой промпта.
+# DEDUP_MAX_DISTANCE — максимальное расстояние Хэмминга между 64-битными подписями дублей
+DEDUP_ENABLED = _env_flag("DEDUP_ENABLED", "false")
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
+
+# Каскад: сначала оцениваются первые RERANK_CASCADE_FIRST_SLICE кандидатов,
+# следующие порции — только если лучшая оценка ниже CONFIDENT_SCORE
+# или последняя порция отстаёт от лучшей оценки меньше чем на MARGIN. Неоценённые кандидаты
+# идут в промпт после оценённых в порядке поиска; RERANK_CASCADE_KEEP_UNSCORED=false их отбрасывает
+RERANK_CASCADE_ENABLED = _env_flag("RERANK_CASCADE_ENABLED", "false")
+RERANK_CASCADE_FIRST_SLICE = int(os.getenv("RERANK_CASCADE_FIRST_SLICE", "10"))
+RERANK_CASCADE_STEP = int(os.getenv("RERANK_CASCADE_STEP", "10"))
+RERANK_CASCADE_MAX_DEPTH = int(os.getenv("RERANK_CASCADE_MAX_DEPTH", "50"))
+RERANK_CASCADE_CONFIDENT_SCORE = float(os.getenv("RERANK_CASCADE_CONFIDENT_SCORE", "0.7"))
+RERANK_CASCADE_MARGIN = float(os.getenv("RERANK_CASCADE_MARGIN", "0.2"))
+RERANK_CASCADE_KEEP_UNSCORED = _env_flag("RERANK_CASCADE_KEEP_UNSCORED", "true")
+
+# === Генерация (LLM) ===
+# Таймауты в секундах: соединение, чтение одной попытки и общий бюджет вызова с повторами
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "90"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))  # keep-alive соединений к эндпоинту
+
+# Хеджирование: если ответа нет дольше p95 недавних задержек (но не меньше MIN_DELAY),
+# отправляется дубль запроса. Удваивает нагрузку на хвосте, поэтому по умолчанию выключено
+LLM_HEDGE_ENABLED = _env_flag("LLM_HEDGE_ENABLED", "false")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))  # не больше 10% дублей
+
+# Автомат (у каждой реплики свой): после LLM_BREAKER_FAILURES ошибок подряд реплика LLM_BREAKER_RESET
+# секунд не получает запросов; если недоступны все, пользователь сразу получает LLM_FALLBACK_REPLY
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Переиспользование префикса промпта на сервере генерации (llama.cpp server и совместимые).
+# LLM_PROMPT_LAYOUT=cache — чанки, уже бывшие в прошлом промпте пользователя, идут первыми в прежнем
+# порядке, новые дописываются после них: префикс (инструкции + общий контекст) совпадает байт в байт.
+# LLM_CACHE_PROMPT — передавать cache_prompt, LLM_SLOT_COUNT > 0 — закреплять пользователя за слотом
+# (id_slot), LLM_USER_AFFINITY — отправлять пользователя на одну и ту же реплику, пока она не перегружена.
+# Запросы пользователей с одним слотом на реплике идут последовательно: слот llama.cpp обслуживает один запрос
+LLM_PROMPT_LAYOUT = os.getenv("LLM_PROMPT_LAYOUT", "default")
+LLM_CACHE_PROMPT = _env_flag("LLM_CACHE_PROMPT", "false")
+LLM_SLOT_COUNT = int(os.getenv("LLM_SLOT_COUNT", "0"))
+LLM_USER_AFFINITY = _env_flag("LLM_USER_AFFINITY", "false")
+
+# Проверка здоровья реплик: GET <хост реплики><LLM_HEALTH_PATH> раз в LLM_HEALTH_INTERVAL секунд (0 — выключено).
+# Нездоровая реплика выводится из ротации, только пока есть здоровые: последнюю запросы не обходят
+LLM_HEALTH_PATH = os.getenv("LLM_HEALTH_PATH", "/health")
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))
+LLM_FALLBACK_REPLY = os.getenv(
+    "LLM_FALLBACK_REPLY",
+    "Сервис ответов сейчас перегружен. Пожалуйста, повторите вопрос через минуту или дождитесь ответа менеджера."
+)
+
+# === Дедлайн ответа ===
+# Каждый ответ укладывается в ANSWER_DEADLINE секунд, у этапов свои бюджеты. Опоздавший этап не ждут:
+# уточняющий вопрос считается новым, реранкинг обрезается или пропускается (порядок поиска),
+# контекст сокращается до DEADLINE_SHRUNK_CONTEXT чанков, если на LLM остаётся меньше DEADLINE_LLM_MIN
+# секунд, а без результатов поиска отдаётся прошлый набор кандидатов или ответ из FAQ с порогом
+# DEADLINE_FAQ_THRESHOLD. Меняет ответы под нагрузкой, поэтому по умолчанию выключено
+DEADLINE_ENABLED = _env_flag("DEADLINE_ENABLED", "false")
+ANSWER_DEADLINE = float(os.getenv("ANSWER_DEADLINE", "30"))
+DEADLINE_FOLLOWUP_BUDGET = float(os.getenv("DEADLINE_FOLLOWUP_BUDGET", "1"))
+DEADLINE_RETRIEVAL_BUDGET = float(os.getenv("DEADLINE_RETRIEVAL_BUDGET", "3"))
+DEADLINE_RERANK_BUDGET = float(os.getenv("DEADLINE_RERANK_BUDGET", "4"))
+DEADLINE_MIN_RERANK_PAIRS = int(os.getenv("DEADLINE_MIN_RERANK_PAIRS", "5"))  # меньше — реранкинг пропускается
+DEADLINE_LLM_MIN = float(os.getenv("DEADLINE_LLM_MIN", "10"))
+DEADLINE_SHRUNK_CONTEXT = int(os.getenv("DEADLINE_SHRUNK_CONTEXT", "8"))
+DEADLINE_FAQ_THRESHOLD = float(os.getenv("DEADLINE_FAQ_THRESHOLD", "0.85"))
+DEADLINE_REPLY = os.getenv(
+    "DEADLINE_REPLY",
+    "Не успеваю подобрать ответ прямо сейчас. Пожалуйста, повторите вопрос чуть позже или дождитесь ответа менеджера."
+)
 
 # Chatwoot Configuration
 CHATWOOT_BASE_URL = os.getenv("CHATWOOT_BASE_URL")
@@ -0,0 +1,75 @@
+"""
+Экспорт локальных моделей (эмбеддер и cross-encoder) в ONNX FP32 и int8
+с проверкой паритета на примерах вопросов.
+
+    python export_onnx.py                  # экспорт обеих моделей + проверка
+    python export_onnx.py --only reranker --no-quantize
+    python export_onnx.py --check-only     # только проверка уже экспортированных
+"""
+import sys
+import logging
+import argparse
+
+from config import EMBED_MODEL_PATH, RERANKER_PATH, ONNX_DIR_NAME
+from services.inference_backends import (
+    export_onnx,
+    check_embeddings_parity,
+    check_reranker_parity
+)
+
+SAMPLE_QUERIES = [
+    "Где находится офис продаж?",
+    "Сколько квартир на третьем этаже?",
+    "Есть ли подземный паркинг?",
+    "Какая стоимость квадратного метра в доме 2?",
+]
+SAMPLE_PASSAGES = [
+    "Офис продаж расположен на первом этаже дома 1, работает ежедневно с 9:00 до 20:00.",
+    "На третьем этаже расположено 12 квартир: 4 однокомнатные, 6 двухкомнатных и 2 трёхкомнатные.",
+    "Подземный паркинг на 240 машиномест, въезд со стороны улицы.",
+]
+
+# Минимальные требования к паритету для каждого бэкенда
+MIN_COSINE = {"onnx": 0.999, "onnx-int8": 0.97}
+MAX_SCORE_DIFF = {"onnx": 1e-3, "onnx-int8": 0.05}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=["embeddings", "reranker"], help="экспортировать только одну модель")
+    parser.add_argument("--no-quantize", action="store_true", help="не создавать int8-версию")
+    parser.add_argument("--check-only", action="store_true", help="пропустить экспорт, только проверить паритет")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    models = {"embeddings": EMBED_MODEL_PATH, "reranker": RERANKER_PATH}
+    if args.only:
+        models = {args.only: models[args.only]}
+    backends = ["onnx"] if args.no_quantize else ["onnx", "onnx-int8"]
+
+    if not args.check_only:
+        for kind, path in models.items():
+            export_onnx(path, kind, onnx_dir=ONNX_DIR_NAME, quantize=not args.no_quantize, opset=args.opset)
+
+    ok = True
+    pairs = [(query, passage) for query in SAMPLE_QUERIES for passage in SAMPLE_PASSAGES]
+    for backend in backends:
+        if "embeddings" in models:
+            result = check_embeddings_parity(
+                models["embeddings"], backend, [f"query: {q}" for q in SAMPLE_QUERIES] + SAMPLE_PASSAGES,
+                onnx_dir=ONNX_DIR_NAME
+            )
+            passed = result["min_cosine"] >= MIN_COSINE[backend]
+            ok &= passed
+            logging.info(f"Эмбеддер {backend}: {result} {'OK' if passed else 'РАСХОЖДЕНИЕ'}")
+        if "reranker" in models:
+            result = check_reranker_parity(models["reranker"], backend, pairs, onnx_dir=ONNX_DIR_NAME)
+            passed = result["max_abs_diff"] <= MAX_SCORE_DIFF[backend] and result["same_top1"]
+            ok &= passed
+            logging.info(f"Реранкер {backend}: {result} {'OK' if passed else 'РАСХОЖДЕНИЕ'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
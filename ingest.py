@@ -0,0 +1,92 @@
+"""
+Загрузка PDF и HTML в коллекцию Chroma.
+
+Файлы разбираются и режутся на чанки в пуле процессов, чанки эмбеддятся
+большими батчами той же моделью (EMBED_MODEL_PATH) и загружаются в Chroma
+пачками. Неизменённые чанки пропускаются по хэшу содержимого, поэтому
+повторный запуск эмбеддит только изменившееся. Полностью загруженные файлы
+записываются в файл состояния — после прерывания запуск продолжается с места
+остановки. Файл, который не удалось разобрать, пропускается и тоже
+записывается в состояние; повторно его разбирают --retry-failed или --force.
+Запущенный бот с гибридным поиском перестраивает BM25 индекс сам, заметив
+новое число документов (раз в HYBRID_REFRESH_INTERVAL секунд).
+
+    python ingest.py data/docs
+    python ingest.py data/docs/prices.pdf --force
+"""
+import os
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from config import (
+    CHROMA_HOST,
+    CHROMA_PORT,
+    COLLECTION_NAME,
+    EMBED_MODEL_PATH,
+    INFERENCE_BACKEND,
+    ONNX_DIR_NAME
+)
+from services.ingestion import discover_sources, iter_parsed, IngestionState, Ingestor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="файлы или каталоги с PDF/HTML")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов для разбора файлов")
+    parser.add_argument("--batch-size", type=int, default=256, help="чанков на один батч эмбеддинга и upsert")
+    parser.add_argument("--state-file", default=".ingest_state.json")
+    parser.add_argument("--force", action="store_true", help="разобрать все файлы заново, игнорируя файл состояния")
+    parser.add_argument("--retry-failed", action="store_true", help="снова разобрать неизменённые файлы, упавшие при разборе")
+    parser.add_argument("--no-prune", action="store_true", help="не удалять устаревшие чанки изменённых файлов")
+    args = parser.parse_args()
+
+    import chromadb
+    from services.inference_backends import load_embeddings
+
+    state = IngestionState(args.state_file)
+    sources = discover_sources(args.paths)
+    pending = sources if args.force else [
+        path for path in sources
+        if not state.is_current(path) or (args.retry_failed and state.is_failed(path))
+    ]
+    logging.info(f"Найдено файлов: {len(sources)}, к обработке: {len(pending)}")
+    if not pending:
+        return
+
+    # Пул разбора стартует через spawn: в нём не нужны ни torch, ни загруженная модель
+    executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+    collection = client.get_or_create_collection(args.collection)
+    kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME}
+    embeddings = load_embeddings(INFERENCE_BACKEND, EMBED_MODEL_PATH, **kwargs)
+    ingestor = Ingestor(collection, embeddings, state, batch_size=args.batch_size, prune=not args.no_prune)
+
+    with executor, tqdm(total=len(pending), unit="файл") as progress:
+        parsed = iter_parsed(executor, pending, args.chunk_size, args.chunk_overlap, window=args.workers * 2)
+        for source, chunks, error in parsed:
+            if error is None:
+                ingestor.add(source, chunks)
+            else:
+                ingestor.fail(source, error)
+            progress.update(1)
+            progress.set_postfix(
+                chunks=ingestor.chunks_seen, new=ingestor.chunks_embedded, failed=len(ingestor.files_failed),
+                rate=f"{ingestor.throughput:.0f}/s"
+            )
+        ingestor.flush()
+
+    logging.info(f"Загрузка завершена: {ingestor.summary()}")
+    for source in ingestor.files_failed:
+        logging.warning(f"Не загружен: {source} ({state.sources[source]['error']})")
+
+
+if __name__ == "__main__":
+    main()
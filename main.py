@@ -1,7 +1,11 @@
 import os
+import signal
+import asyncio
 import threading
 import logging
+from functools import partial
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения из .env файла
@@ -15,90 +19,384 @@ for env_path in env_paths:
 else:
     logging.warning("Файл .env не найден. Используем переменные окружения из системы.")
 
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-import chromadb
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from sentence_transformers import CrossEncoder
-from huggingface_hub import InferenceClient
-
+# Тяжёлые библиотеки (chromadb, LangChain, sentence_transformers, torch) импортируются
+# внутри функций загрузки — они выполняются параллельно, пока уже отвечает /ready
 from config import (
-    CHROMA_HOST, 
-    CHROMA_PORT, 
-    COLLECTION_NAME, 
-    EMBED_MODEL_PATH, 
-    RERANKER_PATH, 
-    HF_ENDPOINT_URL, 
-    HF_API_KEY, 
-    TELEGRAM_BOT_TOKEN, 
-    CHATWOOT_ENABLED
+    CHROMA_HOST,
+    CHROMA_PORT,
+    COLLECTION_NAME,
+    EMBED_MODEL_PATH,
+    RERANKER_PATH,
+    HF_ENDPOINT_URLS,
+    HF_API_KEY,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_URL,
+    CHATWOOT_ENABLED,
+    BOT_CONCURRENT_UPDATES,
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    RETRIEVAL_K,
+    RETRIEVAL_BATCH_ENABLED,
+    RETRIEVAL_BATCH_MAX_SIZE,
+    RETRIEVAL_BATCH_WINDOW_MS,
+    RETRIEVAL_BATCH_WORKERS,
+    HYBRID_SEARCH_ENABLED,
+    HYBRID_LEXICAL_K,
+    HYBRID_RRF_K,
+    HYBRID_TOP_N,
+    HYBRID_REFRESH_INTERVAL,
+    RERANK_CASCADE_ENABLED,
+    RERANK_CASCADE_FIRST_SLICE,
+    RERANK_CASCADE_STEP,
+    RERANK_CASCADE_MAX_DEPTH,
+    RERANK_CASCADE_CONFIDENT_SCORE,
+    RERANK_CASCADE_MARGIN,
+    RERANK_CASCADE_KEEP_UNSCORED,
+    INFERENCE_BACKEND,
+    ONNX_DIR_NAME,
+    ONNX_NUM_THREADS,
+    INFERENCE_WORKERS,
+    INFERENCE_WORKER_THREADS,
+    INFERENCE_POOL_PRELOAD,
+    INFERENCE_WORKER_MAX_RESTARTS,
+    RERANK_TOKEN_CACHE_ENABLED,
+    RERANK_TOKEN_CACHE_SIZE,
+    READINESS_ENDPOINT_ENABLED,
+    STARTUP_WARMUP_ENABLED,
+    FAQ_ENABLED,
+    FAQ_THRESHOLD,
+    FAQ_RELOAD_INTERVAL,
+    TENANTS_FILE,
+    SCALE_OUT_ENABLED,
+    WORKER_ID,
+    WORKER_SHARD,
+    WORKER_SHARDS
 )
-from services.chatwoot_service import validate_chatwoot_config
-from bot.handlers import start, help_command, handle_message
-from bot.callbacks import button_callback
-from webhook.app import run_webhook_server
+from services.startup import startup
+from services.tenants import load_tenants, bind_tenant
+from services import tenants as tenant_registry
+
+# === Этапы запуска ===
+def model_loader():
+    from services.inference_backends import load_models
+
+    model_kwargs = {} if INFERENCE_BACKEND == "torch" else {"onnx_dir": ONNX_DIR_NAME, "num_threads": ONNX_NUM_THREADS}
+    if RERANK_TOKEN_CACHE_ENABLED:
+        model_kwargs["token_cache_size"] = RERANK_TOKEN_CACHE_SIZE
+    return partial(load_models, INFERENCE_BACKEND, EMBED_MODEL_PATH, RERANKER_PATH, **model_kwargs)
+
+def start_inference_pool():
+    """
+    Fork воркеров пула инференса. Вызывается до запуска любых потоков (Flask,
+    параллельная инициализация): дочерний процесс, созданный fork во время импорта
+    или записи в лог в другом потоке, наследует захваченные блокировки и может
+    зависнуть. Загрузку моделей в воркерах ждёт load_inference_models.
+    """
+    from services.inference_pool import InferencePool
+
+    with startup.stage("inference_pool"):
+        return InferencePool(
+            model_loader(),
+            workers=INFERENCE_WORKERS,
+            threads_per_worker=INFERENCE_WORKER_THREADS,
+            preload=INFERENCE_POOL_PRELOAD,
+            wait=False,
+            max_restarts=INFERENCE_WORKER_MAX_RESTARTS
+        )
+
+def load_inference_models(inference_pool=None):
+    """Загружает эмбеддер и реранкер в процессе бота или ждёт их загрузки в пуле процессов"""
+    from services.inference_backends import TimedEmbeddings
+    from services.inference_pool import PooledEmbeddings, PooledCrossEncoder
+    from services.metrics import queue_depth
+
+    with startup.stage("models"):
+        if inference_pool:
+            inference_pool.wait_ready()
+            queue_depth.track(lambda: sum(len(worker.pending) for worker in inference_pool.workers), "inference_pool")
+            return TimedEmbeddings(PooledEmbeddings(inference_pool)), PooledCrossEncoder(inference_pool)
+        embedding_function, reranker = model_loader()()
+        return TimedEmbeddings(embedding_function), reranker
+
+def connect_chroma():
+    with startup.stage("chroma"):
+        import chromadb
+        chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
+        chroma_client.heartbeat()
+        return chroma_client
+
+def check_chatwoot():
+    with startup.stage("chatwoot"):
+        from services.chatwoot_service import validate_chatwoot_config
+        return validate_chatwoot_config()
+
+def import_bot_modules():
+    """Импорт обработчиков тянет за собой LangChain — делаем это параллельно с загрузкой моделей"""
+    with startup.stage("imports"):
+        import langchain_chroma
+        import bot.handlers
+        import bot.callbacks
+        import services.rag_service
+
+def build_retriever(chroma_client, embedding_function, collection_name=COLLECTION_NAME):
+    from langchain_chroma import Chroma
+    from services.retrieval_batcher import RetrievalBatcher
+    from services.metrics import queue_depth
+    from services.hybrid_search import BM25Index, HybridRetriever
+
+    with startup.stage(f"retriever:{collection_name}"):
+        vectorstore = Chroma(client=chroma_client, collection_name=collection_name, embedding_function=embedding_function)
+        collection = chroma_client.get_or_create_collection(collection_name)
+        if RETRIEVAL_BATCH_ENABLED:
+            # Одновременные запросы пользователей уходят в Chroma одним пакетом
+            base_retriever = RetrievalBatcher(
+                collection,
+                embedding_function,
+                k=RETRIEVAL_K,
+                max_batch_size=RETRIEVAL_BATCH_MAX_SIZE,
+                window_ms=RETRIEVAL_BATCH_WINDOW_MS,
+                workers=RETRIEVAL_BATCH_WORKERS
+            )
+            queue_depth.track(base_retriever.queue_size, f"retrieval_batch:{collection_name}")
+        else:
+            base_retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+
+        if HYBRID_SEARCH_ENABLED:
+            # BM25 по документам коллекции + RRF, на реранкинг уходит только HYBRID_TOP_N кандидатов
+            bm25_index = BM25Index.from_collection(collection)
+            base_retriever = HybridRetriever(
+                base_retriever,
+                bm25_index,
+                lexical_k=HYBRID_LEXICAL_K,
+                rrf_k=HYBRID_RRF_K,
+                top_n=HYBRID_TOP_N,
+                collection=collection,
+                refresh_interval=HYBRID_REFRESH_INTERVAL
+            )
+        return base_retriever
+
+def load_faq(embedding_function, tenant):
+    from services import faq
+
+    faq_path = tenant.faq_path
+    if not FAQ_ENABLED or not faq_path or not os.path.exists(faq_path):
+        logging.info(f"FAQ тенанта {tenant.name} не используется ({'выключен' if not FAQ_ENABLED else f'нет файла {faq_path}'})")
+        return
+    with startup.stage(f"faq:{tenant.name}"):
+        tenant.faq_index = faq.FaqIndex(
+            faq_path,
+            embedding_function,
+            threshold=FAQ_THRESHOLD,
+            reload_interval=FAQ_RELOAD_INTERVAL
+        )
+        if faq.faq_index is None:
+            faq.faq_index = tenant.faq_index
+
+def warmup(embedding_function, reranker, inference_pool):
+    """Первый прогон моделей, чтобы ленивую инициализацию ядер не оплачивал первый пользователь"""
+    with startup.stage("warmup"):
+        pairs = [("Где находится офис продаж?", "Офис продаж расположен на первом этаже дома 1.")]
+        if inference_pool:
+            # По запросу на каждый воркер: маршрутизация по загрузке раскладывает их по разным процессам
+            futures = [inference_pool.submit("embed_query", "прогрев") for _ in inference_pool.workers]
+            futures += [inference_pool.submit("predict", pairs) for _ in inference_pool.workers]
+            for future in futures:
+                future.result()
+        else:
+            embedding_function.embed_query("прогрев")
+            reranker.predict(pairs)
+
+def build_application(tenant, reranker, post_init=None, api_url=TELEGRAM_API_URL):
+    """Приложение PTB тенанта с обработчиками; Bot API — по адресу api_url"""
+    from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+    from bot.handlers import start, help_command, handle_message
+    from bot.callbacks import button_callback
+
+    # С контролем допуска сообщения должны сразу доходить до обработчика: RAG ограничивает его
+    # очередь, а лишние быстро получают ответ о перегрузке. Сама очередь апдейтов PTB не
+    # ограничена — сверх concurrent_updates одновременных обработчиков апдейты ждут в ней
+    concurrent_updates = BOT_CONCURRENT_UPDATES
+    if ADMISSION_ENABLED:
+        concurrent_updates = max(concurrent_updates, 2 * (ADMISSION_MAX_CONCURRENT + ADMISSION_MAX_QUEUE))
+
+    builder = (
+        ApplicationBuilder()
+        .token(tenant.bot_token)
+        .base_url(f"{api_url}/bot")
+        .base_file_url(f"{api_url}/file/bot")
+        .concurrent_updates(concurrent_updates)
+    )
+    if post_init:
+        builder = builder.post_init(post_init)
+    application = builder.build()
+
+    # Обработчики команд
+    application.add_handler(CommandHandler("start", bind_tenant(tenant, start)))
+    application.add_handler(CommandHandler("help", bind_tenant(tenant, help_command)))
+
+    # Обработчик колбеков от кнопок
+    application.add_handler(CallbackQueryHandler(bind_tenant(tenant, button_callback)))
+
+    # Обработчик текстовых сообщений
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND,
+            bind_tenant(tenant, partial(handle_message, base_retriever=tenant.retriever, reranker=reranker))
+        )
+    )
+    return application
 
 def main():
     global CHATWOOT_ENABLED
-    
+
     # Выводим информацию о загруженных переменных
     logging.info(f"TELEGRAM_BOT_TOKEN: {'Установлен' if TELEGRAM_BOT_TOKEN else 'Отсутствует'}")
     logging.info(f"CHROMA_HOST: {CHROMA_HOST}")
     logging.info(f"CHROMA_PORT: {CHROMA_PORT}")
     logging.info(f"HF_API_KEY: {'Установлен' if HF_API_KEY else 'Отсутствует'}")
-    logging.info(f"HF_ENDPOINT_URL: {'Установлен' if HF_ENDPOINT_URL else 'Отсутствует'}")
-    
-    # Проверяем соединение с Chatwoot
-    chatwoot_available = validate_chatwoot_config()
-    if not chatwoot_available:
-        logging.warning("⚠️ Интеграция с Chatwoot отключена из-за проблем с конфигурацией")
-        CHATWOOT_ENABLED = False
-    
+    logging.info(f"Эндпоинтов генерации: {HF_ENDPOINT_URLS.count(',') + 1 if HF_ENDPOINT_URLS else 'Отсутствуют'}")
+    if not (HF_API_KEY and HF_ENDPOINT_URLS):
+        logging.warning("⚠️ HF_API_KEY или HF_ENDPOINT_URL не установлены. Некоторые функции могут быть недоступны.")
+
+    # Тенанты: без TENANTS_FILE — один жилой комплекс из переменных окружения
+    tenants = load_tenants(TENANTS_FILE)
+    tenant_registry.tenants.extend(tenants)
+
     # Проверка наличия токена Telegram
-    if not TELEGRAM_BOT_TOKEN:
-        logging.error("❌ Токен Telegram бота не установлен. Установите переменную окружения TELEGRAM_BOT_TOKEN")
+    missing = [tenant.name for tenant in tenants if not tenant.bot_token]
+    if missing:
+        logging.error(f"❌ Токен Telegram бота не установлен (тенанты: {', '.join(missing)}). Установите TELEGRAM_BOT_TOKEN или токены в TENANTS_FILE")
         return
-    
-    # === Инициализация моделей ===
+
+    # Пул инференса — раньше любых потоков, см. start_inference_pool
+    inference_pool = start_inference_pool() if INFERENCE_WORKERS > 0 else None
+
+    # Затем Flask: /ready отвечает 503, пока идёт загрузка
+    if CHATWOOT_ENABLED or READINESS_ENDPOINT_ENABLED or SCALE_OUT_ENABLED:
+        from webhook.app import run_webhook_server
+        logging.info("Запуск вебхука и эндпоинта готовности...")
+        threading.Thread(target=run_webhook_server).start()
+
+    # === Инициализация моделей и подключений (параллельно) ===
     logging.info("Инициализация моделей и подключения к базе данных...")
-    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=False)
-    embedding_function = HuggingFaceEmbeddings(model_name=EMBED_MODEL_PATH, model_kwargs={"device": "cpu"})
-    vectorstore = Chroma(client=chroma_client, collection_name=COLLECTION_NAME, embedding_function=embedding_function)
-    base_retriever = vectorstore.as_retriever(search_kwargs={"k": 50})
-    reranker = CrossEncoder(RERANKER_PATH)
-    
-    if HF_API_KEY and HF_ENDPOINT_URL:
-        hf_client = InferenceClient(model=HF_ENDPOINT_URL, token=HF_API_KEY)
-    else:
-        logging.warning("⚠️ HF_API_KEY или HF_ENDPOINT_URL не установлены. Некоторые функции могут быть недоступны.")
-    
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup") as executor:
+        chatwoot_future = executor.submit(check_chatwoot)
+        chroma_future = executor.submit(connect_chroma)
+        imports_future = executor.submit(import_bot_modules)
+        embedding_function, reranker = load_inference_models(inference_pool)
+        chroma_client = chroma_future.result()
+        imports_future.result()
+        chatwoot_available = chatwoot_future.result()
+
+    if not chatwoot_available:
+        logging.warning("⚠️ Интеграция с Chatwoot отключена из-за проблем с конфигурацией")
+        CHATWOOT_ENABLED = False
+
+    # У каждого тенанта своя коллекция; эмбеддер и реранкер общие
+    for tenant in tenants:
+        tenant.retriever = build_retriever(chroma_client, embedding_function, tenant.collection_name)
+    if RERANK_CASCADE_ENABLED:
+        from services.cascade_reranker import CascadeReranker
+        reranker = CascadeReranker(
+            reranker,
+            first_slice=RERANK_CASCADE_FIRST_SLICE,
+            step=RERANK_CASCADE_STEP,
+            max_depth=RERANK_CASCADE_MAX_DEPTH,
+            confident_score=RERANK_CASCADE_CONFIDENT_SCORE,
+            margin=RERANK_CASCADE_MARGIN,
+            keep_unscored=RERANK_CASCADE_KEEP_UNSCORED
+        )
+    for tenant in tenants:
+        load_faq(embedding_function, tenant)
+
+    # Для /admin/memory: модели в том виде, в каком их видят обработчики
+    from services import memory
+    memory.models.update(embedder=embedding_function, reranker=reranker)
+    memory.inference_pool = inference_pool
+    if STARTUP_WARMUP_ENABLED:
+        warmup(embedding_function, reranker, inference_pool)
+
     # Создание и запуск Telegram бота
     logging.info("Настройка Telegram бота...")
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    
-    # Обработчик колбеков от кнопок
-    application.add_handler(CallbackQueryHandler(button_callback))
-    
-    # Обработчик текстовых сообщений
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            lambda update, context: handle_message(update, context, base_retriever, reranker)
-        )
-    )
-    
-    # Запуск Flask для вебхука в отдельном потоке, только если Chatwoot включен
-    if CHATWOOT_ENABLED:
-        logging.info("Запуск вебхука для Chatwoot...")
-        threading.Thread(target=run_webhook_server).start()
-    
+
+    # Готовность отмечается, когда бот инициализирован и запускает polling. Один бот — из post_init
+    # run_polling; несколько ботов (или масштабирование) — в run_applications, когда запущены все
+    async def on_startup(app):
+        startup.mark_ready()
+
+    single = len(tenants) == 1 and not SCALE_OUT_ENABLED
+    applications = [build_application(tenant, reranker, post_init=on_startup if single else None) for tenant in tenants]
+
     # Запуск бота
-    logging.info(f"Запуск Telegram бота {'с' if CHATWOOT_ENABLED else 'без'} интеграции Chatwoot...")
-    application.run_polling()
+    logging.info(
+        f"Запуск Telegram {'бота' if len(applications) == 1 else f'ботов ({len(applications)})'} "
+        f"{'с' if CHATWOOT_ENABLED else 'без'} интеграции Chatwoot..."
+    )
+    if SCALE_OUT_ENABLED:
+        logging.info(f"Воркер {WORKER_ID}: шард {WORKER_SHARD} из {WORKER_SHARDS}")
+        asyncio.run(run_applications(applications, tenants, scale_out=True))
+    elif len(applications) == 1:
+        applications[0].run_polling()
+    else:
+        asyncio.run(run_applications(applications, tenants))
+
+async def run_applications(applications, tenants, scale_out=False):
+    """
+    Polling нескольких ботов в одном цикле событий (run_polling умеет только один).
+    В режиме масштабирования getUpdates ведёт воркер-лидер, а апдейты своего шарда
+    этот воркер берёт из общей очереди и кладёт в update_queue приложения.
+    """
+    from telegram import Update
+    from services.state_store import state_store
+    from services import scale_out as scaling
+    from services.metrics import queue_depth
+
+    for application in applications:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if not scale_out:
+            await application.updater.start_polling()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = []
+    if scale_out:
+        by_tenant = {tenant.name: application for tenant, application in zip(tenants, applications)}
+
+        async def dispatch(kind, payload):
+            if kind == "telegram":
+                application = by_tenant[payload["tenant"]]
+                await application.update_queue.put(Update.de_json(payload["update"], application.bot))
+            elif kind == "chatwoot":
+                from webhook.app import process_routed_webhook
+                await asyncio.to_thread(process_routed_webhook, payload)
+
+        scaling.pollers.extend(
+            scaling.UpdatePoller(state_store, tenant.name, application.bot)
+            for tenant, application in zip(tenants, applications)
+        )
+        scaling.consumers.append(scaling.ShardConsumer(state_store, dispatch))
+        for shard in range(WORKER_SHARDS):
+            queue_depth.track(partial(state_store.queue_depth, shard), f"shard:{shard}")
+        tasks = [asyncio.create_task(worker.run(stop)) for worker in scaling.pollers + scaling.consumers]
+
+    startup.mark_ready()
+    await stop.wait()
+
+    logging.info("Остановка ботов...")
+    # Опросчики отпускают аренды, чтобы другой воркер сразу подхватил getUpdates
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for application in applications:
+        if not scale_out:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,176 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, Counter, deque
+
+from config import (
+    ADMISSION_USER_RATE,
+    ADMISSION_USER_BURST,
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_ANSWER_CACHE_SIZE
+)
+from services.llm_client import LatencyHistogram
+from services.tenants import tenant_key, current_tenant
+from services.metrics import queue_depth, state_entries
+
+
+# === Лимит сообщений пользователя ===
+class UserRateLimiter:
+    """
+    Токен-бакет на пользователя: rate_per_minute токенов в минуту, не больше
+    burst про запас. Бакеты давно молчавших пользователей вытесняются (LRU).
+    У каждого тенанта свои бакеты: пользователь, пишущий двум ботам, лимитируется в каждом отдельно.
+    """
+
+    def __init__(self, rate_per_minute=6.0, burst=3, max_users=100000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets = OrderedDict()  # user_id -> (токены, время обновления)
+
+    def allow(self, user_id):
+        """Возвращает (допущен, через сколько секунд появится токен)"""
+        now = time.monotonic()
+        user_id = tenant_key(user_id)
+        tokens, updated = self._buckets.pop(user_id, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[user_id] = (tokens, now)
+        while len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (1.0 - tokens) / self.rate if self.rate > 0 else float("inf")
+        return allowed, retry_after
+
+
+# === Недавние ответы ===
+class AnswerCache:
+    """Последние ответы LLM по нормализованному тексту вопроса (у каждого тенанта свои) — для сброса запросов под нагрузкой"""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._answers = OrderedDict()
+
+    def get(self, question):
+        key = tenant_key(question.lower())
+        answer = self._answers.get(key)
+        if answer is not None:
+            self._answers.move_to_end(key)
+        return answer
+
+    def put(self, question, answer):
+        key = tenant_key(question.lower())
+        self._answers[key] = answer
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.max_size:
+            self._answers.popitem(last=False)
+
+
+# === Допуск к RAG ===
+class AdmissionController:
+    """
+    Не больше max_concurrent одновременных прогонов RAG — слоты общие, модели и
+    LLM у тенантов одни. Ожидающие стоят в очередях своих тенантов (до max_queue в
+    каждой): освободившийся слот передаётся по кругу первому в очереди следующего
+    тенанта, минуя счётчик активных, поэтому шумный тенант не отнимает очередь у
+    остальных. Работает в цикле событий бота: все методы вызываются из одного
+    потока, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = OrderedDict()  # тенант -> deque ожидающих; порядок ключей — очередь обхода
+
+        # Статистика
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.shed = Counter()  # причина сброса -> число
+        self.wait_latency = LatencyHistogram(buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+    @property
+    def queue_length(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def acquire(self, on_queued=None):
+        """
+        Занимает слот RAG. True — допущен (после release обязателен), False — очередь
+        тенанта полна и запрос нужно сбросить. on_queued(позиция в очереди тенанта)
+        вызывается, если пришлось ждать.
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        tenant = current_tenant.get()
+        name = tenant.name if tenant else None
+        waiters = self._waiters.get(name)
+        if waiters is not None and len(waiters) >= self.max_queue:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        if waiters is None:
+            waiters = self._waiters[name] = deque()
+        waiters.append(future)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            if on_queued:
+                await on_queued(len(waiters))
+            await future
+        except BaseException:
+            # Отмена во время ожидания: уже переданный слот отдаём следующему
+            if future.done() and not future.cancelled():
+                self.release()
+            elif future in waiters:
+                waiters.remove(future)
+                if not waiters and self._waiters.get(name) is waiters:
+                    del self._waiters[name]
+            raise
+        self.wait_latency.observe(time.monotonic() - started)
+        self.admitted += 1
+        return True
+
+    def release(self):
+        while self._waiters:
+            # Первый тенант в обходе отдаёт одного ожидающего и уходит в конец круга
+            name, waiters = self._waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                self._waiters[name] = waiters
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    def record_shed(self, reason):
+        self.shed[reason] += 1
+        logging.warning(
+            f"Запрос сброшен ({reason}): активных {self.active}, в очереди {self.queue_length}, "
+            f"всего сброшено {sum(self.shed.values())}"
+        )
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queue_length": self.queue_length,
+            "queue_by_tenant": {str(name): len(waiters) for name, waiters in self._waiters.items()},
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "shed": dict(self.shed),
+            "wait": self.wait_latency.snapshot(),
+        }
+
+
+rate_limiter = UserRateLimiter(rate_per_minute=ADMISSION_USER_RATE, burst=ADMISSION_USER_BURST)
+answer_cache = AnswerCache(max_size=ADMISSION_ANSWER_CACHE_SIZE)
+admission = AdmissionController(max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE)
+queue_depth.track(lambda: admission.queue_length, "admission")
+state_entries.track(lambda: len(answer_cache._answers), "answer_cache")
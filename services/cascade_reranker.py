@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+
+
+# === Каскадный реранкинг ===
+class CascadeReranker:
+    """
+    Оценивает кандидатов cross-encoder'ом порциями. Кандидаты приходят уже
+    упорядоченными по векторной близости; сначала оценивается верхняя порция,
+    следующие — только если распределение оценок говорит, что ответ может
+    оказаться глубже:
+      - лучшая оценка ещё ниже confident_score, или
+      - хвост последней порции (нижняя треть по векторной близости) отстаёт
+        от лучшей оценки меньше чем на margin — релевантные куски не кончились.
+    Неоценённые кандидаты по умолчанию идут после оценённых в порядке поиска
+    с оценкой None — в промпт попадает тот же набор, что и без каскада;
+    keep_unscored=False явно обрезает выдачу до оценённых.
+    Метод predict проксируется в исходную модель, поэтому объект можно
+    передавать везде вместо CrossEncoder.
+    """
+
+    def __init__(self, reranker, first_slice=10, step=10, max_depth=50, confident_score=0.7, margin=0.2, keep_unscored=True):
+        self.reranker = reranker
+        self.first_slice = max(1, first_slice)
+        self.step = max(1, step)
+        self.max_depth = max_depth
+        self.confident_score = confident_score
+        self.margin = margin
+        self.keep_unscored = keep_unscored
+
+        # Статистика: среднее число оценённых пар и время реранкинга
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.pairs_scored = 0
+        self.candidates_seen = 0
+        self.total_time = 0.0
+
+    def predict(self, pairs, **kwargs):
+        return self.reranker.predict(pairs, **kwargs)
+
+    def _should_continue(self, best, scores):
+        if best < self.confident_score:
+            return True
+        tail = scores[-max(1, len(scores) // 3):]
+        return max(tail) >= best - self.margin
+
+    def rerank(self, question, docs, max_depth=None, cancelled=None):
+        """
+        Пары (документ, оценка): оценённые по убыванию оценки, затем (при keep_unscored)
+        неоценённые в порядке поиска с оценкой None. После установки cancelled
+        (threading.Event) следующие порции не оцениваются
+        """
+        started = time.perf_counter()
+        depth_limit = min(len(docs), max_depth or self.max_depth or len(docs))
+        scored = []
+        best = float("-inf")
+        position = 0
+        size = self.first_slice
+
+        while position < depth_limit and not (cancelled and cancelled.is_set()):
+            chunk = docs[position:min(position + size, depth_limit)]
+            scores = self.reranker.predict([(question, doc.page_content) for doc in chunk])
+            scored.extend(zip(chunk, scores))
+            best = max(best, max(scores))
+            position += len(chunk)
+            size = self.step
+            if not self._should_continue(best, list(scores)):
+                break
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.queries += 1
+            self.pairs_scored += len(scored)
+            self.candidates_seen += len(docs)
+            self.total_time += elapsed
+        logging.info(
+            f"Каскадный реранкинг: оценено {len(scored)} из {len(docs)} пар за {elapsed:.3f} с "
+            f"(в среднем {self.average_pairs:.1f} пар, {self.average_latency * 1000:.1f} мс на запрос)"
+        )
+        ranked = sorted(scored, key=lambda x: x[1], reverse=True)
+        if self.keep_unscored:
+            ranked.extend((doc, None) for doc in docs[len(scored):])
+        return ranked
+
+    @property
+    def average_pairs(self):
+        return self.pairs_scored / self.queries if self.queries else 0.0
+
+    @property
+    def average_latency(self):
+        return self.total_time / self.queries if self.queries else 0.0
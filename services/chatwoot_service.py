@@ -1,6 +1,18 @@
 import logging
 import requests
-from config import CHATWOOT_BASE_URL, CHATWOOT_API_KEY, CHATWOOT_ACCOUNT_ID, CHATWOOT_INBOX_ID, CHATWOOT_ENABLED
+from config import CHATWOOT_BASE_URL, CHATWOOT_API_KEY, CHATWOOT_ACCOUNT_ID, CHATWOOT_ENABLED
+from services.tenants import current_inbox_id
+from services.metrics import timed, stage_errors
+from services.tracing import span
+
+def _request(method, call, url, **kwargs):
+    """HTTP-запрос к API Chatwoot: длительность в метрике этапа chatwoot_<call>, ответ 4xx/5xx — ошибка этапа"""
+    with timed(f"chatwoot_{call}"), span(f"chatwoot_{call}", method=method.upper()) as request_span:
+        response = requests.request(method, url, **kwargs)
+        request_span.set(http_status=response.status_code)
+    if response.status_code >= 400:
+        stage_errors.inc(f"chatwoot_{call}")
+    return response
 
 def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username=None):
     """Создает новый или получает существующий контакт в Chatwoot для пользователя Telegram"""
@@ -23,7 +35,7 @@ def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username
         }
         
         logging.info(f"Поиск контакта в Chatwoot: URL={search_url}, параметры={params}")
-        search_response = requests.get(search_url, headers=headers, params=params)
+        search_response = _request("get", "contact_search", search_url, headers=headers, params=params)
         
         logging.info(f"Ответ на поиск контакта: статус={search_response.status_code}, текст={search_response.text}")
         
@@ -46,7 +58,7 @@ def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username
         create_url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts"
         
         data = {
-            "inbox_id": CHATWOOT_INBOX_ID,
+            "inbox_id": current_inbox_id(),
             "name": f"{first_name} {last_name or ''}".strip(),
             "identifier": source_id,
             "source_id": source_id,
@@ -61,7 +73,7 @@ def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username
         }
         
         logging.info(f"Создание контакта в Chatwoot: URL={create_url}, данные={data}")
-        create_response = requests.post(create_url, headers=headers, json=data)
+        create_response = _request("post", "contact_create", create_url, headers=headers, json=data)
         
         logging.info(f"Ответ на создание контакта: статус={create_response.status_code}, текст={create_response.text}")
         
@@ -74,7 +86,7 @@ def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username
             
             # Повторный поиск по идентификатору
             try:
-                search_response = requests.get(search_url, headers=headers, params=params)
+                search_response = _request("get", "contact_search", search_url, headers=headers, params=params)
                 
                 if search_response.status_code == 200:
                     response_data = search_response.json()
@@ -86,7 +98,7 @@ def create_or_get_chatwoot_contact(user_id, first_name, last_name=None, username
                 
                 # Если не удалось найти контакт, используем альтернативный поиск
                 alternate_search_url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/contacts"
-                alternate_response = requests.get(alternate_search_url, headers=headers)
+                alternate_response = _request("get", "contact_list", alternate_search_url, headers=headers)
                 
                 if alternate_response.status_code == 200:
                     all_contacts = alternate_response.json()
@@ -122,7 +134,7 @@ def get_or_create_chatwoot_conversation(contact_id):
         url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations"
         
         params = {
-            "inbox_id": CHATWOOT_INBOX_ID,
+            "inbox_id": current_inbox_id(),
             "contact_id": contact_id,
             "status": "open"
         }
@@ -133,7 +145,7 @@ def get_or_create_chatwoot_conversation(contact_id):
         }
         
         logging.info(f"Поиск разговора в Chatwoot: URL={url}, параметры={params}")
-        response = requests.get(url, headers=headers, params=params)
+        response = _request("get", "conversation_search", url, headers=headers, params=params)
         
         logging.info(f"Ответ на поиск разговора: статус={response.status_code}, текст={response.text}")
         
@@ -152,14 +164,14 @@ def get_or_create_chatwoot_conversation(contact_id):
         create_url = f"{CHATWOOT_BASE_URL}/api/v1/accounts/{CHATWOOT_ACCOUNT_ID}/conversations"
         
         data = {
-            "inbox_id": CHATWOOT_INBOX_ID,
+            "inbox_id": current_inbox_id(),
             "contact_id": contact_id,
             "status": "open",
             "source_id": str(contact_id)
         }
         
         logging.info(f"Создание разговора в Chatwoot: URL={create_url}, данные={data}")
-        create_response = requests.post(create_url, headers=headers, json=data)
+        create_response = _request("post", "conversation_create", create_url, headers=headers, json=data)
         
         logging.info(f"Ответ на создание разговора: статус={create_response.status_code}, текст={create_response.text}")
         
@@ -198,7 +210,7 @@ def send_message_to_chatwoot(conversation_id, message, message_type="outgoing",
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = _request("post", "message_send", url, headers=headers, json=data)
         
         if response.status_code in [200, 201]:
             return True
@@ -226,7 +238,7 @@ def assign_agent_to_conversation(conversation_id, agent_id=None):
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = _request("post", "assign_agent", url, headers=headers, json=data)
         
         if response.status_code in [200, 201]:
             return True
@@ -252,7 +264,7 @@ def validate_chatwoot_config():
     logging.info(f"API ключ (первые 5 символов): {CHATWOOT_API_KEY[:5]}...")
     
     try:
-        response = requests.get(url, headers=headers)
+        response = _request("get", "inboxes", url, headers=headers)
         logging.info(f"Статус ответа: {response.status_code}")
         
         if response.status_code == 200:
@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+from collections import Counter
+
+
+# === Дедлайн ответа и бюджеты этапов ===
+class Deadline:
+    """
+    Дедлайн одного ответа: общий бюджет total секунд от создания и бюджеты
+    отдельных этапов (budgets: этап -> секунды). Этап получает меньшее из
+    своего бюджета и остатка общего. total=None — дедлайна нет, все таймауты None.
+
+    Применённые деградации копятся в degradations, чтобы по каждому ответу
+    было видно, чем пришлось пожертвовать ради времени.
+    """
+
+    def __init__(self, total=None, budgets=None):
+        self.total = total
+        self.budgets = budgets or {}
+        self.started = time.monotonic()
+        self.degradations = []
+
+    @property
+    def enabled(self):
+        return self.total is not None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        if self.total is None:
+            return float("inf")
+        return max(0.0, self.total - self.elapsed)
+
+    def timeout(self, stage=None, started=None):
+        """
+        Сколько можно ждать этап (None — без ограничения). started — момент
+        (time.monotonic) запуска этапа, если он стартовал раньше ожидания.
+        """
+        if self.total is None:
+            return None
+        timeout = self.remaining()
+        if stage in self.budgets:
+            spent = time.monotonic() - started if started is not None else 0.0
+            timeout = min(timeout, max(0.0, self.budgets[stage] - spent))
+        return timeout
+
+    def degrade(self, name, detail=""):
+        self.degradations.append(name)
+        degradation_stats.record(name)
+        logging.warning(f"Деградация {name} через {self.elapsed:.2f} с: {detail}" if detail else f"Деградация {name} через {self.elapsed:.2f} с")
+
+
+# === Статистика деградаций ===
+class DegradationStats:
+    """Сколько ответов ушло с каждой деградацией (для /stats/deadline)"""
+
+    def __init__(self):
+        self.answers = 0
+        self.degraded = 0
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def finish(self, deadline):
+        with self._lock:
+            self.answers += 1
+            self.degraded += bool(deadline.degradations)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "answers": self.answers,
+                "degraded": self.degraded,
+                "degraded_rate": round(self.degraded / self.answers, 3) if self.answers else 0.0,
+                "degradations": dict(self.counts),
+            }
+
+
+degradation_stats = DegradationStats()
+
+
+# === Оценка стоимости реранкинга ===
+class PairCostEstimator:
+    """Скользящее среднее времени оценки одной пары cross-encoder: сколько пар успеем за бюджет"""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.per_pair = None
+
+    def observe(self, seconds, pairs):
+        if pairs <= 0:
+            return
+        sample = seconds / pairs
+        self.per_pair = sample if self.per_pair is None else self.alpha * sample + (1 - self.alpha) * self.per_pair
+
+    def affordable(self, budget):
+        """Сколько пар влезет в budget секунд (None — оценки ещё нет или бюджет не ограничен)"""
+        if self.per_pair is None or budget is None or self.per_pair <= 0:
+            return None
+        return int(budget / self.per_pair)
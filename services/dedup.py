@@ -0,0 +1,91 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+# === Схлопывание почти одинаковых чанков (SimHash) ===
+_TOKEN_RE = re.compile(r"\w+")
+_MASK = (1 << 64) - 1
+
+
+def simhash(text, shingle_size=3):
+    """64-битный SimHash по словесным шинглам текста"""
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) < shingle_size:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    signature = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            signature |= 1 << bit
+    return signature & _MASK
+
+
+def numbers_fingerprint(text):
+    """Отпечаток набора чисел в тексте: номера квартир, цены и этажи не должны схлопываться"""
+    return hash(frozenset(token for token in _TOKEN_RE.findall(text) if token.isdigit()))
+
+
+class NearDuplicateFilter:
+    """
+    Отбрасывает кандидатов, чей SimHash отличается от уже оставленного
+    не более чем на max_distance бит, а набор чисел совпадает. Подписи
+    кэшируются по тексту чанка (SimHash берётся из metadata["simhash"],
+    если его записал загрузчик), поэтому проверка 50 кандидатов стоит
+    микросекунды.
+    """
+
+    def __init__(self, max_distance=3, cache_size=50000):
+        self.max_distance = max_distance
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.queries = 0
+        self.dropped = 0
+
+    def signature(self, doc):
+        """Пара (SimHash, отпечаток чисел) для документа"""
+        key = hash(doc.page_content)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                return value
+        stored = doc.metadata.get("simhash") if doc.metadata else None
+        value = (int(stored, 16) if stored else simhash(doc.page_content), numbers_fingerprint(doc.page_content))
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def warm(self, docs):
+        for doc in docs:
+            self.signature(doc)
+
+    def collapse(self, docs):
+        """Возвращает (оставленные документы в исходном порядке, число отброшенных дублей)"""
+        kept, signatures = [], []
+        for doc in docs:
+            value, numbers = self.signature(doc)
+            if any(
+                numbers == other_numbers and (value ^ other).bit_count() <= self.max_distance
+                for other, other_numbers in signatures
+            ):
+                continue
+            kept.append(doc)
+            signatures.append((value, numbers))
+        dropped = len(docs) - len(kept)
+        with self._lock:
+            self.queries += 1
+            self.dropped += dropped
+        return kept, dropped
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+
+from services.utils import clean_text
+from services.llm_client import LatencyHistogram
+from services.inference_backends import embed_queries
+from services.tenants import current_tenant
+
+
+# === Быстрые ответы на частые вопросы (FAQ) ===
+class FaqIndex:
+    """
+    Курируемые ответы из JSON-файла. Формулировки вопросов эмбеддятся при
+    загрузке в одну нормированную матрицу; входящий вопрос сопоставляется с
+    ней одним умножением матрицы на вектор. Обе стороны — вопросы, поэтому и
+    формулировки кодируются как запросы (у e5 — с префиксом query:), иначе
+    сходство вопроса с самим собой меньше 1 и порог смещается. Если косинус лучшей формулировки
+    не ниже threshold, возвращается готовый ответ без поиска и LLM.
+
+    Формат файла — список записей:
+        [{"questions": ["адрес офиса продаж", "где офис продаж"], "answer": "..."}]
+
+    Файл перечитывается, если изменилось его время модификации (проверка
+    не чаще раза в reload_interval секунд). Перечитывание и эмбеддинг
+    формулировок идут в фоновом потоке: match до его конца отвечает по
+    прежней версии и не добавляет задержку к ответу пользователю.
+    """
+
+    def __init__(self, path, embeddings, threshold=0.92, reload_interval=5.0):
+        self.path = path
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.reload_interval = reload_interval
+        self.answers = []
+        self.entry_of = np.zeros(0, dtype=np.int64)  # номер ответа для каждой формулировки
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.mtime = None
+        self._checked = 0.0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.lookups = 0
+        self.hits = 0
+        self.latency = LatencyHistogram(buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+        self.reload()
+
+    def reload(self):
+        """Загружает файл и пересчитывает эмбеддинги формулировок"""
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding="utf-8") as f:
+            entries = json.load(f)
+
+        answers, questions, entry_of = [], [], []
+        for entry in entries:
+            variants = entry.get("questions") or [entry.get("question")]
+            variants = [clean_text(q).lower() for q in variants if q]
+            if not variants or not entry.get("answer"):
+                continue
+            answers.append(entry["answer"])
+            questions.extend(variants)
+            entry_of.extend([len(answers) - 1] * len(variants))
+
+        matrix = np.asarray(embed_queries(self.embeddings, questions), dtype=np.float32) if questions else np.zeros((0, 0), dtype=np.float32)
+        if len(matrix):
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+        with self._lock:
+            self.answers = answers
+            self.entry_of = np.asarray(entry_of, dtype=np.int64)
+            self.matrix = matrix
+            self.mtime = mtime
+        logging.info(f"FAQ загружен из {self.path}: ответов {len(answers)}, формулировок {len(questions)}")
+
+    def _maybe_reload(self):
+        """Проверяет время модификации файла и при изменении запускает одно фоновое перечитывание"""
+        now = time.monotonic()
+        with self._lock:
+            if self._reloading or now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+        try:
+            changed = os.path.getmtime(self.path) != self.mtime
+        except OSError as e:
+            logging.error(f"Не удалось проверить FAQ {self.path}: {e}")
+            return
+        if not changed:
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload_in_background, name="faq-reload", daemon=True).start()
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        except Exception as e:
+            # Битый файл во время редактирования — продолжаем со старой версией
+            logging.error(f"Не удалось перечитать FAQ {self.path}: {e}")
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def match(self, question, threshold=None):
+        """
+        Возвращает (ответ, оценка) при уверенном совпадении, иначе (None, лучшая оценка).
+        threshold — пониженный порог для ответа при опоздании пайплайна; такие
+        сопоставления не попадают в статистику попаданий.
+        """
+        started = time.perf_counter()
+        self._maybe_reload()
+        with self._lock:
+            answers, entry_of, matrix = self.answers, self.entry_of, self.matrix
+
+        answer, best = None, 0.0
+        if len(matrix):
+            vector = np.asarray(self.embeddings.embed_query(question.lower()), dtype=np.float32)
+            scores = matrix @ (vector / (np.linalg.norm(vector) + 1e-12))
+            index = int(scores.argmax())
+            best = float(scores[index])
+            if best >= (self.threshold if threshold is None else threshold):
+                answer = answers[entry_of[index]]
+
+        if threshold is not None:
+            return answer, best
+        self.latency.observe(time.perf_counter() - started)
+        with self._lock:
+            self.lookups += 1
+            self.hits += answer is not None
+        return answer, best
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        return {
+            "answers": len(self.answers),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hit_rate, 3),
+            "latency": self.latency.snapshot(),
+        }
+
+
+# Создаётся в main.py после загрузки эмбеддера (None — FAQ выключен или файла нет).
+# С несколькими тенантами у каждого свой индекс, здесь — индекс первого
+faq_index = None
+
+
+def aggregate_stats(indexes):
+    """
+    Статистика FAQ всех тенантов: суммы по индексам и разбивка по тенантам.
+    indexes — пары (имя тенанта, FaqIndex); None — FAQ нигде не включён.
+    """
+    if not indexes:
+        return None
+    per_tenant = {name: index.stats() for name, index in indexes}
+    lookups = sum(stats["lookups"] for stats in per_tenant.values())
+    hits = sum(stats["hits"] for stats in per_tenant.values())
+    return {
+        "answers": sum(stats["answers"] for stats in per_tenant.values()),
+        "lookups": lookups,
+        "hits": hits,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        "tenants": per_tenant,
+    }
+
+
+def current_faq_index():
+    """FAQ текущего тенанта; без тенанта (бенчмарки) — faq_index"""
+    tenant = current_tenant.get()
+    return tenant.faq_index if tenant is not None else faq_index
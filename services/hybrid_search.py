@@ -0,0 +1,189 @@
+import re
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+# === Лексический поиск (BM25) ===
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text, stem_length=6):
+    """
+    Разбивает текст на токены для BM25. Числа (номера квартир, цены, этажи)
+    остаются целиком, слова обрезаются до stem_length символов — грубый,
+    но дешёвый стемминг для русского языка.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if stem_length and not token.isdigit() and len(token) > stem_length:
+            token = token[:stem_length]
+        tokens.append(token)
+    return tokens
+
+
+def document_key(doc):
+    """
+    Ключ документа для слияния результатов. Используется текст чанка:
+    ретривер LangChain не во всех версиях заполняет Document.id.
+    """
+    return doc.page_content
+
+
+class BM25Index:
+    """Инвертированный индекс Okapi BM25 поверх документов коллекции"""
+
+    def __init__(self, documents, k1=1.5, b=0.75, stem_length=6):
+        self.k1 = k1
+        self.b = b
+        self.stem_length = stem_length
+        self.documents = list(documents)
+        self.postings = defaultdict(list)  # термин -> [(индекс документа, tf)]
+        self.doc_lengths = []
+
+        for index, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content, stem_length))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((index, tf))
+
+        total = len(self.documents)
+        self.avg_length = (sum(self.doc_lengths) / total) if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    @classmethod
+    def from_collection(cls, collection, page_size=1000, **kwargs):
+        """Строит индекс по всем документам коллекции Chroma"""
+        started = time.time()
+        documents = []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            for doc_id, text, metadata in zip(ids, page["documents"], page["metadatas"]):
+                documents.append(Document(id=doc_id, page_content=text or "", metadata=metadata or {}))
+            offset += len(ids)
+        index = cls(documents, **kwargs)
+        logging.info(
+            f"BM25 индекс построен: {len(documents)} документов, {len(index.postings)} терминов "
+            f"за {time.time() - started:.2f} секунд"
+        )
+        return index
+
+    def search(self, query, k=50):
+        """Возвращает до k пар (Document, score) по убыванию BM25"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query, self.stem_length)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for index, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / self.avg_length)
+                scores[index] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(self.documents[index], score) for index, score in best]
+
+
+# === Слияние рангов ===
+def reciprocal_rank_fusion(rankings, k=60, top_n=None):
+    """
+    Reciprocal Rank Fusion: score(d) = Σ 1 / (k + rank). rankings — списки
+    документов, каждый отсортирован по убыванию релевантности.
+    """
+    scores = defaultdict(float)
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = document_key(doc)
+            scores[key] += 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    fused = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    if top_n:
+        fused = fused[:top_n]
+    return [docs[key] for key, _ in fused]
+
+
+class HybridRetriever:
+    """
+    Плотный поиск + BM25, объединённые через RRF. Возвращает top_n кандидатов,
+    поэтому cross-encoder оценивает меньше пар, а точные токены (номера
+    квартир, улицы, цены) находятся лексической частью.
+
+    BM25 считается в потоке, чтобы большой индекс не блокировал цикл событий.
+    С collection индекс раз в refresh_interval секунд сверяет число документов
+    с коллекцией (её пополняет ingest.py из другого процесса) и при расхождении
+    перестраивается в фоновом потоке; до конца перестройки поиск идёт по старому.
+    Замена чанков без изменения их числа так не замечается — для неё есть rebuild().
+    """
+
+    def __init__(self, dense_retriever, bm25_index, lexical_k=50, rrf_k=60, top_n=20, collection=None, refresh_interval=0.0):
+        self.dense_retriever = dense_retriever
+        self.bm25_index = bm25_index
+        self.lexical_k = lexical_k
+        self.rrf_k = rrf_k
+        self.top_n = top_n
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._checked = time.monotonic()
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        """Перестраивает BM25 по текущему содержимому коллекции"""
+        index = self.bm25_index
+        self.bm25_index = BM25Index.from_collection(self.collection, k1=index.k1, b=index.b, stem_length=index.stem_length)
+
+    def _maybe_rebuild(self):
+        if self.collection is None or self.refresh_interval <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._rebuilding or now - self._checked < self.refresh_interval:
+                return
+            self._checked = now
+        try:
+            changed = self.collection.count() != len(self.bm25_index.documents)
+        except Exception as e:
+            logging.error(f"Не удалось проверить размер коллекции для BM25: {e}")
+            return
+        if not changed:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name="bm25-rebuild", daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logging.error(f"Не удалось перестроить BM25 индекс: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _fuse(self, query, dense_docs, k=None):
+        self._maybe_rebuild()
+        lexical_docs = [doc for doc, _ in self.bm25_index.search(query, k or self.lexical_k)]
+        top_n = min(self.top_n, k) if k else self.top_n
+        return reciprocal_rank_fusion([dense_docs, lexical_docs], k=self.rrf_k, top_n=top_n)
+
+    def get_relevant_documents(self, query, k=None):
+        kwargs = {"k": k} if k else {}
+        return self._fuse(query, self.dense_retriever.get_relevant_documents(query, **kwargs), k)
+
+    async def aget_relevant_documents(self, query, k=None):
+        kwargs = {"k": k} if k else {}
+        dense_docs = await self.dense_retriever.aget_relevant_documents(query, **kwargs)
+        return await asyncio.to_thread(self._fuse, query, dense_docs, k)
@@ -0,0 +1,277 @@
+import os
+import json
+import inspect
+import logging
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from services.metrics import timed
+
+# === Бэкенды инференса: PyTorch, ONNX Runtime FP32, ONNX Runtime int8 ===
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+
+
+def onnx_model_file(model_path, backend, onnx_dir="onnx"):
+    """Путь к ONNX-файлу модели для выбранного бэкенда"""
+    filename = ONNX_INT8_FILE if backend == "onnx-int8" else ONNX_FP32_FILE
+    return os.path.join(model_path, onnx_dir, filename)
+
+
+def _create_session(path, num_threads=0):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("Для ONNX-бэкенда установите onnxruntime: pip install onnxruntime") from e
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX-модель не найдена: {path}. Выполните python export_onnx.py")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _OnnxModel:
+    def __init__(self, model_path, backend="onnx", onnx_dir="onnx", num_threads=0, max_length=None):
+        from transformers import AutoTokenizer
+
+        self.model_path = model_path
+        self.backend = backend
+        self.onnx_path = onnx_model_file(model_path, backend, onnx_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.session = _create_session(self.onnx_path, num_threads)
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.max_length = min(max_length or self.tokenizer.model_max_length, 512)
+
+    def run(self, features):
+        """Прогоняет уже токенизированный батч (numpy) через сессию"""
+        inputs = {name: np.asarray(value, dtype=np.int64) for name, value in features.items() if name in self.input_names}
+        return self.session.run(None, inputs)[0]
+
+
+class OnnxEmbeddings(_OnnxModel, Embeddings):
+    """
+    Эмбеддер sentence-transformers на ONNX Runtime. Пулинг и нормализация
+    берутся из конфигурации модели, чтобы векторы совпадали с PyTorch-версией.
+    """
+
+    def __init__(self, model_path, batch_size=32, **kwargs):
+        st_config = _read_json(os.path.join(model_path, "sentence_bert_config.json"))
+        super().__init__(model_path, max_length=st_config.get("max_seq_length"), **kwargs)
+        self.batch_size = batch_size
+        pooling = _read_json(os.path.join(model_path, "1_Pooling", "config.json"))
+        self.cls_pooling = bool(pooling.get("pooling_mode_cls_token"))
+        modules = _read_json(os.path.join(model_path, "modules.json")) or []
+        self.normalize = any("Normalize" in module.get("type", "") for module in modules)
+
+    def _embed_batch(self, texts):
+        features = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        hidden = self.run(features)
+        if self.cls_pooling:
+            vectors = hidden[:, 0]
+        else:
+            mask = features["attention_mask"][..., None].astype(hidden.dtype)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts):
+        vectors = [self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts):
+        # Вопрос кодируется так же, как документ (embed_query выше), поэтому пакет — один прогон
+        return self.embed_documents(texts)
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Cross-encoder на ONNX Runtime с тем же интерфейсом predict, что у sentence_transformers.CrossEncoder"""
+
+    def __init__(self, model_path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        config = _read_json(os.path.join(model_path, "config.json"))
+        # CrossEncoder по умолчанию применяет сигмоиду для моделей с одним выходом
+        self.apply_sigmoid = len(config.get("id2label", {"0": "LABEL_0"})) == 1
+
+    def score_features(self, features):
+        logits = self.run(features)
+        if self.apply_sigmoid:
+            return 1.0 / (1.0 + np.exp(-logits[:, 0]))
+        return logits
+
+    def predict(self, pairs, batch_size=32, **kwargs):
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i:i + batch_size]
+            features = self.tokenizer(
+                [a for a, _ in batch], [b for _, b in batch],
+                padding=True, truncation="longest_first", max_length=self.max_length, return_tensors="np"
+            )
+            scores.append(self.score_features(features))
+        return np.concatenate(scores) if scores else np.array([])
+
+
+class TimedEmbeddings(Embeddings):
+    """Эмбеддер с замером каждого вызова в метрике этапа embedding (вызовы из Chroma, FAQ, батчера)"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts):
+        with timed("embedding"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with timed("embedding"):
+            return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        with timed("embedding"):
+            return embed_queries(self.embeddings, texts)
+
+
+def embed_queries(embeddings, texts):
+    """
+    Эмбеддинги нескольких вопросов с семантикой embed_query: у e5/bge-подобных моделей
+    запрос кодируется иначе, чем документ (префикс или инструкция). Пакетно — если
+    эмбеддер умеет embed_queries, иначе по одному вызову embed_query на вопрос.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(list(texts))
+    return [embeddings.embed_query(text) for text in texts]
+
+
+# === Загрузка моделей ===
+def load_embeddings(backend, model_path, **kwargs):
+    logging.info(f"Загрузка эмбеддера ({backend}): {model_path}")
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_path, model_kwargs={"device": "cpu"})
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(model_path, backend=backend, **kwargs)
+    raise ValueError(f"Неизвестный бэкенд инференса: {backend}. Допустимые: {', '.join(BACKENDS)}")
+
+
+def load_cross_encoder(backend, model_path, **kwargs):
+    logging.info(f"Загрузка реранкера ({backend}): {model_path}")
+    if backend == "torch":
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_path)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxCrossEncoder(model_path, backend=backend, **kwargs)
+    raise ValueError(f"Неизвестный бэкенд инференса: {backend}. Допустимые: {', '.join(BACKENDS)}")
+
+
+def load_models(backend, embed_model_path, reranker_path, token_cache_size=0, **kwargs):
+    """
+    Загружает эмбеддер и cross-encoder одним вызовом (в том числе внутри
+    воркеров пула инференса). token_cache_size > 0 включает кэш токенизации чанков.
+    """
+    embeddings = load_embeddings(backend, embed_model_path, **kwargs)
+    reranker = load_cross_encoder(backend, reranker_path, **kwargs)
+    if token_cache_size > 0:
+        from services.token_cache import CachedTokenCrossEncoder
+        reranker = CachedTokenCrossEncoder(reranker, cache_size=token_cache_size)
+    return embeddings, reranker
+
+
+# === Экспорт и проверка паритета ===
+def export_onnx(model_path, kind, onnx_dir="onnx", quantize=True, opset=14, tolerance=1e-3):
+    """
+    Экспортирует локальную модель в ONNX (FP32) и, при quantize=True,
+    сохраняет динамически квантованную int8-версию рядом.
+    kind: "embeddings" или "reranker". После экспорта выход FP32-графа на примере
+    сравнивается с PyTorch; расхождение больше tolerance — RuntimeError.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel, AutoModelForSequenceClassification
+
+    output_dir = os.path.join(model_path, onnx_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, ONNX_FP32_FILE)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if kind == "embeddings":
+        model = AutoModel.from_pretrained(model_path)
+        sample = tokenizer(["query: пример вопроса"], return_tensors="pt")
+        output_name = "last_hidden_state"
+        output_axes = {0: "batch", 1: "sequence"}
+    else:
+        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        sample = tokenizer(["пример вопроса"], ["пример документа"], return_tensors="pt")
+        output_name = "logits"
+        output_axes = {0: "batch"}
+    model.eval()
+
+    # torch.onnx.export передаёт входы позиционно, поэтому порядок берётся из сигнатуры forward,
+    # а не из токенизатора: у BERT это input_ids, attention_mask, token_type_ids
+    parameters = list(inspect.signature(model.forward).parameters)
+    input_names = sorted(sample.keys(), key=parameters.index)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[output_name] = output_axes
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    logging.info(f"ONNX FP32 сохранён: {fp32_path}")
+
+    with torch.no_grad():
+        reference = getattr(model(**sample), output_name).numpy()
+    session = _create_session(fp32_path)
+    exported = session.run(None, {name: sample[name].numpy() for name in input_names})[0]
+    max_abs_diff = float(np.abs(reference - exported).max())
+    if max_abs_diff > tolerance:
+        raise RuntimeError(
+            f"ONNX-граф {fp32_path} расходится с PyTorch на примере: {max_abs_diff:.2e} > {tolerance:.0e}"
+        )
+    logging.info(f"ONNX FP32 совпадает с PyTorch на примере: расхождение {max_abs_diff:.2e}")
+
+    paths = {"onnx": fp32_path}
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        logging.info(f"ONNX int8 сохранён: {int8_path}")
+        paths["onnx-int8"] = int8_path
+    return paths
+
+
+def check_embeddings_parity(model_path, backend, samples, **kwargs):
+    """Минимальное косинусное сходство эмбеддингов бэкенда с PyTorch-версией"""
+    reference = np.asarray(load_embeddings("torch", model_path).embed_documents(samples))
+    candidate = np.asarray(load_embeddings(backend, model_path, **kwargs).embed_documents(samples))
+    cosine = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    return {"min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean())}
+
+
+def check_reranker_parity(model_path, backend, pairs, **kwargs):
+    """Максимальное расхождение оценок и совпадение порядка с PyTorch-версией"""
+    reference = np.asarray(load_cross_encoder("torch", model_path).predict(pairs))
+    candidate = np.asarray(load_cross_encoder(backend, model_path, **kwargs).predict(pairs))
+    return {
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "same_top1": bool(reference.argmax() == candidate.argmax()),
+        "same_order": bool((reference.argsort() == candidate.argsort()).all()),
+    }
@@ -0,0 +1,248 @@
+import os
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from services.inference_backends import embed_queries
+
+
+# === Пул процессов для инференса моделей ===
+def _worker_main(index, conn, load_models, models, num_threads):
+    """
+    Цикл воркера: принимает (request_id, метод, аргументы) и отвечает
+    (request_id, ok, результат). Модели либо унаследованы от родителя
+    после fork (copy-on-write), либо загружаются здесь.
+    """
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+    if models is None:
+        models = load_models()
+    embeddings, reranker = models
+    handlers = {
+        "embed_documents": embeddings.embed_documents,
+        "embed_query": embeddings.embed_query,
+        "embed_queries": lambda texts: embed_queries(embeddings, texts),
+        "predict": reranker.predict,
+    }
+    conn.send(("ready", index))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        request_id, method, args = message
+        try:
+            conn.send((request_id, True, handlers[method](*args)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, index, process, conn, restarts=0):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.alive = True
+        self.restarts = restarts
+
+    @property
+    def in_flight(self):
+        return len(self.pending)
+
+
+class InferencePool:
+    """
+    N процессов, каждый держит эмбеддер и cross-encoder. Запросы уходят
+    воркеру с наименьшим числом незавершённых запросов по Pipe; ответы
+    собирают потоки-читатели в родительском процессе.
+
+    preload=True: модели загружаются в родителе до fork и разделяются
+    воркерами copy-on-write (PyTorch). preload=False: каждый воркер загружает
+    модели сам (нужно для ONNX Runtime, чьи потоки не переживают fork).
+
+    Упавший воркер перезапускается (не больше max_restarts раз на слот). Родитель
+    к этому времени многопоточный, поэтому замена стартует через spawn и загружает
+    модели сама: load_models должен сериализоваться pickle (functools.partial
+    функции модуля). Пока замена грузится, запросы идут остальным воркерам.
+    """
+
+    def __init__(self, load_models, workers=2, threads_per_worker=None, preload=True, wait=True, max_restarts=3):
+        context = multiprocessing.get_context("fork")
+        workers = max(1, workers)
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        models = load_models() if preload else None
+        self._load_models = load_models
+        self._threads = threads
+        self._preload = preload
+        self._ready = False
+        self.max_restarts = max_restarts
+
+        self._ids = itertools.count()
+        self._closing = False
+        self._route_lock = threading.Lock()
+        self.workers = [self._start_worker(context, index, models) for index in range(workers)]
+
+        if wait:
+            self.wait_ready()
+
+    def _start_worker(self, context, index, models, restarts=0):
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=_worker_main,
+            args=(index, child_conn, self._load_models, models, self._threads),
+            name=f"inference-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, parent_conn, restarts)
+
+    def wait_ready(self):
+        """
+        Ждёт загрузки моделей в воркерах и запускает потоки-читатели. С wait=False
+        fork происходит в конструкторе, до запуска других потоков процесса, а ждать
+        можно позже — параллельно с остальной инициализацией.
+        """
+        if self._ready:
+            return
+        for worker in self.workers:
+            worker.conn.recv()  # ждём ("ready", index) — модели в воркере готовы
+            self._start_reader(worker)
+        self._ready = True
+        logging.info(f"Пул инференса запущен: {len(self.workers)} процессов по {self._threads} потоков, preload={self._preload}")
+
+    def _start_reader(self, worker):
+        threading.Thread(target=self._read_results, args=(worker,), name=f"inference-reader-{worker.index}", daemon=True).start()
+
+    def _pick_worker(self):
+        alive = [worker for worker in self.workers if worker.alive]
+        if not alive:
+            raise RuntimeError("Нет живых воркеров инференса: все процессы пула завершились")
+        return min(alive, key=lambda worker: worker.in_flight)
+
+    def submit(self, method, *args):
+        future = Future()
+        request_id = next(self._ids)
+        # Регистрация запроса и пометка воркера мёртвым идут под одной блокировкой:
+        # запрос не может попасть в pending воркера, чей читатель уже завершился
+        with self._route_lock:
+            if self._closing:
+                raise RuntimeError("Пул инференса остановлен")
+            worker = self._pick_worker()
+            worker.pending[request_id] = future
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, method, args))
+        except Exception as e:
+            with self._route_lock:
+                worker.pending.pop(request_id, None)
+            if not future.done():
+                future.set_exception(RuntimeError(f"Воркер инференса {worker.index} недоступен: {e}"))
+        return future
+
+    def call(self, method, *args):
+        return self.submit(method, *args).result()
+
+    def _read_results(self, worker):
+        while True:
+            try:
+                request_id, ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._route_lock:
+                future = worker.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+        with self._route_lock:
+            worker.alive = False
+            pending, worker.pending = worker.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Воркер инференса {worker.index} завершился"))
+        if self._closing:
+            return
+        worker.process.join(timeout=1)
+        logging.error(f"Воркер инференса {worker.index} завершился (exitcode={worker.process.exitcode})")
+        self._respawn(worker)
+
+    def _respawn(self, worker):
+        if worker.restarts >= self.max_restarts:
+            alive = sum(1 for w in self.workers if w.alive)
+            logging.error(
+                f"Воркер инференса {worker.index} не перезапускается: исчерпан лимит {self.max_restarts} перезапусков "
+                f"(живых воркеров: {alive} из {len(self.workers)})"
+            )
+            return
+        try:
+            replacement = self._start_worker(
+                multiprocessing.get_context("spawn"), worker.index, None, worker.restarts + 1
+            )
+            replacement.conn.recv()  # ("ready", index)
+        except Exception as e:
+            logging.error(f"Не удалось перезапустить воркер инференса {worker.index}: {type(e).__name__}: {e}")
+            return
+        with self._route_lock:
+            if self._closing:
+                replacement.conn.send(None)
+                return
+            self.workers[self.workers.index(worker)] = replacement
+        self._start_reader(replacement)
+        logging.info(f"Воркер инференса {worker.index} перезапущен (перезапуск {replacement.restarts} из {self.max_restarts})")
+
+    def in_flight(self):
+        return {worker.index: worker.in_flight for worker in self.workers}
+
+    def close(self):
+        with self._route_lock:
+            self._closing = True
+        for worker in self.workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+
+
+class PooledEmbeddings(Embeddings):
+    """Эмбеддер, выполняющийся в пуле процессов"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def embed_documents(self, texts):
+        return self.pool.call("embed_documents", list(texts))
+
+    def embed_query(self, text):
+        return self.pool.call("embed_query", text)
+
+    def embed_queries(self, texts):
+        return self.pool.call("embed_queries", list(texts))
+
+
+class PooledCrossEncoder:
+    """Cross-encoder, выполняющийся в пуле процессов (интерфейс predict как у CrossEncoder)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def predict(self, pairs, **kwargs):
+        return self.pool.call("predict", list(pairs))
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from services.utils import clean_text
+from services.dedup import simhash
+
+# === Загрузка документов в Chroma ===
+SUPPORTED_EXTENSIONS = (".pdf", ".html", ".htm")
+
+
+def discover_sources(paths):
+    """Возвращает отсортированный список PDF/HTML файлов из переданных файлов и каталогов"""
+    sources = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        sources.add(os.path.abspath(os.path.join(root, name)))
+        elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+            sources.add(os.path.abspath(path))
+    return sorted(sources)
+
+
+def source_fingerprint(path):
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def extract_text(path):
+    if path.lower().endswith(".pdf"):
+        from pypdf import PdfReader
+        reader = PdfReader(path)
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    from bs4 import BeautifulSoup
+    with open(path, "rb") as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    return soup.get_text("\n")
+
+
+def chunk_id(source, text):
+    """Id чанка зависит от источника и содержимого: изменённый чанк получает новый id"""
+    return hashlib.sha1(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+
+def parse_and_chunk(path, chunk_size=1000, chunk_overlap=150):
+    """
+    Разбирает один файл и режет его на чанки. Выполняется в пуле процессов,
+    поэтому возвращает только простые структуры.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    text = clean_text(extract_text(path))
+    chunks = []
+    seen = set()
+    for index, piece in enumerate(splitter.split_text(text)):
+        piece = piece.strip()
+        if not piece:
+            continue
+        content_hash = hashlib.sha1(piece.encode("utf-8")).hexdigest()
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        chunks.append({
+            "id": chunk_id(path, piece),
+            "text": piece,
+            "metadata": {
+                "source": path,
+                "chunk": index,
+                "content_hash": content_hash,
+                "simhash": format(simhash(piece), "016x"),
+            },
+        })
+    return path, chunks
+
+
+def iter_parsed(executor, sources, chunk_size, chunk_overlap, window):
+    """
+    Потоково отдаёт (источник, чанки, ошибка) по мере готовности, держа в работе
+    не больше window файлов одновременно. Файл, который не удалось разобрать,
+    приходит с chunks=None и исключением — остальные файлы обрабатываются дальше.
+    """
+    pending = {}
+    queue = iter(sources)
+    while True:
+        for path in queue:
+            pending[executor.submit(parse_and_chunk, path, chunk_size, chunk_overlap)] = path
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = pending.pop(future)
+            try:
+                _, chunks = future.result()
+            except Exception as e:
+                logging.error(f"Не удалось разобрать {path}: {e}")
+                yield path, None, e
+            else:
+                yield path, chunks, None
+
+
+class IngestionState:
+    """
+    Файл состояния: какие источники уже полностью загружены (для продолжения после
+    прерывания) и какие не удалось разобрать. Неизменённый файл с ошибкой при
+    продолжении пропускается — повторно его разбирает только --retry-failed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.sources = json.load(f).get("sources", {})
+
+    def is_current(self, source):
+        entry = self.sources.get(source)
+        return bool(entry) and {k: entry.get(k) for k in ("mtime", "size")} == source_fingerprint(source)
+
+    def is_failed(self, source):
+        return "error" in self.sources.get(source, {})
+
+    def mark_done(self, source, chunks):
+        self.sources[source] = {**source_fingerprint(source), "chunks": chunks}
+        self.save()
+
+    def mark_failed(self, source, error):
+        try:
+            fingerprint = source_fingerprint(source)
+        except OSError:
+            fingerprint = {}
+        self.sources[source] = {**fingerprint, "error": f"{type(error).__name__}: {error}"}
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": self.sources}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class Ingestor:
+    """
+    Собирает чанки из нескольких файлов в большие батчи, пропускает уже
+    загруженные (id зависит от содержимого), эмбеддит только новые и делает
+    upsert в Chroma пачкой. После загрузки источника удаляет его устаревшие чанки.
+    """
+
+    def __init__(self, collection, embeddings, state, batch_size=256, prune=True):
+        self.collection = collection
+        self.embeddings = embeddings
+        self.state = state
+        self.batch_size = batch_size
+        self.prune = prune
+        self._buffer = []
+        self._buffered_sources = {}
+
+        # Статистика
+        self.started = time.time()
+        self.chunks_seen = 0
+        self.chunks_embedded = 0
+        self.chunks_skipped = 0
+        self.chunks_deleted = 0
+        self.files_failed = []
+
+    def add(self, source, chunks):
+        self._buffer.extend(chunks)
+        self._buffered_sources[source] = {chunk["id"] for chunk in chunks}
+        self.chunks_seen += len(chunks)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def fail(self, source, error):
+        """Файл не разобран: записывается в состояние и в сводку, загрузка продолжается"""
+        self.files_failed.append(source)
+        self.state.mark_failed(source, error)
+
+    def flush(self):
+        for start in range(0, len(self._buffer), self.batch_size):
+            self._upsert(self._buffer[start:start + self.batch_size])
+        self._buffer = []
+        for source, ids in self._buffered_sources.items():
+            if self.prune:
+                self._delete_stale(source, ids)
+            self.state.mark_done(source, len(ids))
+        self._buffered_sources = {}
+
+    def _upsert(self, chunks):
+        if not chunks:
+            return
+        existing = set(self.collection.get(ids=[chunk["id"] for chunk in chunks], include=[])["ids"])
+        fresh = [chunk for chunk in chunks if chunk["id"] not in existing]
+        self.chunks_skipped += len(chunks) - len(fresh)
+        if not fresh:
+            return
+        vectors = self.embeddings.embed_documents([chunk["text"] for chunk in fresh])
+        self.collection.upsert(
+            ids=[chunk["id"] for chunk in fresh],
+            embeddings=vectors,
+            documents=[chunk["text"] for chunk in fresh],
+            metadatas=[chunk["metadata"] for chunk in fresh],
+        )
+        self.chunks_embedded += len(fresh)
+
+    def _delete_stale(self, source, ids):
+        stored = self.collection.get(where={"source": source}, include=[])["ids"]
+        stale = [doc_id for doc_id in stored if doc_id not in ids]
+        if stale:
+            self.collection.delete(ids=stale)
+            self.chunks_deleted += len(stale)
+            logging.info(f"Удалено устаревших чанков {source}: {len(stale)}")
+
+    @property
+    def throughput(self):
+        elapsed = time.time() - self.started
+        return self.chunks_seen / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "chunks": self.chunks_seen,
+            "embedded": self.chunks_embedded,
+            "skipped_unchanged": self.chunks_skipped,
+            "deleted_stale": self.chunks_deleted,
+            "files_failed": len(self.files_failed),
+            "chunks_per_s": round(self.throughput, 1),
+            "embedded_per_s": round(self.chunks_embedded / elapsed, 1) if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,567 @@
+import math
+import time
+import zlib
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HF_API_KEY,
+    HF_ENDPOINT_URLS,
+    LLM_CONNECT_TIMEOUT,
+    LLM_READ_TIMEOUT,
+    LLM_TOTAL_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF,
+    LLM_POOL_SIZE,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_QUANTILE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_MAX_RATIO,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET,
+    LLM_HEALTH_PATH,
+    LLM_HEALTH_INTERVAL
+)
+from services.metrics import queue_depth
+from services.tracing import span, annotate
+
+
+# === Ошибки ===
+class GenerationError(Exception):
+    """Ошибка ответа эндпоинта генерации; retryable — можно повторить (таймаут, 5xx, 429)"""
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CircuitOpenError(GenerationError):
+    """Автомат разомкнут: эндпоинт считается нездоровым, запрос не отправлялся"""
+
+
+def parse_generation(result):
+    """Достаёт текст из ответа эндпоинта (словарь или список словарей с полем content)"""
+    if isinstance(result, dict) and "content" in result:
+        return result["content"]
+    if isinstance(result, list) and len(result) > 0 and isinstance(result[0], dict) and "content" in result[0]:
+        return result[0]["content"]
+    return str(result)
+
+
+# === Гистограмма задержек ===
+class LatencyHistogram:
+    """
+    Накопительная гистограмма (границы корзин в секундах, как в Prometheus)
+    плюс окно последних значений для оценки перцентилей.
+    """
+
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+    def __init__(self, buckets=BUCKETS, window=500):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self._recent.append(value)
+
+    def quantile(self, q, min_samples=1):
+        """Перцентиль по окну последних значений; None, пока значений меньше min_samples"""
+        with self._lock:
+            if len(self._recent) < max(1, min_samples):
+                return None
+            ordered = sorted(self._recent)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, total = {}, 0
+            for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+                total += count
+                cumulative["+Inf" if bound == float("inf") else str(bound)] = total
+            recent = sorted(self._recent)
+        pick = lambda q: round(recent[max(0, math.ceil(q * len(recent)) - 1)], 3) if recent else None
+        return {
+            "count": self.count,
+            "sum_s": round(self.sum, 3),
+            "buckets": cumulative,
+            "p50_s": pick(0.5),
+            "p95_s": pick(0.95),
+            "p99_s": pick(0.99),
+        }
+
+
+# === Автоматический выключатель ===
+class CircuitBreaker:
+    """
+    closed — запросы идут; после failure_threshold ошибок подряд — open:
+    запросы сразу отклоняются reset_timeout секунд; затем half_open —
+    пропускается один пробный запрос, успех замыкает автомат, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="эндпоинт"):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logging.info(f"LLM: {self.name} снова отвечает, автомат замкнут")
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logging.warning(
+                    f"LLM: автомат {self.name} разомкнут после {self.failures} ошибок, "
+                    f"запросы не отправляются {self.reset_timeout:.0f} с"
+                )
+
+
+# === Пул эндпоинтов генерации ===
+def parse_endpoints(spec):
+    """
+    Разбирает список эндпоинтов "url [вес], url [вес]" в [(url, вес)].
+    Вес по умолчанию 1; реплика с весом 2 получает вдвое больше запросов.
+    """
+    endpoints = []
+    for item in (spec or "").split(","):
+        parts = item.split()
+        if not parts:
+            continue
+        weight = float(parts[1]) if len(parts) > 1 else 1.0
+        endpoints.append((parts[0], max(weight, 0.01)))
+    return endpoints
+
+
+class Endpoint:
+    """Одна реплика: свой автомат, счётчик запросов в работе, флаг здоровья и гистограмма"""
+
+    def __init__(self, url, weight=1.0, breaker=None, health_path="/health"):
+        self.url = url
+        self.weight = weight
+        self.health_url = urljoin(url, health_path)
+        self.breaker = breaker or CircuitBreaker()
+        self.healthy = True
+        self.in_flight = 0
+        self.last_used = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency = LatencyHistogram()
+
+    @property
+    def load(self):
+        return (self.in_flight + 1) / self.weight
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "breaker": self.breaker.state,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency": self.latency.snapshot(),
+        }
+
+
+# === Клиент генерации ===
+class GenerationClient:
+    """
+    Клиент эндпоинтов генерации: keep-alive пул соединений, таймауты на
+    соединение и чтение, ограниченные повторы с общим бюджетом времени,
+    опциональный хеджированный запрос (дубль уходит, если первый не ответил
+    за p95 недавних задержек; дублей не больше hedge_max_ratio от запросов).
+
+    Реплик может быть несколько: запрос уходит на здоровую реплику с
+    наименьшим числом запросов в работе с учётом веса, повтор и дубль — на
+    другую. У каждой реплики свой автомат; фоновые проверки health_path
+    выводят реплику из ротации и возвращают её обратно.
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        api_key=None,
+        connect_timeout=3.0,
+        read_timeout=60.0,
+        total_timeout=90.0,
+        max_retries=1,
+        retry_backoff=0.5,
+        pool_size=16,
+        hedge_enabled=False,
+        hedge_quantile=0.95,
+        hedge_min_delay=1.0,
+        hedge_min_samples=20,
+        hedge_max_ratio=0.1,
+        breaker_failures=5,
+        breaker_reset=30.0,
+        health_path="/health",
+        health_interval=0.0
+    ):
+        if isinstance(endpoints, str):
+            endpoints = parse_endpoints(endpoints)
+        self.endpoints = [
+            Endpoint(url, weight, CircuitBreaker(breaker_failures, breaker_reset, url), health_path)
+            for url, weight in endpoints
+        ]
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.health_interval = health_interval
+
+        # Повторы делаем сами (с учётом бюджета), поэтому у адаптера max_retries=0.
+        # pool_connections — по пулу соединений на каждый хост реплики
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, len(self.endpoints)), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/json"
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm") if hedge_enabled else None
+
+        # Гистограммы: одна HTTP-попытка и весь вызов generate с повторами
+        self.attempt_latency = LatencyHistogram()
+        self.total_latency = LatencyHistogram()
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.prompt_tokens = 0
+        self.prompt_tokens_processed = 0
+        self.prefill_ms = 0.0
+
+        self._stop = threading.Event()
+        if health_interval > 0 and self.endpoints:
+            threading.Thread(target=self._probe_loop, name="llm-health", daemon=True).start()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    # --- Выбор реплики ---
+    def _acquire(self, exclude=(), affinity=None):
+        """
+        Занимает реплику с наименьшей взвешенной загрузкой; None — свободных нет.
+        affinity (id пользователя) закрепляет его за одной репликой, где лежит KV-кэш его
+        промптов, пока она загружена не больше чем вдвое сильнее самой свободной.
+        Если проверка здоровья вывела из ротации все реплики (например, единственный
+        llama.cpp ещё загружает модель и отвечает 503), запросы идут на них как есть:
+        перенаправить некуда, а отказы всё равно отсекает автомат.
+        """
+        with self._lock:
+            pool = [e for e in self.endpoints if e.healthy] or self.endpoints
+            candidates = [e for e in pool if e.url not in exclude]
+            # При равной загрузке — та, что дольше не использовалась (равномерно в простое)
+            ordered = sorted(candidates, key=lambda e: (e.load, e.last_used))
+            if affinity is not None and ordered:
+                preferred = self.endpoints[zlib.crc32(str(affinity).encode("utf-8")) % len(self.endpoints)]
+                if preferred in ordered and preferred.load <= 2 * ordered[0].load:
+                    ordered.remove(preferred)
+                    ordered.insert(0, preferred)
+            for endpoint in ordered:
+                if endpoint.breaker.allow():
+                    self._sequence += 1
+                    endpoint.last_used = self._sequence
+                    endpoint.in_flight += 1
+                    endpoint.requests += 1
+                    return endpoint
+        return None
+
+    def _release(self, endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    # --- HTTP ---
+    def _post(self, endpoint, payload, read_timeout):
+        started = time.perf_counter()
+        self._count("attempts")
+        try:
+            try:
+                with span("llm_attempt", endpoint=endpoint.url) as attempt_span:
+                    response = self.session.post(endpoint.url, json=payload, timeout=(self.connect_timeout, read_timeout))
+                    attempt_span.set(http_status=response.status_code)
+            except requests.RequestException as e:
+                # Таймаут, обрыв соединения, битое тело ответа, петля редиректов
+                raise GenerationError(f"{type(e).__name__}: {e}", retryable=True) from e
+            if response.status_code != 200:
+                retryable = response.status_code == 429 or response.status_code >= 500
+                raise GenerationError(
+                    f"Ошибка от API: {response.status_code} - {response.text[:500]}",
+                    status=response.status_code,
+                    retryable=retryable
+                )
+            try:
+                data = response.json()
+                result = parse_generation(data)
+            except ValueError as e:
+                raise GenerationError(f"Некорректный ответ эндпоинта: {e}", status=response.status_code, retryable=True) from e
+        except GenerationError as e:
+            e.endpoint = endpoint.url
+            if e.retryable:
+                endpoint.breaker.record_failure()
+                self._count_endpoint_failure(endpoint)
+            else:
+                # Ошибка запроса (4xx), а не здоровья реплики: автомат её не считает
+                endpoint.breaker.record_success()
+            raise
+        except Exception:
+            # Исход попытки автомат узнаёт всегда: иначе пробный запрос half_open
+            # так и числится в работе, и реплика больше не получает запросов
+            endpoint.breaker.record_failure()
+            self._count_endpoint_failure(endpoint)
+            raise
+        finally:
+            self._release(endpoint)
+        elapsed = time.perf_counter() - started
+        endpoint.breaker.record_success()
+        endpoint.latency.observe(elapsed)
+        self.attempt_latency.observe(elapsed)
+        self._record_usage(data)
+        return result
+
+    def _record_usage(self, data):
+        """
+        Учёт токенов промпта из ответа llama.cpp server: tokens_evaluated — весь
+        промпт, timings.prompt_n — реально посчитанные токены, остальное взято из кэша.
+        """
+        item = data[0] if isinstance(data, list) and data and isinstance(data[0], dict) else data
+        if not isinstance(item, dict) or "tokens_evaluated" not in item:
+            return
+        timings = item.get("timings") or {}
+        total = item.get("tokens_evaluated") or 0
+        processed = timings.get("prompt_n", max(0, total - (item.get("tokens_cached") or 0)))
+        annotate(prompt_tokens=total, prompt_tokens_processed=min(total, processed))
+        with self._lock:
+            self.prompt_tokens += total
+            self.prompt_tokens_processed += min(total, processed)
+            self.prefill_ms += timings.get("prompt_ms") or 0.0
+
+    def _count_endpoint_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+
+    def hedge_delay(self):
+        """Задержка перед дублирующим запросом: p95 недавних успешных попыток, но не меньше минимума"""
+        quantile = self.attempt_latency.quantile(self.hedge_quantile, self.hedge_min_samples)
+        return None if quantile is None else max(self.hedge_min_delay, quantile)
+
+    def _attempt(self, payload, read_timeout, exclude=(), affinity=None):
+        endpoint = self._acquire(exclude, affinity) or (self._acquire() if exclude else None)
+        if endpoint is None:
+            raise CircuitOpenError("Нет доступных эндпоинтов генерации (автоматы разомкнуты или реплики нездоровы)")
+
+        delay = self.hedge_delay() if self.hedge_enabled else None
+        if delay is None or delay >= read_timeout:
+            return self._post(endpoint, payload, read_timeout)
+
+        # Попытки в пуле потоков остаются в трассе запроса
+        primary = self._executor.submit(contextvars.copy_context().run, self._post, endpoint, payload, read_timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # Бюджет дублей: под общей перегрузкой хеджирование само бы её усиливало
+        with self._lock:
+            allowed = self.hedges < self.hedge_max_ratio * self.requests
+            if allowed:
+                self.hedges += 1
+        backup_endpoint = (self._acquire({endpoint.url}) or self._acquire()) if allowed else None
+        if backup_endpoint is None:
+            return primary.result()
+
+        # Первый запрос застрял в хвосте — отправляем дубль (по возможности на другую реплику)
+        backup = self._executor.submit(
+            contextvars.copy_context().run, self._post, backup_endpoint, payload, max(0.1, read_timeout - delay)
+        )
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except GenerationError as e:
+                    error = e
+                    continue
+                if future is backup:
+                    self._count("hedge_wins")
+                return result
+        raise error
+
+    def generate(self, payload, affinity=None, timeout=None):
+        """
+        Отправляет payload и возвращает текст ответа; CircuitOpenError — нет здоровых реплик.
+        timeout — бюджет вызывающего (дедлайн ответа), если он меньше total_timeout.
+        """
+        self._count("requests")
+        if not self.endpoints:
+            raise GenerationError("Не задан эндпоинт генерации (HF_ENDPOINT_URL / HF_ENDPOINT_URLS)")
+
+        total_timeout = min(self.total_timeout, timeout) if timeout is not None else self.total_timeout
+        started = time.perf_counter()
+        attempt = 0
+        failed = set()
+        try:
+            while True:
+                remaining = total_timeout - (time.perf_counter() - started)
+                try:
+                    return self._attempt(payload, min(self.read_timeout, max(0.1, remaining)), failed, affinity)
+                except CircuitOpenError:
+                    if attempt == 0:
+                        self._count("short_circuited")
+                    raise
+                except GenerationError as e:
+                    if not e.retryable:
+                        raise
+                    failed.add(getattr(e, "endpoint", None))
+                    # На другую реплику повторяем сразу, на ту же — после паузы
+                    backoff = 0.0 if len(failed) < len(self.endpoints) else self.retry_backoff * (2 ** attempt)
+                    remaining = total_timeout - (time.perf_counter() - started)
+                    if attempt >= self.max_retries or remaining <= backoff:
+                        raise
+                    attempt += 1
+                    self._count("retries")
+                    logging.warning(f"LLM: попытка {attempt} не удалась ({e}), повтор через {backoff:.1f} с")
+                    time.sleep(backoff)
+        except GenerationError:
+            self._count("failures")
+            raise
+        finally:
+            self.total_latency.observe(time.perf_counter() - started)
+
+    async def agenerate(self, payload, affinity=None, timeout=None):
+        return await asyncio.to_thread(self.generate, payload, affinity, timeout)
+
+    # --- Проверки здоровья ---
+    def probe(self, endpoint):
+        """Реплика здорова, если health_path отвечает без таймаута и 5xx (404 — сервер жив, пути нет)"""
+        try:
+            response = self.session.get(endpoint.health_url, timeout=(self.connect_timeout, self.connect_timeout))
+            healthy = response.status_code < 500
+        except requests.RequestException:
+            healthy = False
+        if healthy != endpoint.healthy:
+            if healthy:
+                logging.info(f"LLM: реплика {endpoint.url} снова здорова, возвращена в ротацию")
+            else:
+                logging.warning(f"LLM: реплика {endpoint.url} не отвечает на проверку, выведена из ротации")
+        endpoint.healthy = healthy
+        return healthy
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                self.probe(endpoint)
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failures": self.failures,
+                "short_circuited": self.short_circuited,
+                "prompt_tokens": self.prompt_tokens,
+                "prompt_tokens_cached": self.prompt_tokens - self.prompt_tokens_processed,
+                "prompt_cache_hit_rate": round(1 - self.prompt_tokens_processed / self.prompt_tokens, 3) if self.prompt_tokens else None,
+                "prefill_ms": round(self.prefill_ms, 1),
+            }
+            endpoints = [endpoint.stats() for endpoint in self.endpoints]
+        return {
+            **counters,
+            "hedge_delay_s": self.hedge_delay() if self.hedge_enabled else None,
+            "attempt_latency": self.attempt_latency.snapshot(),
+            "total_latency": self.total_latency.snapshot(),
+            "endpoints": endpoints,
+        }
+
+    def close(self):
+        self._stop.set()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        self.session.close()
+
+generation_client = GenerationClient(
+    HF_ENDPOINT_URLS,
+    api_key=HF_API_KEY,
+    connect_timeout=LLM_CONNECT_TIMEOUT,
+    read_timeout=LLM_READ_TIMEOUT,
+    total_timeout=LLM_TOTAL_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
+    retry_backoff=LLM_RETRY_BACKOFF,
+    pool_size=LLM_POOL_SIZE,
+    hedge_enabled=LLM_HEDGE_ENABLED,
+    hedge_quantile=LLM_HEDGE_QUANTILE,
+    hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+    hedge_max_ratio=LLM_HEDGE_MAX_RATIO,
+    breaker_failures=LLM_BREAKER_FAILURES,
+    breaker_reset=LLM_BREAKER_RESET,
+    health_path=LLM_HEALTH_PATH,
+    health_interval=LLM_HEALTH_INTERVAL
+)
+# Запросы генерации в полёте (по всем эндпоинтам)
+queue_depth.track(lambda: sum(endpoint.in_flight for endpoint in generation_client.endpoints), "llm_in_flight")
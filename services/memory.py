@@ -0,0 +1,235 @@
+import os
+import sys
+import types
+import logging
+import threading
+import tracemalloc
+from collections import deque
+
+from config import MEMORY_TRACEMALLOC_FRAMES
+
+
+# === Размер объектов ===
+# Не обходим: код, модули и классы принадлежат процессу, а не структуре
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType)
+
+
+def _snapshot(container, attempts=3):
+    """
+    Копия содержимого контейнера, который обработчики меняют в других потоках;
+    None, если он менялся во время каждой из попыток копирования.
+    """
+    for _ in range(attempts):
+        try:
+            if isinstance(container, dict):
+                return [value for pair in list(container.items()) for value in pair]
+            return list(container)
+        except RuntimeError:
+            # dictionary/set/deque changed size during iteration
+            continue
+    return None
+
+
+def deep_size(obj, limit=500000):
+    """
+    Приблизительный размер объекта вместе со всем, на что он ссылается
+    (sys.getsizeof по графу, каждый объект один раз). Обход ограничен limit
+    объектами; второе значение — True, если граф обойдён не полностью
+    (в том числе если контейнер не удалось скопировать из-за изменений).
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    truncated = False
+    while stack:
+        if len(seen) >= limit:
+            return total, True
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _OPAQUE):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item, 0)
+        if isinstance(item, (dict, list, tuple, set, frozenset, deque)):
+            children = _snapshot(item)
+            if children is None:
+                truncated = True
+            else:
+                stack.extend(children)
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return total, truncated
+
+
+def _entry(name, structure, items=None):
+    # В режиме масштабирования состояние в общем хранилище: в процессе только число записей
+    data = getattr(structure, "_data", structure)
+    entry = {"name": name, "entries": len(data)}
+    if isinstance(data, dict):
+        size, truncated = deep_size(data)
+        entry["mb"] = round(size / 2 ** 20, 2)
+        if truncated:
+            entry["truncated"] = True
+    else:
+        entry["location"] = "state_store"
+    if items is not None:
+        entry["items"] = items
+    return entry
+
+
+def state_structures():
+    """Число записей и приблизительный размер структур состояния и кэшей процесса"""
+    from services import utils, faq
+    from services.session_cache import session_cache
+    from services.admission import answer_cache, rate_limiter
+    from services.tenants import tenants
+
+    structures = [
+        _entry("user_message_history", utils.user_message_history,
+               items=sum(len(history) for history in list(utils.user_message_history._data.values()))),
+        _entry("user_question_history", utils.user_question_history,
+               items=sum(len(history) for history in list(utils.user_question_history._data.values()))),
+        _entry("user_context_order", utils.user_context_order),
+        _entry("user_states", utils.user_states),
+        _entry("cleaned_documents", utils._cleaned_documents),
+        _entry("session_cache", session_cache._sessions),
+        _entry("answer_cache", answer_cache._answers),
+        _entry("rate_limiter", rate_limiter._buckets),
+    ]
+    indexes = {id(tenant.faq_index): (tenant.name, tenant.faq_index) for tenant in tenants if tenant.faq_index}
+    if faq.faq_index is not None:
+        indexes.setdefault(id(faq.faq_index), ("default", faq.faq_index))
+    for name, index in indexes.values():
+        structures.append({
+            "name": f"faq:{name}",
+            "entries": len(index.answers),
+            "mb": round(index.matrix.nbytes / 2 ** 20, 2),
+        })
+    for tenant in tenants:
+        bm25_index = getattr(tenant.retriever, "bm25_index", None)
+        if bm25_index is not None:
+            size, truncated = deep_size([bm25_index.documents, bm25_index.postings, bm25_index.idf, bm25_index.doc_lengths])
+            structures.append({"name": f"bm25:{tenant.name}", "entries": len(bm25_index.documents),
+                               "mb": round(size / 2 ** 20, 2), **({"truncated": True} if truncated else {})})
+    return structures
+
+
+# === Модели ===
+# Заполняется в main.py: имя -> эмбеддер или реранкер (как их видят обработчики), пул инференса
+models = {}
+inference_pool = None
+
+# Обёртки хранят модель в одном из этих атрибутов
+_WRAPPED = ("embeddings", "cross_encoder", "reranker", "client", "model", "_client")
+
+
+def _model_size(model, depth=0):
+    """Байты весов: параметры и буферы torch или размер файла ONNX (веса сессии ≈ файлу)"""
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return {"backend": "torch", "mb": round(sum(t.numel() * t.element_size() for t in tensors) / 2 ** 20, 1)}
+    if getattr(model, "onnx_path", None):
+        return {"backend": "onnx", "mb": round(os.path.getsize(model.onnx_path) / 2 ** 20, 1), "file": model.onnx_path}
+    if getattr(model, "pool", None) is not None:
+        return {"backend": "inference_pool"}
+    if depth < 4:
+        for attribute in _WRAPPED:
+            inner = getattr(model, attribute, None)
+            if inner is not None and inner is not model:
+                found = _model_size(inner, depth + 1)
+                if found:
+                    return found
+    return None
+
+
+def _rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def model_memory():
+    report = {name: _model_size(model) or {"backend": type(model).__name__} for name, model in models.items()}
+    if inference_pool is not None:
+        report["inference_pool_workers"] = [
+            {"index": worker.index, "pid": worker.process.pid, "rss_mb": _rss_mb(worker.process.pid)}
+            for worker in inference_pool.workers
+        ]
+    return report
+
+
+# === Рост аллокаций ===
+class AllocationTracker:
+    """
+    Разница снимков tracemalloc между вызовами: какие строки кода нарастили
+    память с прошлого раза. tracemalloc запускается первым вызовом (до этого
+    ничего не стоит) и работает до stop().
+    """
+
+    # Служебные аллокации самого tracemalloc и импорта не интересны
+    FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+    def __init__(self, frames=1):
+        self.frames = frames
+        self.previous = None
+        self._lock = threading.Lock()
+
+    def diff(self, limit=20):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.previous = None
+                logging.info(f"tracemalloc запущен ({self.frames} кадров на аллокацию)")
+            snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+            previous, self.previous = self.previous, snapshot
+            traced, peak = tracemalloc.get_traced_memory()
+
+        report = {"traced_mb": round(traced / 2 ** 20, 2), "peak_mb": round(peak / 2 ** 20, 2)}
+        if previous is None:
+            report["status"] = "started"
+            report["top"] = [
+                {"site": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:limit]
+            ]
+            return report
+        report["status"] = "diff"
+        report["top"] = [
+            {
+                "site": str(stat.traceback),
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "count_diff": stat.count_diff,
+                "size_kb": round(stat.size / 1024, 1),
+            }
+            for stat in snapshot.compare_to(previous, "lineno")[:limit]
+        ]
+        return report
+
+    def stop(self):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                logging.info("tracemalloc остановлен")
+            self.previous = None
+
+
+allocation_tracker = AllocationTracker(frames=MEMORY_TRACEMALLOC_FRAMES)
+
+
+def memory_report(top=20, allocations=True):
+    report = {
+        "rss_mb": _rss_mb(),
+        "structures": state_structures(),
+        "models": model_memory(),
+    }
+    if allocations:
+        report["allocations"] = allocation_tracker.diff(limit=top)
+    return report
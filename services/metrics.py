@@ -0,0 +1,167 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# Секунды: от миллисекундных этапов (эмбеддинг, FAQ, сборка промпта) до генерации
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# === Метрики в формате Prometheus ===
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """
+    Счётчики по корзинам без хранения значений: observe — bisect и сложение
+    под блокировкой, накопительные суммы считаются только при экспорте.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счётчики по корзинам (+Inf последняя), сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Текущие значения. Либо меняются inc/dec, либо считываются функцией (track)
+    только при запросе /metrics — тогда на горячем пути ничего не делается.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def track(self, function, *labels):
+        self._functions[labels] = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, function in list(self._functions.items()):
+            try:
+                values[labels] = function()
+            except Exception as e:
+                logging.debug(f"Метрика {self.name}{labels} не считана: {e}")
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in values.items()]
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Этапы: faq, embedding, retrieval, followup_check, rerank, prompt, llm, reply и typing (Telegram),
+# chatwoot_* (каждый вызов API Chatwoot), telegram_send (ответ оператора из вебхука), admission
+stage_seconds = registry.histogram("rag_bot_stage_seconds", "Длительность этапов обработки", ("stage",))
+stage_errors = registry.counter("rag_bot_stage_errors_total", "Ошибки по этапам", ("stage",))
+answer_seconds = registry.histogram(
+    "rag_bot_answer_seconds", "Полное время process_question (ok или degraded)", ("outcome",)
+)
+requests_in_flight = registry.gauge("rag_bot_requests_in_flight", "Сообщения пользователей в обработке")
+queue_depth = registry.gauge("rag_bot_queue_depth", "Глубина очередей", ("queue",))
+state_entries = registry.gauge("rag_bot_state_entries", "Записей в состоянии и кэшах процесса", ("structure",))
+
+
+@contextmanager
+def timed(stage):
+    """Длительность блока в rag_bot_stage_seconds, исключение — в rag_bot_stage_errors_total"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage)
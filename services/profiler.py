@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+# Функции, на которых поток ждёт (сокет, блокировка, очередь, цикл событий), а не считает —
+# запасной признак простоя там, где нет /proc
+IDLE_FUNCTIONS = {"wait", "select", "poll", "epoll", "sleep", "acquire", "accept", "get", "recv", "recv_into", "readinto", "_worker"}
+
+
+def _cpu_ticks(native_id):
+    """Процессорное время потока в тиках (utime + stime из /proc); None, если недоступно"""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# === Сэмплирующий профилировщик ===
+class SamplingProfiler:
+    """
+    Раз в interval секунд снимает стеки всех потоков процесса (sys._current_frames)
+    и считает одинаковые стеки. Профилируемый код не инструментируется, поэтому
+    работает на живом процессе; стоимость — только сам поток сэмплирования.
+    Профиль процессорный: на Linux стек учитывается с весом тиков CPU, которые
+    поток потратил с прошлого сэмпла (ждущие потоки не попадают), без /proc —
+    отбрасываются стеки, стоящие в функциях ожидания. include_idle — профиль
+    по времени (все стеки, вес 1). Результат — свёрнутые стеки (flamegraph.pl, speedscope).
+    """
+
+    def __init__(self, max_depth=64):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def capture(self, seconds, interval=0.01, include_idle=False):
+        """Профиль за seconds секунд; None, если уже идёт другой замер"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(seconds, interval, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds, interval, include_idle):
+        me = threading.get_ident()
+        stacks = Counter()
+        ticks = {}
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                thread = threads.get(ident)
+                weight = 1
+                if not include_idle:
+                    current = _cpu_ticks(thread.native_id) if thread is not None else None
+                    if current is not None:
+                        weight, ticks[ident] = current - ticks.get(ident, current), current
+                    elif frame.f_code.co_name in IDLE_FUNCTIONS:
+                        weight = 0
+                if weight <= 0:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread.name if thread is not None else str(ident))
+                stacks[";".join(reversed(stack))] += weight
+            samples += 1
+            time.sleep(interval)
+        return {"samples": samples, "seconds": seconds, "interval": interval, "stacks": stacks}
+
+
+def folded(profile):
+    """Свёрнутые стеки: «поток;функция;...;функция число» построчно, частые сверху"""
+    return "\n".join(f"{stack} {count}" for stack, count in profile["stacks"].most_common()) + "\n"
+
+
+def top_functions(profile, limit=30):
+    """Функции с наибольшим числом сэмплов на вершине стека (собственное время)"""
+    leaves = Counter()
+    for stack, count in profile["stacks"].items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [{"function": name, "samples": count, "share": round(count / total, 4)} for name, count in leaves.most_common(limit)]
+
+
+profiler = SamplingProfiler()
@@ -1,11 +1,44 @@
 import time
+import hashlib
+import asyncio
 import logging
-import requests
+import threading
 from langchain.prompts import PromptTemplate
-from langchain_core.documents import Document
 
-from config import HF_API_KEY, HF_ENDPOINT_URL, RAG_PROMPT_TEMPLATE
-from services.utils import clean_text, user_question_history, is_contextual_followup
+from config import (
+    RAG_PROMPT_TEMPLATE,
+    DEDUP_ENABLED,
+    DEDUP_MAX_DISTANCE,
+    LLM_FALLBACK_REPLY,
+    LLM_PROMPT_LAYOUT,
+    LLM_CACHE_PROMPT,
+    LLM_SLOT_COUNT,
+    LLM_USER_AFFINITY,
+    SESSION_CACHE_ENABLED,
+    SESSION_DELTA_K,
+    DEADLINE_ENABLED,
+    ANSWER_DEADLINE,
+    DEADLINE_FOLLOWUP_BUDGET,
+    DEADLINE_RETRIEVAL_BUDGET,
+    DEADLINE_RERANK_BUDGET,
+    DEADLINE_MIN_RERANK_PAIRS,
+    DEADLINE_LLM_MIN,
+    DEADLINE_SHRUNK_CONTEXT,
+    DEADLINE_FAQ_THRESHOLD,
+    DEADLINE_REPLY,
+    ADMISSION_ENABLED
+)
+from services.utils import clean_text, clean_document, user_question_history, user_context_order, is_contextual_followup
+from services.dedup import NearDuplicateFilter
+from services.llm_client import generation_client, CircuitOpenError
+from services.deadline import Deadline, PairCostEstimator, degradation_stats
+from services.admission import answer_cache
+from services import faq
+from services.session_cache import session_cache
+from services.timeline import stage, run_stage
+from services.metrics import answer_seconds
+from services.tracing import annotate
+from services.tenants import current_tenant
 from collections import deque
 
 # Инициализация промпта
@@ -14,81 +47,344 @@ custom_prompt = PromptTemplate(
     template=RAG_PROMPT_TEMPLATE
 )
 
+# Промпты тенантов (у каждого жилого комплекса свой шаблон)
+tenant_prompts = {}
+
+# Статический префикс промпта (инструкции до контекста) — одинаковый для всех запросов
+PROMPT_PREFIX, PROMPT_SUFFIX = RAG_PROMPT_TEMPLATE.split("{context}", 1)
+
+# Фильтр почти одинаковых чанков (подписи кэшируются между запросами)
+near_duplicate_filter = NearDuplicateFilter(max_distance=DEDUP_MAX_DISTANCE) if DEDUP_ENABLED else None
+
+# Время оценки одной пары cross-encoder: сколько кандидатов успеем переранжировать за бюджет
+rerank_cost = PairCostEstimator()
+
+# === Реранкинг ===
+def rerank_documents(question, docs, reranker, cancelled=None, chunk_size=32):
+    """
+    Возвращает пары (документ, оценка cross-encoder) по убыванию оценки.
+    cancelled (threading.Event) — вызывающий больше не ждёт: поток не может быть прерван,
+    поэтому пары оцениваются порциями по chunk_size и после установки события новые
+    порции не запускаются; уже начатая порция досчитывается
+    """
+    if not docs:
+        return []
+    if hasattr(reranker, "rerank"):
+        # Каскадный реранкер сам решает, сколько кандидатов оценивать
+        return reranker.rerank(question, docs, cancelled=cancelled)
+    if cancelled is None:
+        scores = reranker.predict([(question, doc.page_content) for doc in docs])
+    else:
+        scores = []
+        for start in range(0, len(docs), chunk_size):
+            if cancelled.is_set():
+                return []
+            scores.extend(reranker.predict([(question, doc.page_content) for doc in docs[start:start + chunk_size]]))
+    return sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+
+async def rerank_within(question, docs, reranker, timeout):
+    """
+    rerank_documents в потоке с таймаутом. asyncio.TimeoutError — как у wait_for; при этом
+    поток дорабатывает лишь текущую порцию пар и не занимает CPU следующего запроса
+    """
+    cancelled = threading.Event()
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(rerank_documents, question, docs, reranker, cancelled), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        cancelled.set()
+        raise
+
+def scored_pairs(reranked_docs):
+    """Число реально оценённых пар (каскад оставляет часть кандидатов без оценки)"""
+    return sum(1 for _, score in reranked_docs if score is not None)
+
+# === Кандидаты для промпта ===
+async def rank_candidates(question, docs, reranker, deadline=None):
+    """
+    Очистка, дедупликация и реранкинг найденных документов: пары (документ, оценка).
+    С дедлайном реранкинг обрезается до пар, которые успеют оцениться за бюджет: не попавшие
+    в оценку кандидаты идут после оценённых в порядке поиска с оценкой None. Слишком малый
+    бюджет или таймаут — все пары в порядке поиска с оценкой None.
+    """
+    cleaned_docs = [clean_document(doc) for doc in docs]
+
+    dropped = 0
+    if near_duplicate_filter and cleaned_docs:
+        cleaned_docs, dropped = near_duplicate_filter.collapse(cleaned_docs)
+    if not cleaned_docs:
+        return []
+
+    timeout = deadline.timeout("rerank") if deadline else None
+    affordable = rerank_cost.affordable(timeout)
+    unscored = []
+    if affordable is not None and affordable < len(cleaned_docs):
+        if affordable < DEADLINE_MIN_RERANK_PAIRS:
+            deadline.degrade("rerank_skipped", f"бюджет {timeout:.2f} с, порядок поиска")
+            return [(doc, None) for doc in cleaned_docs]
+        deadline.degrade("rerank_truncated", f"оценено {affordable} из {len(cleaned_docs)} кандидатов")
+        unscored = [(doc, None) for doc in cleaned_docs[affordable:]]
+
+    rerank_start = time.perf_counter()
+    try:
+        reranked_docs = await rerank_within(question, cleaned_docs[:len(cleaned_docs) - len(unscored)], reranker, timeout)
+    except asyncio.TimeoutError:
+        deadline.degrade("rerank_timeout", f"не уложился в {timeout:.2f} с, порядок поиска")
+        return [(doc, None) for doc in cleaned_docs]
+    rerank_time = time.perf_counter() - rerank_start
+    pairs = scored_pairs(reranked_docs)
+    rerank_cost.observe(rerank_time, pairs)
+    if dropped:
+        saved = rerank_time / max(1, pairs) * dropped
+        logging.info(
+            f"Дедупликация: отброшено {dropped} дублей (всего {near_duplicate_filter.dropped}), "
+            f"сэкономлено ~{saved * 1000:.0f} мс реранкинга"
+        )
+    return reranked_docs + unscored
+
+async def refresh_candidates(question, cached, docs, reranker, deadline=None):
+    """
+    Уточняющий вопрос: docs — небольшой поиск на SESSION_DELTA_K документов,
+    оцениваются только те, которых нет в наборе прошлого вопроса, затем слияние по оценке.
+    Не успели оценить новые — остаётся набор прошлого вопроса.
+    """
+    docs = docs[:SESSION_DELTA_K]
+    known = {doc.page_content for doc, _ in cached}
+    new_docs = [doc for doc in (clean_document(doc) for doc in docs) if doc.page_content not in known]
+
+    if near_duplicate_filter and new_docs:
+        kept, _ = near_duplicate_filter.collapse([doc for doc, _ in cached] + new_docs)
+        kept_new = {doc.page_content for doc in kept} - known
+        new_docs = [doc for doc in new_docs if doc.page_content in kept_new]
+
+    scored = []
+    if new_docs:
+        timeout = deadline.timeout("rerank") if deadline else None
+        rerank_start = time.perf_counter()
+        try:
+            scored = await rerank_within(question, new_docs, reranker, timeout)
+        except asyncio.TimeoutError:
+            deadline.degrade("rerank_timeout", f"новые кандидаты не оценены за {timeout:.2f} с, набор прошлого вопроса")
+            return list(cached)
+        rerank_cost.observe(time.perf_counter() - rerank_start, scored_pairs(scored))
+    logging.info(f"Уточняющий вопрос: из кэша сессии {len(cached)} кандидатов, заново оценено {scored_pairs(scored)}")
+    return session_cache.merge(cached, scored)
+
+# === Сборка промпта ===
+def order_for_prompt_cache(user_id, docs):
+    """
+    Чанки, которые были в прошлом промпте пользователя, ставятся первыми в
+    прежнем порядке, новые — после них в порядке реранкинга. Тогда промпт
+    уточняющего вопроса начинается с того же текста, что и предыдущий,
+    и сервер берёт этот префикс из KV-кэша слота.
+    """
+    by_content = {doc.page_content: doc for doc in docs}
+    previous = [content for content in user_context_order.get(user_id, []) if content in by_content]
+    kept = set(previous)
+    ordered = [by_content[content] for content in previous] + [doc for doc in docs if doc.page_content not in kept]
+    user_context_order[user_id] = [doc.page_content for doc in ordered]
+    return ordered
+
+def build_prompt(user_id, docs, question, layout=LLM_PROMPT_LAYOUT):
+    tenant = current_tenant.get()
+    if layout == "cache":
+        docs = order_for_prompt_cache(user_id, docs)
+        context = "\n\n".join(doc.page_content for doc in docs)
+        prefix, suffix = (tenant.prompt_prefix, tenant.prompt_suffix) if tenant else (PROMPT_PREFIX, PROMPT_SUFFIX)
+        return prefix + context + suffix.replace("{question}", question)
+    combined_context = "\n\n".join([doc.page_content for doc in docs])
+    if tenant:
+        return tenant_prompt(tenant).format(context=combined_context, question=question)
+    return custom_prompt.format(context=combined_context, question=question)
+
+def tenant_prompt(tenant):
+    """PromptTemplate тенанта (создаётся один раз)"""
+    if tenant.name not in tenant_prompts:
+        tenant_prompts[tenant.name] = PromptTemplate(input_variables=["context", "question"], template=tenant.prompt_template)
+    return tenant_prompts[tenant.name]
+
+def generation_hints(user_id, cache_prompt=LLM_CACHE_PROMPT, slot_count=LLM_SLOT_COUNT):
+    """
+    Подсказки серверу генерации: переиспользовать KV-кэш промпта и слот пользователя.
+    Слот считается другим хэшем (blake2b): реплику (affinity) и шард выбирает crc32(user_id),
+    и при числе слотов, кратном числу реплик, все пользователи реплики попали бы в один слот;
+    crc32 с другим префиксом не помогает — он линеен, младшие биты остаются связаны.
+    Пользователи с одним слотом всё равно ждут друг друга — слот обслуживает один запрос
+    """
+    hints = {}
+    if cache_prompt:
+        hints["cache_prompt"] = True
+    if slot_count > 0:
+        digest = hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8).digest()
+        hints["id_slot"] = int.from_bytes(digest, "little") % slot_count
+    return hints
+
+# === Дедлайн ===
+def new_deadline():
+    """Дедлайн ответа с бюджетами этапов; при выключенном DEADLINE_ENABLED — без ограничений"""
+    if not DEADLINE_ENABLED:
+        return Deadline()
+    return Deadline(ANSWER_DEADLINE, {
+        "followup_check": DEADLINE_FOLLOWUP_BUDGET,
+        "retrieval": DEADLINE_RETRIEVAL_BUDGET,
+        "rerank": DEADLINE_RERANK_BUDGET,
+    })
+
+async def fallback_answer(question, deadline):
+    """Ответ, когда на полный пайплайн времени нет: FAQ с пониженным порогом или DEADLINE_REPLY"""
+    faq_index = faq.current_faq_index()
+    if faq_index:
+        answer, score = await asyncio.to_thread(faq_index.match, question, DEADLINE_FAQ_THRESHOLD)
+        if answer:
+            deadline.degrade("faq_fallback", f"сходство {score:.3f}")
+            return answer
+    deadline.degrade("deadline_reply")
+    return DEADLINE_REPLY
+
 # === Запрос пользователя (RAG пайплайн) ===
 async def process_question(user_id, question, base_retriever, reranker):
     logging.info(f"Запрос от пользователя {user_id}: {question}")
+    start = time.time()
+    deadline = new_deadline()
     try:
-        start = time.time()
-
         clean_question = clean_text(question)
 
+        # Курируемый ответ из FAQ: одно сравнение с матрицей формулировок вместо всего пайплайна
+        faq_index = faq.current_faq_index()
+        if faq_index:
+            with stage("faq"):
+                answer, score = await asyncio.to_thread(faq_index.match, clean_question)
+            if answer:
+                logging.info(f"Ответ из FAQ (сходство {score:.3f}, доля попаданий {faq_index.hit_rate:.1%})")
+                annotate(faq_hit=True, faq_score=round(float(score), 3))
+                return answer
+
         # Инициализация истории вопросов пользователя, если нет
         if user_id not in user_question_history:
             user_question_history[user_id] = deque(maxlen=4)
 
-        use_context = is_contextual_followup(user_id, clean_question, reranker)
-        if not use_context:
+        # Поиск не зависит от проверки уточняющего вопроса (до 4 вызовов cross-encoder) — идут параллельно.
+        # Есть набор кандидатов сессии — вопрос, вероятно, уточняющий: ищем только SESSION_DELTA_K
+        # документов, а если проверка скажет, что тема сменилась, запускаем полный поиск
+        cached = session_cache.get(user_id) if SESSION_CACHE_ENABLED else None
+        retrieval_kwargs = {"k": SESSION_DELTA_K} if cached else {}
+        candidates_start = time.perf_counter()
+        retrieval_started = time.monotonic()
+        retrieval = asyncio.create_task(
+            run_stage("retrieval", base_retriever.aget_relevant_documents(clean_question, **retrieval_kwargs))
+        )
+        followup_checked = True
+        try:
+            with stage("followup_check"):
+                use_context = await asyncio.wait_for(
+                    asyncio.to_thread(is_contextual_followup, user_id, clean_question, reranker),
+                    deadline.timeout("followup_check")
+                )
+        except asyncio.TimeoutError:
+            # Не знаем, сменилась ли тема: отвечаем как на новый вопрос, но историю не трогаем
+            deadline.degrade("followup_check_skipped", "вопрос считается новым")
+            use_context, followup_checked = False, False
+        except BaseException:
+            retrieval.cancel()
+            raise
+        if not use_context and followup_checked:
             user_question_history[user_id].clear()
+            user_context_order.pop(user_id, None)
+            session_cache.drop(user_id)
             logging.info(f"Контекст сброшен для пользователя {user_id}: тема изменилась")
         user_question_history[user_id].append(clean_question)
 
-        docs = base_retriever.get_relevant_documents(clean_question)
-        logging.info(f"Найдено документов: {len(docs)}")
+        if cached and not use_context:
+            # Дельты для нового вопроса мало. Малый поиск не отменяем: его ждёт пакет RetrievalBatcher
+            cached = None
+            retrieval_started = time.monotonic()
+            retrieval = asyncio.create_task(run_stage("retrieval", base_retriever.aget_relevant_documents(clean_question)))
 
-        cleaned_docs = [Document(page_content=clean_text(doc.page_content), metadata=doc.metadata) for doc in docs]
+        try:
+            docs = await asyncio.wait_for(retrieval, deadline.timeout("retrieval", retrieval_started))
+        except asyncio.TimeoutError:
+            docs = None
 
-        if cleaned_docs:
-            rerank_inputs = [(clean_question, doc.page_content) for doc in cleaned_docs]
-            scores = reranker.predict(rerank_inputs)
-            reranked_docs = sorted(zip(cleaned_docs, scores), key=lambda x: x[1], reverse=True)
-            cleaned_docs = [doc for doc, _ in reranked_docs]
+        if docs is None:
+            # Поиск не уложился в бюджет: прошлый набор кандидатов сессии, иначе ответ без поиска
+            stale = session_cache.get(user_id) if SESSION_CACHE_ENABLED and use_context else None
+            if not stale:
+                return await fallback_answer(clean_question, deadline)
+            deadline.degrade("stale_candidates", f"поиск дольше {DEADLINE_RETRIEVAL_BUDGET} с, кандидаты прошлого вопроса")
+            reranked_docs = stale
+        else:
+            logging.info(f"Найдено документов: {len(docs)}")
+            annotate(retrieved_docs=len(docs), followup=use_context)
+            with stage("rerank"):
+                if cached:
+                    reranked_docs = await refresh_candidates(clean_question, cached, docs, reranker, deadline)
+                    latency = session_cache.followup_latency
+                else:
+                    reranked_docs = await rank_candidates(clean_question, docs, reranker, deadline)
+                    latency = session_cache.cold_latency
+            latency.observe(time.perf_counter() - candidates_start)
+            # Пары без оценки (реранкинг пропущен) в кэш сессии не кладём
+            if SESSION_CACHE_ENABLED and reranked_docs and reranked_docs[0][1] is not None:
+                session_cache.put(user_id, reranked_docs)
+                logging.info(
+                    f"Кандидаты за {(time.perf_counter() - candidates_start) * 1000:.0f} мс "
+                    f"(p50 новых вопросов {(session_cache.cold_latency.quantile(0.5) or 0) * 1000:.0f} мс, "
+                    f"уточняющих {(session_cache.followup_latency.quantile(0.5) or 0) * 1000:.0f} мс)"
+                )
+        cleaned_docs = [doc for doc, _ in reranked_docs]
 
         if not cleaned_docs:
             logging.warning("После очистки не осталось документов")
             return "Не удалось найти подходящую информацию для ответа на ваш вопрос."
 
-        combined_context = "\n\n".join([doc.page_content for doc in cleaned_docs])
-        
+        # Мало времени на генерацию: короче контекст — быстрее префилл
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            return await fallback_answer(clean_question, deadline)
+        if remaining < DEADLINE_LLM_MIN and len(cleaned_docs) > DEADLINE_SHRUNK_CONTEXT:
+            deadline.degrade("context_shrunk", f"{len(cleaned_docs)} → {DEADLINE_SHRUNK_CONTEXT} чанков, на генерацию {remaining:.1f} с")
+            cleaned_docs = cleaned_docs[:DEADLINE_SHRUNK_CONTEXT]
+
         try:
-            prompt = custom_prompt.format(context=combined_context, question=clean_question)
+            with stage("prompt"):
+                prompt = build_prompt(user_id, cleaned_docs, clean_question)
+            annotate(context_docs=len(cleaned_docs), prompt_chars=len(prompt))
 
             payload = {
                 "prompt": prompt,
                 "max_new_tokens": 320,
                 "temperature": 0.3,
-                "stop": ["</s>"]
+                "stop": ["</s>"],
+                **generation_hints(user_id)
             }
 
-            headers = {
-                "Authorization": f"Bearer {HF_API_KEY}",
-                "Content-Type": "application/json"
-            }
-
-            response = requests.post(HF_ENDPOINT_URL, headers=headers, json=payload)
-
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, dict) and "content" in result:
-                    response_text = result["content"]
-                elif isinstance(result, list) and len(result) > 0 and isinstance(result[0], dict) and "content" in result[0]:
-                    response_text = result[0]["content"]
-                else:
-                    response_text = str(result)
-
-                response_text = clean_text(response_text)
-                logging.info(f"Ответ от модели: {response_text}")
-                return response_text.strip()
-            else:
-                logging.error(f"Ошибка от API: {response.status_code} - {response.text}")
-                return "Произошла ошибка при обработке вашего запроса через языковую модель."
+            affinity = user_id if LLM_USER_AFFINITY else None
+            with stage("llm"):
+                response_text = await generation_client.agenerate(payload, affinity=affinity, timeout=deadline.timeout())
+            response_text = clean_text(response_text).strip()
+            logging.info(f"Ответ от модели: {response_text}")
+            # Полный ответ на самостоятельный вопрос пригодится, если под нагрузкой запрос придётся сбросить
+            if ADMISSION_ENABLED and not use_context and not deadline.degradations:
+                answer_cache.put(clean_question, response_text)
+            return response_text
 
+        except CircuitOpenError:
+            logging.warning("LLM недоступна (автомат разомкнут), отправлен резервный ответ")
+            return LLM_FALLBACK_REPLY
         except Exception as e:
             logging.error(f"Ошибка при вызове LLM: {e}")
+            if deadline.enabled and deadline.remaining() <= 0:
+                deadline.degrade("llm_timeout")
+                return DEADLINE_REPLY
             return "Произошла ошибка при обработке вашего запроса через языковую модель."
 
-        end = time.time()
-        logging.info(f"Время выполнения: {end - start:.2f} секунд")
-
     except Exception as e:
         logging.error(f"Ошибка в процессе обработки: {e}")
-        return "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте другой вопрос."
\ No newline at end of file
+        return "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте другой вопрос."
+
+    finally:
+        answer_seconds.observe(time.time() - start, "degraded" if deadline.degradations else "ok")
+        if deadline.degradations:
+            annotate(degradations=list(deadline.degradations))
+        degradation_stats.finish(deadline)
+        degradations = f", деградации: {', '.join(deadline.degradations)}" if deadline.degradations else ""
+        logging.info(f"Время выполнения: {time.time() - start:.2f} секунд{degradations}")
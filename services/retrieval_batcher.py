@@ -0,0 +1,139 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+from langchain_core.documents import Document
+
+from services.inference_backends import embed_queries
+
+
+# === Объединение одновременных запросов к Chroma ===
+class RetrievalBatcher:
+    """
+    Собирает запросы, пришедшие в течение короткого окна, и выполняет их
+    одним вызовом collection.query с несколькими query_embeddings.
+    collection — коллекция Chroma (client.get_or_create_collection), embeddings —
+    тот же эмбеддер, что у векторного хранилища; вопросы кодируются как запросы
+    (embed_query), а не как документы.
+    Интерфейс совместим с ретривером LangChain (get_relevant_documents /
+    aget_relevant_documents), поэтому может подменять base_retriever.
+    """
+
+    def __init__(self, collection, embeddings, k=50, max_batch_size=32, window_ms=5.0, workers=2):
+        self.collection = collection
+        self.embeddings = embeddings
+        self.k = k
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self._queue = queue.Queue()
+
+        # Статистика для логов и бенчмарков
+        self.batches = 0
+        self.queries = 0
+
+        self._workers = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._run, name=f"retrieval-batcher-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, query, k=None):
+        """Ставит запрос в очередь и возвращает Future со списком (Document, distance)"""
+        future = Future()
+        self._queue.put((query, k or self.k, future))
+        return future
+
+    def search_with_scores(self, query, k=None):
+        return self.submit(query, k).result()
+
+    async def asearch_with_scores(self, query, k=None):
+        return await asyncio.wrap_future(self.submit(query, k))
+
+    def get_relevant_documents(self, query, k=None):
+        return [doc for doc, _ in self.search_with_scores(query, k)]
+
+    async def aget_relevant_documents(self, query, k=None):
+        return [doc for doc, _ in await self.asearch_with_scores(query, k)]
+
+    def queue_size(self):
+        """Число запросов, ждущих пакета"""
+        return self._queue.qsize()
+
+    @property
+    def average_batch_size(self):
+        return self.queries / self.batches if self.batches else 0.0
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch = self._take(self._queue.get())
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        if timeout > 0:
+                            batch += self._take(self._queue.get(timeout=timeout))
+                        else:
+                            batch += self._take(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._execute(batch)
+            except Exception as e:
+                # Один неудачный пакет не должен останавливать поток: иначе остальные запросы ждут вечно
+                logging.error(f"Ошибка в потоке пакетного поиска: {e}", exc_info=True)
+                for _, _, future in batch:
+                    self._resolve(future, exception=e)
+
+    @staticmethod
+    def _take(item):
+        """
+        Переводит Future запроса в состояние running; отменённый вызывающим запрос
+        пропускается. После этого cancel() уже не срабатывает и результат можно выставить
+        """
+        return [item] if item[2].set_running_or_notify_cancel() else []
+
+    @staticmethod
+    def _resolve(future, result=None, exception=None):
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _execute(self, batch):
+        try:
+            texts = [query for query, _, _ in batch]
+            embeddings = embed_queries(self.embeddings, texts)
+            n_results = max(k for _, k, _ in batch)
+            result = self.collection.query(
+                query_embeddings=embeddings,
+                n_results=n_results,
+                include=["documents", "metadatas", "distances"]
+            )
+        except Exception as e:
+            logging.error(f"Ошибка пакетного запроса к Chroma ({len(batch)} запросов): {e}")
+            for _, _, future in batch:
+                self._resolve(future, exception=e)
+            return
+
+        self.batches += 1
+        self.queries += len(batch)
+        logging.debug(f"Пакетный запрос к Chroma: {len(batch)} запросов, n_results={n_results}")
+
+        for i, (_, k, future) in enumerate(batch):
+            ids = result["ids"][i]
+            documents = result["documents"][i]
+            metadatas = result["metadatas"][i]
+            distances = result["distances"][i]
+            docs = [
+                (Document(id=doc_id, page_content=text or "", metadata=metadata or {}), distance)
+                for doc_id, text, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            self._resolve(future, docs[:k])
@@ -0,0 +1,139 @@
+import zlib
+import asyncio
+import logging
+
+from config import WORKER_SHARDS, WORKER_SHARD, WORKER_ID, POLLER_LEASE_TTL, SHARD_QUEUE_POLL_INTERVAL
+
+
+# === Шарды пользователей ===
+def shard_of(telegram_id, shards=WORKER_SHARDS):
+    """Шард пользователя: одинаков на всех воркерах и не зависит от PYTHONHASHSEED"""
+    return zlib.crc32(str(telegram_id).encode("utf-8")) % shards
+
+
+def owns(telegram_id):
+    """Обрабатывает ли этот воркер пользователя"""
+    return shard_of(telegram_id) == WORKER_SHARD
+
+
+def update_user_id(update):
+    """Telegram id автора апдейта (для апдейтов без пользователя — id чата или 0)"""
+    if update.effective_user:
+        return update.effective_user.id
+    return update.effective_chat.id if update.effective_chat else 0
+
+
+async def _sleep_or_stop(stop, seconds):
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+# === Опрос Telegram ===
+class UpdatePoller:
+    """
+    getUpdates у бота может вызывать только один процесс, поэтому его опрашивает
+    воркер, держащий аренду poller:<тенант>. Апдейты раскладываются по очередям
+    шардов их пользователей, смещение хранится в общем хранилище. Лидер продлевает
+    аренду на каждом круге (long polling короче TTL); упавшего лидера через TTL
+    заменяет другой воркер и продолжает с сохранённого смещения. Доставка
+    «хотя бы раз»: апдейты, разложенные перед самым падением, могут повториться.
+    """
+
+    def __init__(self, store, tenant_name, bot, worker_id=WORKER_ID, ttl=POLLER_LEASE_TTL, shards=WORKER_SHARDS):
+        self.store = store
+        self.tenant_name = tenant_name
+        self.bot = bot
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.shards = shards
+        self.lease = f"poller:{tenant_name}"
+        self.leader = False
+        self.distributed = 0
+
+    async def run(self, stop):
+        try:
+            while not stop.is_set():
+                leader = await asyncio.to_thread(self.store.acquire_lease, self.lease, self.worker_id, self.ttl)
+                if leader != self.leader:
+                    logging.info(f"Воркер {self.worker_id} {'получил' if leader else 'потерял'} опрос Telegram тенанта {self.tenant_name}")
+                    self.leader = leader
+                if not leader:
+                    await _sleep_or_stop(stop, self.ttl / 3)
+                    continue
+
+                offset = await asyncio.to_thread(self.store.get, "offsets", self.tenant_name)
+                try:
+                    updates = await self.bot.get_updates(offset=offset, timeout=max(1, int(self.ttl / 3)))
+                except Exception as e:
+                    logging.warning(f"getUpdates тенанта {self.tenant_name} не удался: {e}")
+                    await _sleep_or_stop(stop, 1.0)
+                    continue
+                if updates:
+                    await asyncio.to_thread(self._distribute, updates)
+        finally:
+            if self.leader:
+                await asyncio.to_thread(self.store.release_lease, self.lease, self.worker_id)
+                self.leader = False
+
+    def _distribute(self, updates):
+        # Аренду могли перехватить, пока шёл long polling: тогда пачку разложит новый лидер
+        if not self.store.acquire_lease(self.lease, self.worker_id, self.ttl):
+            return
+        for update in updates:
+            payload = {"tenant": self.tenant_name, "update": update.to_dict()}
+            self.store.enqueue(shard_of(update_user_id(update), self.shards), "telegram", payload)
+        self.store.set("offsets", self.tenant_name, updates[-1].update_id + 1)
+        self.distributed += len(updates)
+
+
+# === Очередь шарда ===
+class ShardConsumer:
+    """
+    Забирает события своего шарда (апдейты Telegram, вебхуки Chatwoot) и передаёт
+    их handle(kind, payload). У шарда один потребитель — воркер WORKER_SHARD.
+    Пачка подтверждается, когда handle вернулся для каждого события: вебхук Chatwoot
+    к этому моменту обработан, а апдейт Telegram только положен в update_queue PTB.
+    Повторно доставляются лишь события, не переданные до падения воркера; апдейт из
+    update_queue упавшего воркера и событие, на котором handle бросил исключение
+    (оно пишется в лог), теряются — иначе одно плохое событие остановило бы шард.
+    """
+
+    def __init__(self, store, handle, shard=WORKER_SHARD, interval=SHARD_QUEUE_POLL_INTERVAL):
+        self.store = store
+        self.handle = handle
+        self.shard = shard
+        self.interval = interval
+        self.consumed = 0
+
+    async def run(self, stop):
+        while not stop.is_set():
+            events = await asyncio.to_thread(self.store.peek, self.shard)
+            for _, kind, payload in events:
+                try:
+                    await self.handle(kind, payload)
+                except Exception as e:
+                    logging.error(f"Ошибка обработки события {kind} шарда {self.shard}: {e}", exc_info=True)
+            # Подтверждение после передачи: не переданные до падения события достанутся перезапущенному
+            await asyncio.to_thread(self.store.ack, self.shard, events)
+            self.consumed += len(events)
+            if not events:
+                await _sleep_or_stop(stop, self.interval)
+
+
+# Запущенные в этом воркере (заполняется в main.py)
+pollers = []
+consumers = []
+
+
+def scale_out_stats(store):
+    return {
+        "worker_id": WORKER_ID,
+        "shard": WORKER_SHARD,
+        "shards": WORKER_SHARDS,
+        "leader_of": [poller.tenant_name for poller in pollers if poller.leader],
+        "distributed": sum(poller.distributed for poller in pollers),
+        "consumed": sum(consumer.consumed for consumer in consumers),
+        "queue_depth": {shard: store.queue_depth(shard) for shard in range(WORKER_SHARDS)},
+    }
@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import OrderedDict
+
+from config import SESSION_CACHE_TTL, SESSION_CACHE_MAX_USERS, RETRIEVAL_K
+from services.llm_client import LatencyHistogram
+from services.tenants import tenant_key
+from services.metrics import state_entries
+
+
+# === Кэш кандидатов сессии пользователя ===
+class SessionCandidateCache:
+    """
+    Хранит для каждого пользователя последний набор кандидатов после
+    реранкинга: пары (Document с id и текстом, оценка cross-encoder).
+    Для уточняющего вопроса набор переиспользуется: ищется только небольшая
+    дельта, оцениваются лишь новые пары, а старые сохраняют свои оценки.
+    """
+
+    def __init__(self, ttl=600.0, max_users=10000, max_candidates=50):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_candidates = max_candidates
+        self._sessions = OrderedDict()  # user_id -> (время, [(doc, score), ...])
+        self._lock = threading.Lock()
+
+        # Задержка получения кандидатов (поиск + реранкинг) для новых и уточняющих вопросов
+        buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+        self.cold_latency = LatencyHistogram(buckets)
+        self.followup_latency = LatencyHistogram(buckets)
+        self.rescored_pairs = 0
+        self.reused_pairs = 0
+
+    def get(self, user_id):
+        user_id = tenant_key(user_id)
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                return None
+            stored_at, candidates = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._sessions[user_id]
+                return None
+            self._sessions.move_to_end(user_id)
+            return candidates
+
+    def put(self, user_id, candidates):
+        user_id = tenant_key(user_id)
+        with self._lock:
+            self._sessions[user_id] = (time.monotonic(), list(candidates)[:self.max_candidates])
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+
+    def drop(self, user_id):
+        user_id = tenant_key(user_id)
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def merge(self, cached, scored):
+        """Объединяет закэшированные и новые пары, сортирует по оценке и обрезает до max_candidates"""
+        with self._lock:
+            self.reused_pairs += len(cached)
+            self.rescored_pairs += len(scored)
+        # Неоценённые каскадом кандидаты (оценка None) — после оценённых
+        merged = sorted(
+            list(cached) + list(scored),
+            key=lambda pair: float("-inf") if pair[1] is None else pair[1],
+            reverse=True
+        )
+        return merged[:self.max_candidates]
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "reused_pairs": self.reused_pairs,
+            "rescored_pairs": self.rescored_pairs,
+            "cold": self.cold_latency.snapshot(),
+            "followup": self.followup_latency.snapshot(),
+        }
+
+
+session_cache = SessionCandidateCache(ttl=SESSION_CACHE_TTL, max_users=SESSION_CACHE_MAX_USERS, max_candidates=RETRIEVAL_K)
+state_entries.track(lambda: len(session_cache._sessions), "session_cache")
@@ -0,0 +1,59 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# === Учёт времени запуска и готовность ===
+class StartupTracker:
+    """
+    Собирает длительность этапов запуска (этапы могут идти параллельно)
+    и хранит флаг готовности для эндпоинта /ready.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.errors = {}
+        self.ready = False
+        self.ready_after = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            raise
+        finally:
+            with self._lock:
+                self.stages[name] = {
+                    "start_s": round(started - self.started, 3),
+                    "duration_s": round(time.monotonic() - started, 3),
+                }
+
+    def mark_ready(self):
+        self.ready_after = round(time.monotonic() - self.started, 3)
+        self.ready = True
+        self.log_summary()
+
+    def status(self):
+        with self._lock:
+            return {
+                "status": "ready" if self.ready else "starting",
+                "uptime_s": round(time.monotonic() - self.started, 1),
+                "ready_after_s": self.ready_after,
+                "stages": dict(self.stages),
+                "errors": dict(self.errors),
+            }
+
+    def log_summary(self):
+        logging.info(f"Запуск завершён за {self.ready_after:.2f} секунд:")
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["start_s"]):
+            logging.info(f"  {name:<24} старт +{stage['start_s']:>7.2f} с, длительность {stage['duration_s']:>7.2f} с")
+
+
+startup = StartupTracker()
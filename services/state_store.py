@@ -0,0 +1,282 @@
+import json
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+
+from config import SCALE_OUT_ENABLED, STATE_STORE_URL
+
+
+# === Общее хранилище состояния воркеров ===
+class SQLiteStateStore:
+    """
+    Встроенное хранилище по умолчанию: один файл SQLite (WAL), общий для
+    воркеров на одной машине. Три таблицы: ключ-значение по пространствам
+    имён, аренды (lease) с временем истечения и очереди событий по шардам.
+    Значения сериализуются pickle — хранилище доступно только нашим процессам.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # executescript сам фиксирует транзакцию — схема создаётся вне _Transaction
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS kv (namespace TEXT, key TEXT, value BLOB, PRIMARY KEY (namespace, key));
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+            CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER, kind TEXT, payload TEXT);
+            CREATE INDEX IF NOT EXISTS queue_shard ON queue (shard, id);
+        """)
+
+    def _connect(self):
+        # Соединение SQLite нельзя делить между потоками — у каждого своё
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _connection(self):
+        """
+        Соединение в режиме autocommit: одиночный запрос — сам себе транзакция, чтения
+        в WAL не ждут писателей и друг друга. Для ключей-значений этого достаточно
+        """
+        return _Autocommit(self._connect())
+
+    def _transaction(self):
+        """BEGIN IMMEDIATE — для аренд и очередей, где несколько запросов должны быть атомарны"""
+        return _Transaction(self._connect())
+
+    # --- Ключ-значение ---
+    def get(self, namespace, key, default=None):
+        with self._connection() as connection:
+            row = connection.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, key, pickle.dumps(value))
+            )
+
+    def delete(self, namespace, key):
+        with self._connection() as connection:
+            return connection.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).rowcount > 0
+
+    def keys(self, namespace):
+        with self._connection() as connection:
+            return [row[0] for row in connection.execute("SELECT key FROM kv WHERE namespace = ?", (namespace,))]
+
+    def count(self, namespace):
+        with self._connection() as connection:
+            return connection.execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    # --- Аренды ---
+    def acquire_lease(self, name, owner, ttl):
+        """Берёт или продлевает аренду; True — аренда у owner до now + ttl"""
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now)
+            )
+            row = connection.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def lease_owner(self, name):
+        with self._connection() as connection:
+            row = connection.execute("SELECT owner FROM leases WHERE name = ? AND expires >= ?", (name, time.time())).fetchone()
+        return row[0] if row else None
+
+    # --- Очереди шардов ---
+    def enqueue(self, shard, kind, payload):
+        with self._transaction() as connection:
+            connection.execute("INSERT INTO queue (shard, kind, payload) VALUES (?, ?, ?)", (shard, kind, json.dumps(payload)))
+
+    def peek(self, shard, limit=50):
+        """Первые limit событий шарда [(id, kind, payload)]; удаляются только ack после обработки"""
+        with self._connection() as connection:
+            rows = connection.execute(
+                "SELECT id, kind, payload FROM queue WHERE shard = ? ORDER BY id LIMIT ?", (shard, limit)
+            ).fetchall()
+        return [(event_id, kind, json.loads(payload)) for event_id, kind, payload in rows]
+
+    def ack(self, shard, events):
+        if events:
+            with self._transaction() as connection:
+                connection.execute("DELETE FROM queue WHERE shard = ? AND id <= ?", (shard, events[-1][0]))
+
+    def queue_depth(self, shard=None):
+        with self._connection() as connection:
+            if shard is None:
+                return connection.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+            return connection.execute("SELECT COUNT(*) FROM queue WHERE shard = ?", (shard,)).fetchone()[0]
+
+
+class _Autocommit:
+    """Без явной транзакции: каждый запрос фиксируется сам (isolation_level=None)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT вокруг блока: чтение и запись очереди и аренд атомарны между процессами"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class RedisStateStore:
+    """
+    То же поверх Redis — для воркеров на разных машинах. Пакет redis
+    импортируется только при выборе этого хранилища.
+    """
+
+    # Продление аренды только её владельцем
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url, prefix="rag-bot"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._renew = self.redis.register_script(self._RENEW)
+        self._release = self.redis.register_script(self._RELEASE)
+
+    def _key(self, *parts):
+        return ":".join([self.prefix, *map(str, parts)])
+
+    def get(self, namespace, key, default=None):
+        value = self.redis.hget(self._key("kv", namespace), key)
+        return pickle.loads(value) if value is not None else default
+
+    def set(self, namespace, key, value):
+        self.redis.hset(self._key("kv", namespace), key, pickle.dumps(value))
+
+    def delete(self, namespace, key):
+        return self.redis.hdel(self._key("kv", namespace), key) > 0
+
+    def keys(self, namespace):
+        return [key.decode("utf-8") for key in self.redis.hkeys(self._key("kv", namespace))]
+
+    def count(self, namespace):
+        return self.redis.hlen(self._key("kv", namespace))
+
+    def acquire_lease(self, name, owner, ttl):
+        key = self._key("lease", name)
+        if self.redis.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        return bool(self._renew(keys=[key], args=[owner, int(ttl * 1000)]))
+
+    def release_lease(self, name, owner):
+        self._release(keys=[self._key("lease", name)], args=[owner])
+
+    def lease_owner(self, name):
+        owner = self.redis.get(self._key("lease", name))
+        return owner.decode("utf-8") if owner is not None else None
+
+    def enqueue(self, shard, kind, payload):
+        self.redis.rpush(self._key("queue", shard), json.dumps([kind, payload]))
+
+    def peek(self, shard, limit=50):
+        items = self.redis.lrange(self._key("queue", shard), 0, limit - 1)
+        return [(index, *json.loads(item)) for index, item in enumerate(items)]
+
+    def ack(self, shard, events):
+        if events:
+            self.redis.ltrim(self._key("queue", shard), len(events), -1)
+
+    def queue_depth(self, shard=None):
+        if shard is not None:
+            return self.redis.llen(self._key("queue", shard))
+        return sum(self.redis.llen(key) for key in self.redis.scan_iter(self._key("queue", "*")))
+
+
+def open_state_store(url):
+    """sqlite:///путь/к/файлу.db (по умолчанию) или redis://хост:порт/база"""
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        store = RedisStateStore(url)
+    elif url.startswith("sqlite:///"):
+        store = SQLiteStateStore(url[len("sqlite:///"):])
+    else:
+        raise ValueError(f"Неизвестное хранилище состояния: {url}")
+    logging.info(f"Хранилище состояния: {url}")
+    return store
+
+
+# === Словарь поверх хранилища ===
+class SharedDict(MutableMapping):
+    """
+    Словарь в пространстве имён хранилища. Значение читается копией:
+    изменения вложенных полей нужно записывать обратно присваиванием
+    (см. services.utils.update_user_state).
+    """
+
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+
+    @staticmethod
+    def _encode(key):
+        return json.dumps(key)
+
+    @staticmethod
+    def _decode(key):
+        key = json.loads(key)
+        return tuple(key) if isinstance(key, list) else key
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, self._encode(key), _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, self._encode(key), value)
+
+    def __delitem__(self, key):
+        if not self.store.delete(self.namespace, self._encode(key)):
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter([self._decode(key) for key in self.store.keys(self.namespace)])
+
+    def __len__(self):
+        return self.store.count(self.namespace)
+
+
+_MISSING = object()
+
+
+# Открывается только в режиме масштабирования; иначе состояние остаётся в памяти процесса
+state_store = open_state_store(STATE_STORE_URL) if SCALE_OUT_ENABLED else None
+
+
+def shared_mapping(namespace):
+    """Общий словарь воркеров в режиме масштабирования, иначе обычный dict"""
+    return SharedDict(state_store, namespace) if state_store else {}
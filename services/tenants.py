@@ -0,0 +1,145 @@
+import os
+import json
+import logging
+from contextvars import ContextVar
+from collections.abc import MutableMapping
+
+from config import TELEGRAM_BOT_TOKEN, COLLECTION_NAME, RAG_PROMPT_TEMPLATE, CHATWOOT_INBOX_ID, FAQ_PATH
+
+
+# === Тенант (жилой комплекс) ===
+class Tenant:
+    """
+    Всё, что отличает один жилой комплекс от другого: бот, коллекция Chroma,
+    промпт, инбокс Chatwoot и файл FAQ. Ретривер и индекс FAQ заполняются
+    в main.py; эмбеддер, реранкер и клиент генерации у всех тенантов общие.
+    """
+
+    def __init__(self, name, bot_token, collection_name, prompt_template=RAG_PROMPT_TEMPLATE,
+                 chatwoot_inbox_id=CHATWOOT_INBOX_ID, faq_path=FAQ_PATH):
+        if "{context}" not in prompt_template or "{question}" not in prompt_template:
+            raise ValueError(f"Промпт тенанта {name} должен содержать {{context}} и {{question}}")
+        self.name = name
+        self.bot_token = bot_token
+        self.collection_name = collection_name
+        self.prompt_template = prompt_template
+        self.prompt_prefix, self.prompt_suffix = prompt_template.split("{context}", 1)
+        self.chatwoot_inbox_id = str(chatwoot_inbox_id) if chatwoot_inbox_id else None
+        self.faq_path = faq_path
+        self.retriever = None
+        self.faq_index = None
+
+    def __repr__(self):
+        return f"Tenant({self.name}, коллекция {self.collection_name}, инбокс {self.chatwoot_inbox_id})"
+
+
+def load_tenants(path=None):
+    """
+    Список тенантов из JSON-файла:
+        [{"name": "yuzhane", "telegram_bot_token_env": "YUZHANE_BOT_TOKEN", "collection_name": "yuzhane",
+          "prompt_path": "prompts/yuzhane.txt", "chatwoot_inbox_id": 61964, "faq_path": "faq-yuzhane.json"}]
+    Токен можно задать прямо (telegram_bot_token) или именем переменной окружения.
+    Без файла — единственный тенант из переменных окружения.
+    """
+    if not path:
+        return [Tenant("default", TELEGRAM_BOT_TOKEN, COLLECTION_NAME)]
+
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    tenants = []
+    for entry in entries:
+        prompt = entry.get("prompt")
+        if entry.get("prompt_path"):
+            with open(entry["prompt_path"], encoding="utf-8") as f:
+                prompt = f.read()
+        token = entry.get("telegram_bot_token") or os.getenv(entry.get("telegram_bot_token_env", ""))
+        tenants.append(Tenant(
+            entry["name"],
+            token,
+            entry["collection_name"],
+            prompt_template=prompt or RAG_PROMPT_TEMPLATE,
+            chatwoot_inbox_id=entry.get("chatwoot_inbox_id") or CHATWOOT_INBOX_ID,
+            faq_path=entry.get("faq_path")
+        ))
+    if len({tenant.name for tenant in tenants}) != len(tenants):
+        raise ValueError(f"Имена тенантов в {path} должны быть уникальны")
+    logging.info(f"Тенанты из {path}: {', '.join(tenant.name for tenant in tenants)}")
+    return tenants
+
+
+# Все тенанты процесса (заполняется в main.py) и тенант текущего апдейта / вебхука
+tenants = []
+current_tenant = ContextVar("current_tenant", default=None)
+
+
+def tenant_for_inbox(inbox_id):
+    """Тенант по инбоксу Chatwoot; None, если инбокс не принадлежит ни одному"""
+    for tenant in tenants:
+        if inbox_id is not None and tenant.chatwoot_inbox_id == str(inbox_id):
+            return tenant
+    return None
+
+
+def current_inbox_id():
+    tenant = current_tenant.get()
+    return tenant.chatwoot_inbox_id if tenant else CHATWOOT_INBOX_ID
+
+
+def current_bot_token():
+    tenant = current_tenant.get()
+    return tenant.bot_token if tenant else TELEGRAM_BOT_TOKEN
+
+
+def tenant_key(key):
+    """Ключ, общий для процесса, но раздельный для тенантов (один пользователь может писать двум ботам)"""
+    tenant = current_tenant.get()
+    return key if tenant is None else (tenant.name, key)
+
+
+def bind_tenant(tenant, callback):
+    """Обработчик PTB, выполняющийся в контексте тенанта (asyncio-задачи и to_thread его наследуют)"""
+    async def wrapped(update, context):
+        token = current_tenant.set(tenant)
+        try:
+            return await callback(update, context)
+        finally:
+            current_tenant.reset(token)
+    return wrapped
+
+
+# === Состояние пользователей по тенантам ===
+class TenantScopedDict(MutableMapping):
+    """
+    Словарь, ключи которого неявно дополняются текущим тенантом: код, который
+    пишет user_states[user_id], в разных ботах видит разные записи. Без
+    тенанта (бенчмарки, один комплекс без main.py) работает как обычный dict.
+    backing — где лежат записи (по умолчанию dict процесса).
+    """
+
+    def __init__(self, backing=None):
+        self._data = {} if backing is None else backing
+
+    def __getitem__(self, key):
+        return self._data[tenant_key(key)]
+
+    def __setitem__(self, key, value):
+        self._data[tenant_key(key)] = value
+
+    def __delitem__(self, key):
+        del self._data[tenant_key(key)]
+
+    def __iter__(self):
+        tenant = current_tenant.get()
+        for key in list(self._data):
+            if tenant is None:
+                yield key
+            elif isinstance(key, tuple) and key[0] == tenant.name:
+                yield key[1]
+
+    def __len__(self):
+        # Без тенанта (метрики, /admin/memory) — размер всего хранилища: у SharedDict это один
+        # COUNT, а не выборка всех ключей. Записи одного тенанта приходится перебирать
+        if current_tenant.get() is None:
+            return len(self._data)
+        return sum(1 for _ in self)
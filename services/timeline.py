@@ -0,0 +1,81 @@
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from services.metrics import timed, stage_seconds, stage_errors
+from services.tracing import span
+
+
+# === Таймлайн этапов обработки сообщения ===
+class Timeline:
+    """
+    Записывает старт и длительность этапов одного запроса относительно его
+    начала. Этапы могут идти параллельно (asyncio-задачи), поэтому в логе
+    видно, какие из них перекрылись.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = []  # (этап, старт, длительность) в секундах
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        except Exception:
+            stage_errors.inc(name)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            self.stages.append((name, started - self.started, duration))
+            stage_seconds.observe(duration, name)
+
+    async def run(self, name, awaitable):
+        """Выполняет awaitable как этап таймлайна (удобно для asyncio.create_task)"""
+        with self.stage(name):
+            return await awaitable
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        return {
+            "total_ms": round(self.elapsed * 1000, 1),
+            "stages": [
+                {"stage": name, "start_ms": round(start * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+                for name, start, duration in sorted(self.stages, key=lambda item: item[1])
+            ],
+        }
+
+    def log(self):
+        lines = [f"Таймлайн {self.name}: всего {self.elapsed * 1000:.0f} мс"]
+        for name, start, duration in sorted(self.stages, key=lambda item: item[1]):
+            lines.append(f"  {name:<18} +{start * 1000:>7.0f} мс, {duration * 1000:>7.0f} мс")
+        logging.info("\n".join(lines))
+
+
+# Таймлайн текущего сообщения; asyncio-задачи наследуют его из контекста
+current_timeline = ContextVar("current_timeline", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Этап текущего таймлайна; без таймлайна (вебхук, бенчмарки) пишется только в метрики"""
+    timeline = current_timeline.get()
+    if timeline is None:
+        with timed(name), span(name):
+            yield
+        return
+    with timeline.stage(name):
+        yield
+
+
+async def run_stage(name, awaitable):
+    """Выполняет awaitable как этап текущего таймлайна"""
+    with stage(name):
+        return await awaitable
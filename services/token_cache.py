@@ -0,0 +1,134 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# === Кэш токенизации чанков для cross-encoder ===
+def content_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def truncate_pair(first, second, budget):
+    """
+    Обрезка пары по стратегии truncation="longest_first": токены снимаются
+    с более длинной последовательности, при равенстве — со второй. Быстрые
+    (Rust) токенизаторы при нечётном остатке могут разойтись на один токен.
+    """
+    over = len(first) + len(second) - budget
+    if over <= 0:
+        return first, second
+    len_first, len_second = len(first), len(second)
+    if len_first > len_second:
+        cut = min(over, len_first - len_second)
+        len_first -= cut
+        over -= cut
+    elif len_second > len_first:
+        cut = min(over, len_second - len_first)
+        len_second -= cut
+        over -= cut
+    if over:
+        len_second -= (over + 1) // 2
+        len_first -= over // 2
+    return first[:len_first], second[:len_second]
+
+
+class CachedTokenCrossEncoder:
+    """
+    Обёртка над CrossEncoder / OnnxCrossEncoder: токены чанков кэшируются по
+    хэшу содержимого, при запросе токенизируется только вопрос, а входы пар
+    собираются из кэшированных id со специальными токенами и обрезкой.
+    """
+
+    def __init__(self, cross_encoder, cache_size=20000, batch_size=32):
+        self.cross_encoder = cross_encoder
+        self.tokenizer = cross_encoder.tokenizer
+        self.max_length = min(getattr(cross_encoder, "max_length", None) or self.tokenizer.model_max_length, 512)
+        self.budget = self.max_length - self.tokenizer.num_special_tokens_to_add(pair=True)
+        self.pad_id = self.tokenizer.pad_token_id or 0
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Статистика для логов и бенчмарков
+        self.hits = 0
+        self.misses = 0
+        self.tokenize_time = 0.0
+
+    def _tokenize(self, text):
+        return self.tokenizer(text, add_special_tokens=False, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def _document_ids(self, text):
+        key = content_hash(text)
+        with self._lock:
+            ids = self._cache.get(key)
+            if ids is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return ids
+        ids = self._tokenize(text)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = ids
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ids
+
+    def warm(self, texts):
+        """Заранее токенизирует чанки коллекции"""
+        for text in texts:
+            self._document_ids(text)
+
+    def _encode(self, pairs):
+        started = time.perf_counter()
+        question_ids = {}
+        rows = []
+        for question, document in pairs:
+            if question not in question_ids:
+                question_ids[question] = self._tokenize(question)
+            first, second = truncate_pair(question_ids[question], self._document_ids(document), self.budget)
+            input_ids = self.tokenizer.build_inputs_with_special_tokens(first, second)
+            token_type_ids = self.tokenizer.create_token_type_ids_from_sequences(first, second)
+            rows.append((input_ids, token_type_ids))
+
+        width = max(len(input_ids) for input_ids, _ in rows)
+        features = {
+            "input_ids": np.full((len(rows), width), self.pad_id, dtype=np.int64),
+            "attention_mask": np.zeros((len(rows), width), dtype=np.int64),
+            "token_type_ids": np.zeros((len(rows), width), dtype=np.int64),
+        }
+        for i, (input_ids, token_type_ids) in enumerate(rows):
+            features["input_ids"][i, :len(input_ids)] = input_ids
+            features["attention_mask"][i, :len(input_ids)] = 1
+            features["token_type_ids"][i, :len(token_type_ids)] = token_type_ids
+        self.tokenize_time += time.perf_counter() - started
+        return features
+
+    def _score(self, features):
+        if hasattr(self.cross_encoder, "score_features"):
+            return self.cross_encoder.score_features(features)
+
+        import torch
+        model = self.cross_encoder.model
+        tensors = {name: torch.from_numpy(value).to(model.device) for name, value in features.items()}
+        if "token_type_ids" not in self.tokenizer.model_input_names:
+            tensors.pop("token_type_ids")
+        with torch.no_grad():
+            logits = model(**tensors).logits
+            scores = self.cross_encoder.default_activation_function(logits)
+        scores = scores.cpu().numpy()
+        return scores[:, 0] if scores.shape[1] == 1 else scores
+
+    def predict(self, pairs, batch_size=None, **kwargs):
+        pairs = list(pairs)
+        batch_size = batch_size or self.batch_size
+        scores = [self._score(self._encode(pairs[i:i + batch_size])) for i in range(0, len(pairs), batch_size)]
+        return np.concatenate(scores) if scores else np.array([])
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
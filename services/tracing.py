@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+from config import (
+    TRACING_ENABLED,
+    TRACE_FILE,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_SECONDS,
+    TRACE_MAX_BYTES,
+    TRACE_BACKUP_COUNT
+)
+
+
+# === Спаны ===
+class Span:
+    """Участок трассы: имя, родитель, время начала и длительность, атрибуты и статус"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "_started", "duration", "attributes", "status")
+
+    def __init__(self, name, trace, parent_id, attributes):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "end": round(self.start + (self.duration or 0.0), 6),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Заглушка при выключенной трассировке: атрибуты никуда не пишутся"""
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, sampled):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans = []
+
+
+# === Экспорт ===
+class TraceExporter:
+    """
+    Пишет завершённые трассы в JSONL (строка на спан) с ротацией по размеру.
+    Решение о сохранении принимается по корневому спану: случайная доля
+    sample_rate плюс все трассы дольше slow_seconds — медленные ответы не теряются.
+    """
+
+    def __init__(self, path, sample_rate=0.05, slow_seconds=10.0, max_bytes=50 * 1024 * 1024, backup_count=5):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.path = path
+        self._logger = None
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def _output(self):
+        # Файл открывается при первой сохранённой трассе
+        if self._logger is None:
+            logger = logging.getLogger("traces")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(self.path, maxBytes=self._max_bytes, backupCount=self._backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def new_trace(self):
+        return Trace(sampled=random.random() < self.sample_rate)
+
+    def finish(self, trace, root):
+        if not (trace.sampled or root.duration >= self.slow_seconds):
+            self.dropped += 1
+            return
+        with self._lock:
+            output = self._output()
+            for span in sorted(trace.spans, key=lambda span: span.start):
+                output.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+            self.exported += 1
+
+    def stats(self):
+        return {
+            "enabled": TRACING_ENABLED,
+            "file": self.path,
+            "sample_rate": self.sample_rate,
+            "slow_seconds": self.slow_seconds,
+            "exported_traces": self.exported,
+            "dropped_traces": self.dropped,
+        }
+
+
+exporter = TraceExporter(
+    TRACE_FILE,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_seconds=TRACE_SLOW_SECONDS,
+    max_bytes=TRACE_MAX_BYTES,
+    backup_count=TRACE_BACKUP_COUNT
+)
+
+# Текущий спан; asyncio-задачи и asyncio.to_thread наследуют его из контекста
+current_span = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Спан внутри текущего (или корень новой трассы). Когда завершается корень,
+    трасса отдаётся экспортёру. При выключенной трассировке ничего не создаёт.
+    """
+    if not TRACING_ENABLED:
+        yield _NOOP_SPAN
+        return
+
+    parent = current_span.get()
+    trace = parent.trace if parent else exporter.new_trace()
+    current = Span(name, trace, parent.span_id if parent else None, attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        current.finish()
+        current_span.reset(token)
+        trace.spans.append(current)
+        if parent is None:
+            exporter.finish(trace, current)
+
+
+def annotate(**attributes):
+    """Добавляет атрибуты текущему спану (если он есть)"""
+    current = current_span.get()
+    if current is not None:
+        current.set(**attributes)
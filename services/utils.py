@@ -1,24 +1,89 @@
 import re
+import threading
 import unicodedata
-from collections import deque
+from collections import deque, OrderedDict
 import logging
 from datetime import datetime
 
+from langchain_core.documents import Document
+
+from config import MESSAGE_HISTORY_LIMIT
+from services.tenants import TenantScopedDict
+from services.state_store import shared_mapping
+from services.metrics import state_entries
+
 # === Очистка текста ===
+# Один предкомпилированный проход: управляющие символы заменяются пробелом, суррогаты удаляются.
+# После удаления суррогатов строка всегда кодируется в UTF-8, поэтому encode/decode не нужен
+_DIRTY_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F\ud800-\udfff]')
+
+def _replace_dirty(match):
+    return '' if '\ud800' <= match.group() <= '\udfff' else ' '
+
 def clean_text(text):
-    cleaned = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', ' ', text)
-    cleaned = re.sub(r'[\ud800-\udfff]', '', cleaned)
-    cleaned = unicodedata.normalize('NFKC', cleaned)
-    return cleaned.encode('utf-8', 'ignore').decode('utf-8')
+    if _DIRTY_RE.search(text) is not None:
+        text = _DIRTY_RE.sub(_replace_dirty, text)
+    # Быстрый путь: уже нормализованная строка возвращается как есть
+    if text.isascii() or unicodedata.is_normalized('NFKC', text):
+        return text
+    return unicodedata.normalize('NFKC', text)
+
+# === Кэш очищенных чанков ===
+# Чанки коллекции статичны, поэтому очищенный текст запоминается по исходному тексту чанка
+# (а не по id — при переиндексации текст под тем же id мог измениться). Кэшируется только
+# строка: у чанков с одинаковым текстом (шаблонные блоки) разные id и metadata, и Document
+# каждый раз собирается с id и metadata вызывающего
+_cleaned_documents = OrderedDict()
+_cleaned_documents_lock = threading.Lock()
+CLEANED_DOCUMENTS_CACHE_SIZE = 50000
+
+def clean_document(doc):
+    """Возвращает Document с очищенным текстом; очистка повторяющегося текста берётся из кэша"""
+    key = doc.page_content
+    with _cleaned_documents_lock:
+        cleaned_text = _cleaned_documents.get(key)
+        if cleaned_text is not None:
+            _cleaned_documents.move_to_end(key)
+    if cleaned_text is None:
+        cleaned_text = clean_text(key)
+        with _cleaned_documents_lock:
+            _cleaned_documents[key] = cleaned_text
+            if len(_cleaned_documents) > CLEANED_DOCUMENTS_CACHE_SIZE:
+                _cleaned_documents.popitem(last=False)
+    return Document(id=getattr(doc, "id", None), page_content=cleaned_text, metadata=doc.metadata)
+
+# Состояние пользователей ниже раздельно для каждого тенанта (см. TenantScopedDict).
+# В режиме масштабирования user_states и user_message_history лежат в общем хранилище:
+# их значения читаются копией, изменения записываются присваиванием (update_user_state).
+# История вопросов и порядок чанков остаются в памяти воркера, владеющего шардом пользователя
 
 # === Словарь для хранения истории вопросов пользователей ===
-user_question_history = {}
+user_question_history = TenantScopedDict()
 
 # === Словарь для хранения полной истории сообщений ===
-user_message_history = {}  # user_id -> [{"role": "user/bot", "text": "...", "timestamp": datetime}]
+user_message_history = TenantScopedDict(shared_mapping("user_message_history"))  # user_id -> [{"role": "user/bot", "text": "...", "timestamp": datetime}]
+
+# === Порядок чанков в последнем промпте (переиспользование KV-кэша сервера генерации) ===
+user_context_order = TenantScopedDict()  # user_id -> [page_content, ...]
 
 # === Отслеживание состояния пользователей ===
-user_states = {}  # user_id -> {'with_agent': True/False, 'conversation_id': chatwoot_conv_id}
+user_states = TenantScopedDict(shared_mapping("user_states"))  # user_id -> {'with_agent': True/False, 'conversation_id': chatwoot_conv_id}
+
+# Размеры структур в /metrics (считаются при запросе метрик)
+for _name, _structure in (
+    ("user_question_history", user_question_history),
+    ("user_message_history", user_message_history),
+    ("user_context_order", user_context_order),
+    ("user_states", user_states),
+    ("cleaned_documents", _cleaned_documents),
+):
+    state_entries.track(_structure.__len__, _name)
+
+def update_user_state(user_id, **changes):
+    """Меняет поля состояния пользователя и записывает его обратно (нужно для общего хранилища)"""
+    state = user_states[user_id]
+    state.update(changes)
+    user_states[user_id] = state
 
 # === Проверка контекстности запроса ===
 def is_contextual_followup(user_id, new_q, reranker):
@@ -36,19 +101,18 @@ def is_contextual_followup(user_id, new_q, reranker):
 # === Добавление сообщения в историю ===
 def add_message_to_history(user_id, role, text):
     """
-    Добавляет сообщение в историю пользователя
+    Добавляет сообщение в историю пользователя; хранятся последние MESSAGE_HISTORY_LIMIT
     :param user_id: ID пользователя
     :param role: 'user' или 'bot'
     :param text: текст сообщения
     """
-    if user_id not in user_message_history:
-        user_message_history[user_id] = []
-    
-    user_message_history[user_id].append({
+    history = user_message_history.get(user_id, [])
+    history.append({
         "role": role,
         "text": text,
         "timestamp": datetime.now()
     })
+    user_message_history[user_id] = history[-MESSAGE_HISTORY_LIMIT:]
 
 # === Получение истории сообщений в формате для передачи ===
 def get_formatted_history(user_id, max_messages=20):
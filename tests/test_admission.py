@@ -0,0 +1,66 @@
+"""Допуск к RAG: шумный тенант не забирает очередь и лимиты остальных"""
+import asyncio
+from types import SimpleNamespace
+
+from services.admission import AdmissionController, UserRateLimiter
+from services.tenants import current_tenant
+
+NOISY, QUIET = SimpleNamespace(name="noisy"), SimpleNamespace(name="quiet")
+
+
+async def acquire_as(admission, tenant, log, label):
+    current_tenant.set(tenant)
+    admitted = await admission.acquire()
+    log.append((label, admitted))
+    return admitted
+
+
+def test_noisy_tenant_does_not_starve_others():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=2)
+        log = []
+        assert await acquire_as(admission, NOISY, log, "noisy-0")
+        noisy = [asyncio.create_task(acquire_as(admission, NOISY, log, f"noisy-{i}")) for i in (1, 2, 3)]
+        await asyncio.sleep(0)
+        # Очередь шумного тенанта полна, но тихий тенант в свою очередь встаёт
+        assert ("noisy-3", False) in log
+        quiet = asyncio.create_task(acquire_as(admission, QUIET, log, "quiet-1"))
+        await asyncio.sleep(0)
+        assert admission.stats()["queue_by_tenant"] == {"noisy": 2, "quiet": 1}
+
+        # Слоты раздаются по кругу: после первого шумного — тихий, а не второй шумный
+        for _ in range(3):
+            admission.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(quiet, *noisy)
+        return [label for label, admitted in log if admitted]
+
+    assert asyncio.run(scenario()) == ["noisy-0", "noisy-1", "quiet-1", "noisy-2"]
+
+
+def test_cancelled_waiter_leaves_tenant_queue():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, max_queue=2)
+        log = []
+        await acquire_as(admission, NOISY, log, "noisy-0")
+        waiter = asyncio.create_task(acquire_as(admission, QUIET, log, "quiet-1"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert admission.queue_length == 0 and admission.stats()["queue_by_tenant"] == {}
+        admission.release()
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_is_per_tenant():
+    limiter = UserRateLimiter(rate_per_minute=0.0, burst=1)
+    token = current_tenant.set(NOISY)
+    try:
+        assert limiter.allow(42)[0]
+        assert not limiter.allow(42)[0]
+        current_tenant.set(QUIET)
+        assert limiter.allow(42)[0]
+    finally:
+        current_tenant.reset(token)
@@ -0,0 +1,43 @@
+"""FAQ: формулировки и входящий вопрос кодируются одинаково — порог не зависит от префиксов e5"""
+import json
+
+import pytest
+
+from config import FAQ_THRESHOLD
+from services.faq import FaqIndex
+from benchmarks.common import HashEmbeddings
+
+
+class PrefixedEmbeddings(HashEmbeddings):
+    """Как e5: запрос и документ получают разные префиксы перед кодированием"""
+
+    def embed_documents(self, texts):
+        return [self._embed(f"passage: {text}") for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(f"query: {text}")
+
+
+@pytest.fixture
+def faq_index(tmp_path):
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps([
+        {"questions": ["где находится офис продаж", "адрес офиса продаж"], "answer": "Офис продаж — в доме 1."},
+        {"questions": ["есть ли подземный паркинг"], "answer": "Да, на 240 машиномест."},
+    ], ensure_ascii=False), encoding="utf-8")
+    return FaqIndex(str(path), PrefixedEmbeddings(), threshold=FAQ_THRESHOLD, reload_interval=3600)
+
+
+def test_exact_question_scores_one(faq_index):
+    answer, score = faq_index.match("Есть ли подземный паркинг")
+    assert answer == "Да, на 240 машиномест."
+    assert score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_paraphrase_matches_and_unrelated_question_does_not(faq_index):
+    # Те же слова в другом порядке — для эмбеддера по мешку слов это перефразировка без потери сходства
+    answer, score = faq_index.match("Офис продаж где находится")
+    assert answer == "Офис продаж — в доме 1." and score >= FAQ_THRESHOLD
+
+    answer, score = faq_index.match("Когда сдача первой очереди")
+    assert answer is None and score < FAQ_THRESHOLD
@@ -0,0 +1,19 @@
+"""Слот llama.cpp для пользователя не должен совпадать с выбором реплики"""
+import zlib
+from collections import Counter
+
+from services.rag_service import generation_hints
+
+
+def test_slots_spread_across_users_of_one_replica():
+    replicas, slots = 2, 4
+    users = [user_id for user_id in range(1000, 3000) if zlib.crc32(str(user_id).encode("utf-8")) % replicas == 0]
+    used = Counter(generation_hints(user_id, cache_prompt=False, slot_count=slots)["id_slot"] for user_id in users)
+    assert set(used) == set(range(slots))
+    # Ни один слот не берёт на себя заметно больше своей доли пользователей реплики
+    assert max(used.values()) < 1.5 * len(users) / slots
+
+
+def test_slot_is_stable_for_user():
+    assert generation_hints(42, cache_prompt=True, slot_count=4) == generation_hints(42, cache_prompt=True, slot_count=4)
+    assert generation_hints(42, cache_prompt=False, slot_count=0) == {}
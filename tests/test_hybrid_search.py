@@ -0,0 +1,53 @@
+"""Гибридный поиск: BM25 вне цикла событий и перестройка индекса после пополнения коллекции"""
+import time
+import asyncio
+import threading
+
+from services.hybrid_search import BM25Index, HybridRetriever
+from benchmarks.common import HashEmbeddings, MemoryVectorStore
+
+
+class NoDense:
+    def get_relevant_documents(self, query, k=None):
+        return []
+
+    async def aget_relevant_documents(self, query, k=None):
+        return []
+
+
+def make_store():
+    return MemoryVectorStore(HashEmbeddings(), ["Офис продаж в доме 1", "Подземный паркинг на 240 мест"])
+
+
+def test_bm25_runs_off_event_loop():
+    store = make_store()
+    retriever = HybridRetriever(NoDense(), BM25Index.from_collection(store.collection))
+    search, threads = retriever.bm25_index.search, []
+
+    def recording_search(query, k=50):
+        threads.append(threading.current_thread())
+        return search(query, k)
+
+    retriever.bm25_index.search = recording_search
+    docs = asyncio.run(retriever.aget_relevant_documents("паркинг"))
+    assert [doc.page_content for doc in docs] == ["Подземный паркинг на 240 мест"]
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_index_rebuilt_when_collection_grows():
+    store = make_store()
+    retriever = HybridRetriever(NoDense(), BM25Index.from_collection(store.collection), collection=store.collection, refresh_interval=0.01)
+    assert retriever.get_relevant_documents("ипотека") == []
+
+    # ingest.py дописал чанк в коллекцию
+    collection = store.collection
+    collection.ids.append("2")
+    collection.documents.append("Ипотека от 6% для семей с детьми")
+    collection.metadatas.append({})
+
+    time.sleep(0.02)
+    retriever.get_relevant_documents("ипотека")  # замечает новый размер и перестраивает в фоне
+    started = time.monotonic()
+    while len(retriever.bm25_index.documents) < 3 and time.monotonic() - started < 5:
+        time.sleep(0.01)
+    assert [doc.page_content for doc in retriever.get_relevant_documents("ипотека")] == ["Ипотека от 6% для семей с детьми"]
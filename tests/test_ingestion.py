@@ -0,0 +1,75 @@
+"""Загрузка документов: один битый файл не останавливает загрузку и не разбирается при каждом продолжении"""
+from concurrent.futures import ThreadPoolExecutor
+
+from services.ingestion import iter_parsed, IngestionState, Ingestor
+
+
+class FakeCollection:
+    """Подмножество API коллекции Chroma, которым пользуется Ingestor"""
+
+    def __init__(self):
+        self.items = {}
+
+    def get(self, ids=None, where=None, include=()):
+        if ids is not None:
+            return {"ids": [doc_id for doc_id in ids if doc_id in self.items]}
+        return {"ids": [doc_id for doc_id, item in self.items.items() if item["source"] == where["source"]]}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for doc_id, metadata in zip(ids, metadatas):
+            self.items[doc_id] = metadata
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.items.pop(doc_id)
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[0.0] for _ in texts]
+
+
+def make_sources(tmp_path):
+    good = tmp_path / "prices.html"
+    good.write_text("<html><body><p>Стоимость квадратного метра в доме 2 — 180 000 рублей.</p></body></html>")
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf at all")
+    return str(good), str(broken)
+
+
+def ingest(state, sources):
+    ingestor = Ingestor(FakeCollection(), FakeEmbeddings(), state, batch_size=8)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for source, chunks, error in iter_parsed(executor, sources, 1000, 150, window=2):
+            if error is None:
+                ingestor.add(source, chunks)
+            else:
+                ingestor.fail(source, error)
+    ingestor.flush()
+    return ingestor
+
+
+def test_broken_file_is_reported_and_skipped_on_resume(tmp_path):
+    good, broken = make_sources(tmp_path)
+    state_path = str(tmp_path / "state.json")
+    ingestor = ingest(IngestionState(state_path), [broken, good])
+
+    summary = ingestor.summary()
+    assert summary["files_failed"] == 1
+    assert summary["chunks"] == 1
+    assert ingestor.files_failed == [broken]
+
+    # Продолжение: оба файла записаны в состояние, битый помечен ошибкой
+    state = IngestionState(state_path)
+    assert state.is_current(good) and not state.is_failed(good)
+    assert state.is_current(broken) and state.is_failed(broken)
+
+
+def test_changed_broken_file_is_parsed_again(tmp_path):
+    good, broken = make_sources(tmp_path)
+    state_path = str(tmp_path / "state.json")
+    ingest(IngestionState(state_path), [broken])
+
+    with open(broken, "w", encoding="utf-8") as f:
+        f.write("исправленный файл, но всё ещё не PDF")
+    assert not IngestionState(state_path).is_current(broken)
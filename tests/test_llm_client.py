@@ -0,0 +1,182 @@
+"""Клиент генерации против локальных фейковых эндпоинтов с внедрённой медлительностью и отказами"""
+import time
+
+import pytest
+
+from services.llm_client import GenerationClient, GenerationError, CircuitOpenError
+from benchmarks.common import FakeEndpoint
+
+PAYLOAD = {"prompt": "Сколько квартир в доме?", "max_new_tokens": 16}
+
+
+@pytest.fixture
+def endpoint():
+    endpoint = FakeEndpoint(base_delay=0.01, tail_rate=0.0)
+    yield endpoint
+    endpoint.server.shutdown()
+
+
+def make_client(endpoints, **kwargs):
+    options = dict(connect_timeout=1.0, read_timeout=2.0, total_timeout=5.0, max_retries=0, retry_backoff=0.05)
+    options.update(kwargs)
+    return GenerationClient(endpoints, **options)
+
+
+def test_generate_returns_content(endpoint):
+    client = make_client(endpoint.url)
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert client.stats()["attempts"] == 1
+
+
+def test_read_timeout_on_hanging_endpoint(endpoint):
+    endpoint.mode = "hang"
+    client = make_client(endpoint.url, read_timeout=0.3)
+    started = time.perf_counter()
+    with pytest.raises(GenerationError) as error:
+        client.generate(PAYLOAD)
+    assert error.value.retryable
+    assert time.perf_counter() - started < 2.0
+
+
+def test_total_timeout_bounds_retries(endpoint):
+    endpoint.mode = "hang"
+    client = make_client(endpoint.url, read_timeout=0.3, total_timeout=0.8, max_retries=10, breaker_failures=100)
+    started = time.perf_counter()
+    with pytest.raises(GenerationError):
+        client.generate(PAYLOAD)
+    assert time.perf_counter() - started < 1.5
+
+
+def test_retry_goes_to_other_replica():
+    failing, healthy = FakeEndpoint(base_delay=0.01, tail_rate=0.0), FakeEndpoint(base_delay=0.01, tail_rate=0.0)
+    failing.mode = "error"
+    try:
+        client = make_client(f"{failing.url},{healthy.url}", max_retries=1)
+        assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+        assert (failing.hits, healthy.hits) == (1, 1)
+        assert client.stats()["retries"] == 1
+    finally:
+        failing.server.shutdown()
+        healthy.server.shutdown()
+
+
+def test_breaker_opens_and_recovers_after_half_open_probe(endpoint):
+    client = make_client(endpoint.url, breaker_failures=2, breaker_reset=0.3)
+    breaker = client.endpoints[0].breaker
+    endpoint.mode = "error"
+    for _ in range(2):
+        with pytest.raises(GenerationError):
+            client.generate(PAYLOAD)
+    assert breaker.state == "open"
+
+    # Разомкнутый автомат отклоняет запрос, не обращаясь к эндпоинту
+    hits = endpoint.hits
+    with pytest.raises(CircuitOpenError):
+        client.generate(PAYLOAD)
+    assert endpoint.hits == hits
+    assert client.stats()["short_circuited"] == 1
+
+    # После reset_timeout — один пробный запрос; его успех замыкает автомат
+    endpoint.mode = "ok"
+    time.sleep(0.35)
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert breaker.state == "closed"
+
+
+def test_failed_half_open_probe_reopens_breaker(endpoint):
+    client = make_client(endpoint.url, breaker_failures=1, breaker_reset=0.2)
+    breaker = client.endpoints[0].breaker
+    endpoint.mode = "error"
+    with pytest.raises(GenerationError):
+        client.generate(PAYLOAD)
+    time.sleep(0.25)
+    with pytest.raises(GenerationError):
+        client.generate(PAYLOAD)
+    assert breaker.state == "open"
+
+    endpoint.mode = "ok"
+    time.sleep(0.25)
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert breaker.state == "closed"
+
+
+def test_invalid_response_body_does_not_wedge_half_open_breaker(endpoint):
+    """Ответ не в JSON во время пробного запроса: автомат снова размыкается, а не ждёт пробу вечно"""
+    client = make_client(endpoint.url, breaker_failures=1, breaker_reset=0.2)
+    breaker = client.endpoints[0].breaker
+    endpoint.mode = "garbage"
+    with pytest.raises(GenerationError) as error:
+        client.generate(PAYLOAD)
+    assert error.value.retryable
+    assert breaker.state == "open"
+
+    time.sleep(0.25)
+    with pytest.raises(GenerationError):
+        client.generate(PAYLOAD)
+    assert breaker.state == "open"
+
+    endpoint.mode = "ok"
+    time.sleep(0.25)
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert breaker.state == "closed"
+
+
+def test_hedged_request_beats_slow_primary(endpoint):
+    endpoint.tail_delay = 1.0
+    client = make_client(endpoint.url, pool_size=4, hedge_enabled=True, hedge_min_delay=0.05, hedge_min_samples=5, hedge_max_ratio=1.0)
+    for _ in range(5):
+        client.generate(PAYLOAD)
+
+    # Следующий запрос застревает в хвосте — дубль отвечает раньше
+    endpoint.tail_rate = 1.0
+    endpoint.random.random = iter([0.0, 1.0]).__next__
+    started = time.perf_counter()
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert time.perf_counter() - started < 0.8
+    assert client.stats()["hedge_wins"] == 1
+
+
+def test_least_loaded_selection_respects_weights():
+    heavy, light = FakeEndpoint(base_delay=0.01, tail_rate=0.0), FakeEndpoint(base_delay=0.01, tail_rate=0.0)
+    try:
+        client = make_client(f"{heavy.url} 2, {light.url}")
+        # Запросы не отпускаются: каждый следующий идёт на реплику с меньшей загрузкой in_flight / вес
+        acquired = [client._acquire() for _ in range(6)]
+        assert [endpoint.url for endpoint in acquired].count(heavy.url) == 4
+        assert [endpoint.in_flight for endpoint in client.endpoints] == [4, 2]
+        for endpoint in acquired:
+            client._release(endpoint)
+        assert [endpoint.in_flight for endpoint in client.endpoints] == [0, 0]
+    finally:
+        heavy.server.shutdown()
+        light.server.shutdown()
+
+
+def test_unhealthy_endpoint_is_ejected_and_returned_after_probe():
+    first, second = FakeEndpoint(base_delay=0.01, tail_rate=0.0), FakeEndpoint(base_delay=0.01, tail_rate=0.0)
+    try:
+        client = make_client(f"{first.url} 2, {second.url}")
+        first.mode = "down"
+        assert client.probe(client.endpoints[0]) is False
+        for _ in range(3):
+            assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+        assert (first.hits, second.hits) == (0, 3)
+
+        first.mode = "ok"
+        assert client.probe(client.endpoints[0]) is True
+        assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+        assert first.hits == 1
+    finally:
+        first.server.shutdown()
+        second.server.shutdown()
+
+
+def test_last_endpoint_is_used_even_when_probe_fails(endpoint):
+    """Единственный сервер ещё загружает модель: проверка здоровья падает, но запросы идут"""
+    client = make_client(endpoint.url)
+    endpoint.mode = "error"
+    assert client.probe(client.endpoints[0]) is False
+
+    endpoint.mode = "ok"
+    assert client.generate(PAYLOAD) == "Ответ фейковой модели"
+    assert endpoint.hits == 1
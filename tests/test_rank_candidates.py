@@ -0,0 +1,55 @@
+"""Реранкинг под дедлайном: обрезанные кандидаты не пропадают, брошенный реранкинг останавливается"""
+import time
+import asyncio
+
+from langchain_core.documents import Document
+
+from services import rag_service
+from services.deadline import Deadline, PairCostEstimator
+from services.rag_service import rank_candidates
+
+
+class SlowReranker:
+    """Оценка пары — пауза pair_seconds; чем раньше документ в выдаче, тем ниже оценка"""
+
+    def __init__(self, pair_seconds=0.0):
+        self.pair_seconds = pair_seconds
+        self.pairs = 0
+
+    def predict(self, pairs, **kwargs):
+        time.sleep(self.pair_seconds * len(pairs))
+        self.pairs += len(pairs)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+def make_docs(count):
+    return [Document(page_content=f"Чанк номер {i}") for i in range(count)]
+
+
+def test_truncated_rerank_keeps_cut_candidates_in_retrieval_order(monkeypatch):
+    estimator = PairCostEstimator()
+    estimator.observe(1.0, 10)  # 0.1 с на пару: в бюджет 0.65 с влезает 6 пар
+    monkeypatch.setattr(rag_service, "rerank_cost", estimator)
+    deadline = Deadline(30, {"rerank": 0.65})
+    reranker = SlowReranker()
+
+    ranked = asyncio.run(rank_candidates("вопрос", make_docs(10), reranker, deadline))
+
+    assert reranker.pairs == 6
+    assert [doc.page_content for doc, _ in ranked] == [f"Чанк номер {i}" for i in (5, 4, 3, 2, 1, 0, 6, 7, 8, 9)]
+    assert [score for _, score in ranked[6:]] == [None] * 4
+    assert deadline.degradations == ["rerank_truncated"]
+
+
+def test_timed_out_rerank_stops_scoring(monkeypatch):
+    monkeypatch.setattr(rag_service, "rerank_cost", PairCostEstimator())
+    deadline = Deadline(30, {"rerank": 0.1})
+    reranker = SlowReranker(pair_seconds=0.005)  # порция из 32 пар — 0.16 с
+
+    ranked = asyncio.run(rank_candidates("вопрос", make_docs(320), reranker, deadline))
+    assert all(score is None for _, score in ranked) and len(ranked) == 320
+    assert deadline.degradations == ["rerank_timeout"]
+
+    # Брошенный поток досчитывает начатую порцию и дальше не оценивает
+    time.sleep(0.5)
+    assert reranker.pairs == 32
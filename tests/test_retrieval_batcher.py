@@ -0,0 +1,83 @@
+"""Пакетный поиск: отмена запросов и сбои пакета не останавливают поток батчера"""
+import asyncio
+import threading
+
+import pytest
+
+from services.retrieval_batcher import RetrievalBatcher
+from benchmarks.common import HashEmbeddings, MemoryVectorStore, synthetic_chunks
+
+
+class BlockingCollection:
+    """Коллекция, чей query ждёт release — пакет «в полёте», пока тест что-то делает"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def query(self, **kwargs):
+        self.entered.set()
+        assert self.release.wait(5)
+        return self.collection.query(**kwargs)
+
+
+@pytest.fixture
+def store():
+    return MemoryVectorStore(HashEmbeddings(), synthetic_chunks(50))
+
+
+def test_cancel_while_batch_in_flight_keeps_batcher_alive(store):
+    collection = BlockingCollection(store.collection)
+    batcher = RetrievalBatcher(collection, store.embeddings, k=5, window_ms=0, workers=1)
+    future = batcher.submit("Есть ли подземный паркинг?")
+    assert collection.entered.wait(5)
+    future.cancel()
+    collection.release.set()
+
+    assert len(future.result(timeout=5)) == 5
+    assert len(batcher.search_with_scores("Где находится офис продаж?")) == 5
+    assert all(worker.is_alive() for worker in batcher._workers)
+
+
+def test_cancelled_asyncio_caller_does_not_break_batch(store):
+    collection = BlockingCollection(store.collection)
+    batcher = RetrievalBatcher(collection, store.embeddings, k=5, window_ms=0, workers=1)
+
+    async def scenario():
+        task = asyncio.create_task(batcher.aget_relevant_documents("Когда сдача первой очереди?"))
+        await asyncio.to_thread(collection.entered.wait, 5)
+        task.cancel()
+        collection.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await batcher.aget_relevant_documents("Какая высота потолков в квартирах?")
+
+    assert len(asyncio.run(scenario())) == 5
+    assert all(worker.is_alive() for worker in batcher._workers)
+
+
+def test_request_cancelled_before_dispatch_is_skipped(store):
+    collection = BlockingCollection(store.collection)
+    batcher = RetrievalBatcher(collection, store.embeddings, k=5, window_ms=0, workers=1)
+    first = batcher.submit("Есть ли подземный паркинг?")
+    assert collection.entered.wait(5)
+    waiting = batcher.submit("Какие планировки есть в доме 2?")
+    assert waiting.cancel()
+    collection.release.set()
+
+    assert len(first.result(timeout=5)) == 5
+    assert len(batcher.search_with_scores("Где находится офис продаж?")) == 5
+    assert batcher.queries == 2
+
+
+def test_malformed_result_fails_batch_not_worker(store):
+    class Broken:
+        def query(self, **kwargs):
+            return {}
+
+    batcher = RetrievalBatcher(Broken(), store.embeddings, k=5, window_ms=0, workers=1)
+    with pytest.raises(KeyError):
+        batcher.search_with_scores("Есть ли подземный паркинг?")
+    batcher.collection = store.collection
+    assert len(batcher.search_with_scores("Есть ли подземный паркинг?")) == 5
@@ -1,9 +1,19 @@
+import math
 import logging
 import json
 import traceback
 import requests
-from flask import Flask, request, jsonify
-from config import TELEGRAM_BOT_TOKEN, CHATWOOT_ENABLED
+from flask import Flask, Response, request, jsonify
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_URL,
+    CHATWOOT_ENABLED,
+    SCALE_OUT_ENABLED,
+    WEBHOOK_PORT,
+    ADMIN_TOKEN,
+    PROFILE_MAX_SECONDS,
+    MEMORY_INTROSPECTION_ENABLED
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,6 +28,19 @@ app = Flask(__name__)
 
 # Состояния пользователей импортируются из services.utils
 from services.utils import user_states
+from services.startup import startup
+from services.llm_client import generation_client
+from services import faq
+from services.session_cache import session_cache
+from services.deadline import degradation_stats
+from services.admission import admission
+from services.tenants import tenants, current_tenant, tenant_for_inbox, current_bot_token
+from services.state_store import state_store
+from services.scale_out import shard_of, owns, scale_out_stats
+from services.metrics import registry, timed, stage_errors
+from services.tracing import span, exporter
+from services.profiler import profiler, folded, top_functions
+from services import memory
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
@@ -26,21 +49,69 @@ def webhook():
         data = request.get_json(force=True, silent=True) or {}
         logger.info("\n--- Webhook от Chatwoot ---")
         logger.info(json.dumps(data, indent=2))
-        
+
+        # Пользователь другого шарда: событие обработает воркер, владеющий им
+        telegram_id = telegram_id_of(data)
+        if SCALE_OUT_ENABLED and telegram_id and not owns(telegram_id):
+            state_store.enqueue(shard_of(telegram_id), "chatwoot", data)
+            logger.info(f"Вебхук пользователя {telegram_id} передан шарду {shard_of(telegram_id)}")
+            return jsonify({"status": "routed", "shard": shard_of(telegram_id)}), 200
+
+        return dispatch_webhook(data)
+
+    except Exception as e:
+        logger.error(f"Ошибка в webhook: {str(e)}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 200
+
+def dispatch_webhook(data):
+    """Обработка вебхука в этом воркере (из запроса или из очереди шарда) — корневой спан трассы"""
+    conversation_id = (data.get("conversation") or {}).get("id")
+    with span("webhook", event=data.get("event"), conversation_id=conversation_id) as webhook_span:
+        response = handle_event(data)
+        webhook_span.set(result=response[0].get_json().get("status"))
+        return response
+
+def handle_event(data):
+    # Тенант (жилой комплекс) — по инбоксу разговора: от него зависят бот и состояние пользователей
+    tenant_token = None
+    if len(tenants) > 1:
+        tenant = tenant_for_inbox(inbox_of(data))
+        if tenant is None:
+            logger.warning(f"Инбокс {inbox_of(data)} не принадлежит ни одному тенанту")
+            return jsonify({"status": "unknown_inbox"}), 200
+        tenant_token = current_tenant.set(tenant)
+    elif tenants:
+        tenant_token = current_tenant.set(tenants[0])
+
+    try:
         # Обработка изменения статуса разговора
         if data.get("event") == "conversation_status_changed":
             return handle_status_change(data)
-        
+
         # Обработка сообщений
         if data.get("event") in ["message_created", "message.created"]:
             return handle_message(data)
-        
-        logger.info("Webhook не содержит известных событий для обработки")
-        return jsonify({"status": "ignored"}), 200
-        
-    except Exception as e:
-        logger.error(f"Ошибка в webhook: {str(e)}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 200
+    finally:
+        if tenant_token is not None:
+            current_tenant.reset(tenant_token)
+
+    logger.info("Webhook не содержит известных событий для обработки")
+    return jsonify({"status": "ignored"}), 200
+
+def process_routed_webhook(data):
+    """Вебхук, переданный другим воркером через очередь шарда"""
+    with app.app_context():
+        response = dispatch_webhook(data)
+    logger.info(f"Переданный вебхук обработан: {response[0].get_json().get('status')}")
+
+def inbox_of(data):
+    """Инбокс Chatwoot из вебхука (у сообщений — inbox.id, у разговора — inbox_id)"""
+    return (data.get("inbox") or {}).get("id") or (data.get("conversation") or {}).get("inbox_id") or data.get("inbox_id")
+
+def telegram_id_of(data):
+    """Telegram ID пользователя разговора из meta.sender.identifier"""
+    sender = ((data.get("conversation") or {}).get("meta") or {}).get("sender") or {}
+    return extract_telegram_id_from_identifier(sender.get("identifier"))
 
 def extract_telegram_id_from_identifier(identifier):
     """Извлекает Telegram ID из строки формата 'telegram:ID'"""
@@ -190,7 +261,7 @@ def handle_message(data):
 def send_telegram_message(chat_id, message):
     """Отправляет сообщение в Telegram"""
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        url = f"{TELEGRAM_API_URL}/bot{current_bot_token()}/sendMessage"
         data = {
             "chat_id": chat_id,
             "text": f"Оператор: {message}",
@@ -198,13 +269,16 @@ def send_telegram_message(chat_id, message):
         }
         
         logger.info(f"Отправка в Telegram API: chat_id={chat_id}, текст={message[:50]}...")
-        response = requests.post(url, json=data)
+        with timed("telegram_send"), span("telegram_send", chat_id=chat_id) as send_span:
+            response = requests.post(url, json=data)
+            send_span.set(http_status=response.status_code)
         response_data = response.json()
         
         if response.status_code == 200 and response_data.get("ok"):
             logger.info("Сообщение успешно отправлено в Telegram")
             return True
         else:
+            stage_errors.inc("telegram_send")
             logger.error(f"Telegram API ответил с ошибкой: {response.status_code} - {response.text}")
             return False
     except Exception as e:
@@ -215,11 +289,125 @@ def send_telegram_message(chat_id, message):
 def test():
     return "Webhook server is running!", 200
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Готовность бота: 200 после загрузки моделей и подключений, до этого 503 с ходом запуска"""
+    status = startup.status()
+    return jsonify(status), 200 if startup.ready else 503
+
+@app.route('/stats/llm', methods=['GET'])
+def llm_stats():
+    """Счётчики и гистограммы задержек клиента генерации, состояние автомата"""
+    return jsonify(generation_client.stats()), 200
+
+@app.route('/stats/session', methods=['GET'])
+def session_stats():
+    """Задержка получения кандидатов для новых и уточняющих вопросов, переиспользованные пары"""
+    return jsonify(session_cache.stats()), 200
+
+@app.route('/stats/faq', methods=['GET'])
+def faq_stats():
+    """Доля вопросов, закрытых ответами из FAQ, по всем тенантам и по каждому (с задержкой поиска)"""
+    indexes = [(tenant.name, tenant.faq_index) for tenant in tenants if tenant.faq_index]
+    if not indexes and faq.faq_index:
+        indexes = [("default", faq.faq_index)]
+    stats = faq.aggregate_stats(indexes)
+    if stats is None:
+        return jsonify({"status": "disabled"}), 200
+    return jsonify(stats), 200
+
+@app.route('/stats/deadline', methods=['GET'])
+def deadline_stats():
+    """Сколько ответов ушло с деградациями ради дедлайна и с какими"""
+    return jsonify(degradation_stats.stats()), 200
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    """Длина очереди к RAG, сброшенные запросы по причинам и время ожидания допуска"""
+    return jsonify(admission.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в текстовом формате Prometheus: этапы, ошибки, очереди, размеры состояния"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/stats/tracing', methods=['GET'])
+def tracing_stats():
+    """Сохранённые и отброшенные трассы, файл и доля сэмплирования"""
+    return jsonify(exporter.stats()), 200
+
+def admin_allowed():
+    """Административные эндпоинты доступны только с ADMIN_TOKEN в заголовке X-Admin-Token"""
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+def query_number(name, default, cast=float):
+    """Неотрицательный числовой параметр запроса; ValueError — ответ 400"""
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f"Параметр {name} должен быть числом, получено {raw!r}")
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"Параметр {name} должен быть неотрицательным числом, получено {raw!r}")
+    return value
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    Сэмплирующий CPU-профиль процесса за seconds секунд (по умолчанию 10):
+    свёрнутые стеки для flamegraph.pl / speedscope или, с format=json, топ функций.
+    """
+    if not admin_allowed():
+        return jsonify({"status": "forbidden"}), 403
+    try:
+        seconds = min(query_number("seconds", 10.0), PROFILE_MAX_SECONDS)
+        interval = max(query_number("interval", 0.01), 0.001)
+    except ValueError as e:
+        return jsonify({"status": "bad_request", "message": str(e)}), 400
+    include_idle = request.args.get("idle", "false").lower() in ("1", "true", "yes")
+    logger.info(f"Профилирование процесса: {seconds} с, интервал {interval * 1000:.0f} мс")
+    profile = profiler.capture(seconds, interval=interval, include_idle=include_idle)
+    if profile is None:
+        return jsonify({"status": "busy", "message": "Профилирование уже идёт"}), 409
+    if request.args.get("format") == "json":
+        return jsonify({"samples": profile["samples"], "seconds": seconds, "top": top_functions(profile)}), 200
+    return Response(folded(profile), mimetype="text/plain; charset=utf-8")
+
+@app.route('/admin/memory', methods=['GET'])
+def admin_memory():
+    """
+    Память процесса: RSS, записи и размер структур состояния и кэшей, веса моделей
+    и (allocations=1, по умолчанию) строки кода с наибольшим ростом аллокаций с
+    прошлого вызова. stop=1 останавливает tracemalloc.
+    """
+    if not MEMORY_INTROSPECTION_ENABLED:
+        return jsonify({"status": "disabled"}), 404
+    if not admin_allowed():
+        return jsonify({"status": "forbidden"}), 403
+    if request.args.get("stop", "").lower() in ("1", "true", "yes"):
+        memory.allocation_tracker.stop()
+        return jsonify({"status": "stopped"}), 200
+    allocations = request.args.get("allocations", "true").lower() in ("1", "true", "yes")
+    try:
+        top = query_number("top", 20, cast=int)
+    except ValueError as e:
+        return jsonify({"status": "bad_request", "message": str(e)}), 400
+    return jsonify(memory.memory_report(top=top, allocations=allocations)), 200
+
+@app.route('/stats/workers', methods=['GET'])
+def workers_stats():
+    """Шард этого воркера, опрос каких ботов он ведёт и глубина очередей шардов"""
+    if not SCALE_OUT_ENABLED:
+        return jsonify({"enabled": False}), 200
+    return jsonify(scale_out_stats(state_store)), 200
+
 def run_webhook_server():
     """Запускает Flask-сервер для обработки вебхуков"""
     logger.info("=" * 80)
-    logger.info("Запуск Flask-сервера для вебхуков на порту 5011")
+    logger.info(f"Запуск Flask-сервера для вебхуков на порту {WEBHOOK_PORT}")
     logger.info(f"Chatwoot интеграция {'ВКЛЮЧЕНА' if CHATWOOT_ENABLED else 'ОТКЛЮЧЕНА'}")
     logger.info(f"Telegram токен {'настроен' if TELEGRAM_BOT_TOKEN else 'НЕ настроен'}")
     logger.info("=" * 80)
-    app.run(host='0.0.0.0', port=5011, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=WEBHOOK_PORT, debug=False)
\ No newline at end of file